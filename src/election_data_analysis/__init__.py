@@ -4,6 +4,7 @@ from election_data_analysis import munge as m
 from sqlalchemy.orm import sessionmaker
 from typing import List, Dict, Optional
 import datetime
+import time
 import os
 import pandas as pd
 import ntpath
@@ -13,6 +14,7 @@ from election_data_analysis import analyze as a
 from election_data_analysis import visualize as viz
 from election_data_analysis import juris_and_munger as jm
 from election_data_analysis import preparation as prep
+from election_data_analysis import result_cache as rc
 
 # constants
 sdl_pars_req = [
@@ -50,6 +52,19 @@ optional_mdl_pars = [
     "unloaded_dir",
 ]
 
+# tables whose non-unique indexes are dropped during a bulk load
+bulk_load_deferred_tables = ["VoteCount"]
+
+# tables whose planner statistics are refreshed after a load, if enough rows changed
+#  (see database.analyze_stale_tables)
+analyze_after_load_tables = [
+    "VoteCount",
+    "CandidateSelection",
+    "ReportingUnit",
+    "ComposingReportingUnitJoin",
+    "_vote_count_rollup",
+]
+
 prep_pars = [
     "name",
     "abbreviated_name",
@@ -90,6 +105,9 @@ class DataLoader:
             header="election_data_analysis",
         )
 
+        # timings and row counts from the most recent load_all
+        self.load_metrics = dict()
+
         # create db if it does not already exist and have right tables
         err = db.create_db_if_not_ok()
 
@@ -112,14 +130,20 @@ class DataLoader:
             print("Exiting")
             quit()
         else:
+            # bring any older database up to date
+            for e in db.upgrade_database(self.engine):
+                print(e)
             return
 
     def change_db(self, new_db_name: str):
         """Changes the database into which the data is loaded, including reconnecting"""
         self.d["dbname"] = new_db_name
         self.session.close()
-        self.connect_to_db(dbname=new_db_name)
-        db.create_db_if_not_ok(dbname=new_db_name)
+        # release pooled connections, which would keep the db from being re-created from the template
+        self.engine.dispose()
+        # create the db first, since connecting brings it up to date
+        err = db.create_db_if_not_ok(dbname=new_db_name)
+        self.connect_to_db(dbname=new_db_name, err=err)
         return
 
     def change_dir(self, dir_param: str, new_dir: str):
@@ -127,16 +151,102 @@ class DataLoader:
         self.d[dir_param] = new_dir
         return
 
+    def slim_vote_count(self) -> Optional[dict]:
+        """Converts VoteCount in a database created before it referred to OtherCountItemType
+        by Id (see database.slim_vote_count), reporting its size before and after. VoteCount is
+        rewritten, and locked meanwhile. Returns an error dictionary (or None)"""
+        sizes, e = db.slim_vote_count(self.engine)
+        if e:
+            return ui.add_new_error(None, "system", "DataLoader.slim_vote_count", e)
+        if sizes:
+            print(
+                f"VoteCount (with indexes) took {sizes[0] / 2 ** 20:.1f} MB before conversion "
+                f"and {sizes[1] / 2 ** 20:.1f} MB after"
+            )
+        else:
+            print(f"VoteCount in {self.engine.url.database} needed no conversion")
+        return None
+
     def load_all(
         self,
         load_jurisdictions: bool = True,
         move_files: bool = True,
         election_jurisdiction_list: Optional[list] = None,
+        bulk_load: bool = False,
     ) -> (Optional[dict], bool):
         """Processes all .ini files in the DataLoader's results directory.
         By default, loads (or reloads) the info from the jurisdiction files
         into the db first. By default, moves files to the DataLoader's archive directory.
+        If <bulk_load> is True (e.g., when filling a new database), the non-unique indexes on
+        VoteCount are dropped for the duration of the load and rebuilt, in parallel, afterwards.
+        Afterwards, planner statistics are refreshed for any of analyze_after_load_tables with many
+        changed rows. Timings and changed-row counts are recorded in self.load_metrics.
         Returns a post-reporting error dictionary, and a flag to indicate whether all loaded successfully"""
+        err = None
+        start = time.perf_counter()
+        before = db.table_change_counts(self.engine, analyze_after_load_tables)
+
+        index_defs = list()
+        if bulk_load:
+            index_defs, e = db.drop_deferrable_indexes(self.engine, bulk_load_deferred_tables)
+            if e:
+                err = ui.add_new_error(err, "warn-system", "DataLoader.load_all", e)
+        try:
+            new_err, success = self.load_all_files(
+                load_jurisdictions=load_jurisdictions,
+                move_files=move_files,
+                election_jurisdiction_list=election_jurisdiction_list,
+                refresh_rollups=not bulk_load,
+            )
+            err = ui.consolidate_errors([err, new_err])
+        finally:
+            # rebuild indexes even if the load failed
+            e = db.rebuild_indexes(self.engine, index_defs) if bulk_load else None
+        if e:
+            err = ui.add_new_error(err, "system", "DataLoader.load_all", e)
+            success = False
+
+        # bring the VoteCount summary up to date for any files not already done
+        #  (all of them, in bulk-load mode, so the summaries can use the rebuilt indexes)
+        n, e = db.refresh_vote_count_rollup(self.engine)
+        if e:
+            err = ui.add_new_error(err, "warn-system", "DataLoader.load_all", e)
+        # invalidate cached results that don't depend on a particular election
+        #  (e.g., lists of reporting units from newly loaded jurisdictions)
+        e = db.record_data_change(self.engine, [])
+        if e:
+            err = ui.add_new_error(err, "warn-system", "DataLoader.load_all", e)
+        load_seconds = time.perf_counter() - start
+
+        # refresh planner statistics where the load changed many rows
+        after = db.table_change_counts(self.engine, analyze_after_load_tables)
+        analyze_seconds, e = db.analyze_stale_tables(self.engine, analyze_after_load_tables)
+        if e:
+            err = ui.add_new_error(err, "warn-system", "DataLoader.load_all", e)
+
+        self.load_metrics = {
+            "load_seconds": load_seconds,
+            "rows_changed": {
+                t: after[t]["changed"] - before[t]["changed"] for t in analyze_after_load_tables
+            },
+            "analyze_seconds": analyze_seconds,
+        }
+        if analyze_seconds:
+            print(
+                "Refreshed planner statistics: "
+                + ", ".join(f"{t} ({sec:.1f}s)" for t, sec in analyze_seconds.items())
+            )
+        return err, success
+
+    def load_all_files(
+        self,
+        load_jurisdictions: bool = True,
+        move_files: bool = True,
+        election_jurisdiction_list: Optional[list] = None,
+        refresh_rollups: bool = True,
+    ) -> (Optional[dict], bool):
+        """Does the work of load_all (without any index management).
+        If not <refresh_rollups>, VoteCount summaries are left for the caller to refresh."""
         # initialize error dictionary and success flag
         err = None
         success = True
@@ -272,7 +382,7 @@ class DataLoader:
                 # if no fatal error from SDL initialization, continue
                 else:
                     # try to load data
-                    load_error = sdl.load_results()
+                    load_error = sdl.load_results(refresh_rollup=refresh_rollups)
                     if load_error:
                         err = ui.consolidate_errors([err, load_error])
 
@@ -327,17 +437,33 @@ class DataLoader:
         connection = self.session.bind.raw_connection()
         cursor = connection.cursor()
 
-        # find all datafile ids matching the given election and jurisdiction
+        # find all datafiles matching the given election and jurisdiction
         df_list, err_str = db.data_file_list(
-            cursor, election_id, reporting_unit_id=juris_id
+            cursor, election_id, reporting_unit_id=juris_id, by="short_name"
         )
+        cursor.close()
+        connection.close()
         if err_str:
             return err_str
+        if not df_list:
+            return None
 
-        # remove data from all those datafiles
-        for idx in df_list:
-            db.remove_vote_counts(connection, cursor, idx, active_confirm)
-        return None
+        if active_confirm:
+            confirm = input(
+                f"Confirm: delete all VoteCount data from these results files: {df_list} (y/n)?"
+            )
+            if confirm != "y":
+                return "Deletion not confirmed by user"
+
+        # remove data from all those datafiles at once
+        counts, err_str = db.remove_datafiles(
+            self.session.bind, election_id=election_id, juris_id=juris_id
+        )
+        if not err_str:
+            print(
+                f"{counts['VoteCount']} VoteCounts deleted from {counts['_datafile']} results files"
+            )
+        return err_str
 
 
 class SingleDataLoader:
@@ -458,14 +584,13 @@ class SingleDataLoader:
         )
         data = m.clean_strings(data, ["short_name"])
         try:
-            e = db.insert_to_cdf_db(self.session.bind, data, "_datafile")
+            data, e = db.upsert_and_return_ids(
+                self.session.bind, data, "_datafile", ["short_name"]
+            )
             if e:
                 return [0, 0], e
             else:
-                col_map = {"short_name": "short_name"}
-                datafile_id = db.append_id_to_dframe(
-                    self.session.bind, data, "_datafile", col_map=col_map
-                ).iloc[0]["_datafile_Id"]
+                datafile_id = data.iloc[0]["_datafile_Id"]
         except Exception as exc:
             return (
                 [0, 0],
@@ -473,8 +598,10 @@ class SingleDataLoader:
             )
         return {"_datafile_Id": datafile_id, "Election_Id": election_id}, e
 
-    def load_results(self) -> dict:
-        """Load results, returning error (or None, if load successful)"""
+    def load_results(self, refresh_rollup: bool = True) -> dict:
+        """Load results, returning error (or None, if load successful).
+        If <refresh_rollup>, the VoteCount summary for the file is recomputed afterwards
+        (otherwise it is left marked out of date, e.g., for refresh at the end of a bulk load)"""
         err = None
         print(f'\n\nProcessing {self.d["results_file"]}')
 
@@ -490,6 +617,13 @@ class SingleDataLoader:
             return err
 
         else:
+            # summary of VoteCounts from this file is out of date until the load is done
+            e = db.invalidate_vote_count_rollup(
+                self.session.bind, int(results_info["_datafile_Id"])
+            )
+            if e:
+                err = ui.add_new_error(err, "warn-system", "SingleDataLoader.load_results", e)
+
             if self.d["aux_data_dir"] is None:
                 aux_data_path = None
             else:
@@ -563,6 +697,28 @@ class SingleDataLoader:
                 )
                 if new_err:
                     err = ui.consolidate_errors([err, new_err])
+
+            if refresh_rollup:
+                n, e = db.refresh_vote_count_rollup(
+                    self.session.bind, [int(results_info["_datafile_Id"])]
+                )
+                if e:
+                    err = ui.add_new_error(err, "warn-system", "SingleDataLoader.load_results", e)
+
+            # recompute any saved candidate vote counts this election-jurisdiction affects
+            juris_id = db.name_to_id(
+                self.session, "ReportingUnit", self.d["top_reporting_unit"]
+            )
+            n, e = db.refresh_candidate_votecounts(
+                self.session.bind, int(results_info["Election_Id"]), juris_id
+            )
+            if e:
+                err = ui.add_new_error(err, "warn-system", "SingleDataLoader.load_results", e)
+
+            # invalidate cached results for the election
+            e = db.record_data_change(self.session.bind, [int(results_info["Election_Id"])])
+            if e:
+                err = ui.add_new_error(err, "warn-system", "SingleDataLoader.load_results", e)
         return err
 
 
@@ -1455,9 +1611,10 @@ class Analyzer:
         if not param_file:
             param_file = "run_time.ini"
 
-        # read rollup_directory from param_file
+        # read rollup_directory (and any result cache settings) from param_file
         d, error = ui.get_runtime_parameters(
             required_keys=["rollup_directory"],
+            optional_keys=["result_cache_size", "result_cache_dir"],
             param_file=param_file,
             header="election_data_analysis",
         )
@@ -1468,7 +1625,35 @@ class Analyzer:
         Session = sessionmaker(bind=eng)
         self.session = Session()
 
+        # databases are brought up to date only when loading (see DataLoader.connect_to_db),
+        #  since upgrading an older database can rewrite or index large tables
+        if eng and not db.has_reporting_unit_hierarchy(eng):
+            print(
+                f"Database {eng.url.database} was created by an earlier version of this package. "
+                f"Connect to it with a DataLoader (or call database.upgrade_database) to bring it up to date."
+            )
+
+        # cache results of queries (invalidated when the data changes), sharing any cache already
+        #  set up for this database
+        if d.get("result_cache_size"):
+            cache_size = int(d["result_cache_size"])
+        else:
+            cache_size = rc.default_cache_size
+        rc.configure(eng, size=cache_size, directory=d.get("result_cache_dir") or None)
+
     def display_options(self, input: str, verbose: bool = False, filters: list = None):
+        # options can change with any load, so depend on the version of the whole database
+        return rc.cached(
+            self.session.bind,
+            "display_options",
+            {"input": input, "verbose": verbose, "filters": filters},
+            [0],
+            lambda: self.display_options_uncached(input, verbose=verbose, filters=filters),
+        )
+
+    def display_options_uncached(
+        self, input: str, verbose: bool = False, filters: list = None
+    ):
         if not verbose:
             results = db.get_input_options(self.session, input, False)
         else:
@@ -1616,6 +1801,82 @@ class Analyzer:
         )
         return err
 
+    def top_counts_multilevel(
+        self,
+        election: str,
+        rollup_unit: str,
+        sub_units: List[str],
+        by_vote_type: List[bool] = [False],
+        long_format: bool = False,
+    ) -> Optional[str]:
+        """As top_counts, but for several sub_unit types (e.g., county and congressional)
+        and by_vote_type settings at once, with one query per contest type.
+        If <long_format>, all levels go into one file."""
+        rollup_unit_id = db.name_to_id(self.session, "ReportingUnit", rollup_unit)
+        sub_unit_ids = [
+            db.name_to_id(self.session, "ReportingUnitType", sub_unit) for sub_unit in sub_units
+        ]
+        election_id = db.name_to_id(self.session, "Election", election)
+        err = a.create_multilevel_rollup(
+            self.session,
+            self.rollup_directory,
+            top_ru_id=rollup_unit_id,
+            sub_rutype_ids=sub_unit_ids,
+            election_id=election_id,
+            by_vote_type=by_vote_type,
+            long_format=long_format,
+        )
+        return err
+
+
+# Analyzers shared by the top-level helper functions (aggregate_results, etc.),
+#  keyed by (absolute path of param file, dbname), each with the Id of the process that created it
+shared_analyzers: Dict[tuple, tuple] = dict()
+# Analyzers inherited from a parent process. Never used or disposed here (disposal would close
+#  the parent's connections), just kept from garbage collection, which would also close them
+inherited_analyzers: List[Analyzer] = list()
+# if this environment variable is "0", get_analyzer creates a new Analyzer for every call, as before
+#  Analyzers were shared (e.g., to compare timings; see tests/benchmark_shared_analyzer.py)
+share_analyzers_variable = "ELECTION_DATA_ANALYSIS_SHARE_ANALYZERS"
+
+
+def get_analyzer(param_file: Optional[str] = None, dbname: Optional[str] = None) -> Optional[Analyzer]:
+    """Returns the Analyzer shared by all callers in this process for the given parameter file
+    and database, creating it on first use (or None, if it cannot be created)"""
+    if not param_file:
+        param_file = "run_time.ini"
+    if os.environ.get(share_analyzers_variable) == "0":
+        return Analyzer(param_file=param_file, dbname=dbname)
+    key = (os.path.abspath(param_file), dbname)
+    pid = os.getpid()
+    if key in shared_analyzers:
+        an, creator_pid = shared_analyzers[key]
+        if creator_pid == pid:
+            # clear any transaction left over from an earlier error
+            an.session.rollback()
+            return an
+        # created before a fork, so belongs to the parent process
+        inherited_analyzers.append(an)
+        del shared_analyzers[key]
+    an = Analyzer(param_file=param_file, dbname=dbname)
+    if an:
+        shared_analyzers[key] = (an, pid)
+    return an
+
+
+def dispose_analyzers():
+    """Closes the sessions and connection pools of all Analyzers shared in this process
+    (e.g., before dropping a database they connect to)"""
+    pid = os.getpid()
+    for key, (an, creator_pid) in list(shared_analyzers.items()):
+        if creator_pid == pid:
+            an.session.close()
+            an.session.bind.dispose()
+        else:
+            inherited_analyzers.append(an)
+        del shared_analyzers[key]
+    return
+
 
 def get_filename(path: str) -> str:
     head, tail = ntpath.split(path)
@@ -1634,10 +1895,52 @@ def aggregate_results(
         exclude_redundant_total: bool = True,
 ):
     """if a vote type is given, restricts to that vote type; otherwise returns all vote types;
-    Similarly for sub_unit and contest"""
+    Similarly for sub_unit and contest. Results are cached until the election's data changes"""
+    args = {
+        "election": election,
+        "jurisdiction": jurisdiction,
+        "vote_type": vote_type,
+        "sub_unit": sub_unit,
+        "contest": contest,
+        "contest_type": contest_type,
+        "sub_unit_type": sub_unit_type,
+        "exclude_redundant_total": exclude_redundant_total,
+    }
+    an = get_analyzer(dbname=dbname)
+    if not an:
+        return pd.DataFrame(columns=["contest", "count"])
+    election_id = db.name_to_id(an.session, "Election", election)
+    if not election_id:
+        return pd.DataFrame(columns=["contest", "count"])
+    return rc.cached(
+        an.session.bind,
+        "aggregate_results",
+        args,
+        [election_id],
+        lambda: aggregate_results_uncached(dbname=dbname, analyzer=an, **args),
+    )
+
+
+def aggregate_results_uncached(
+        election,
+        jurisdiction,
+        dbname: Optional[str] = None,
+        vote_type: Optional[str] = None,
+        sub_unit: Optional[str] = None,
+        contest: Optional[str] = None,
+        contest_type: str = "Candidate",
+        sub_unit_type: str = "county",
+        exclude_redundant_total: bool = True,
+        analyzer: Optional[Analyzer] = None,
+):
+    """As aggregate_results, but always querying the database (via <analyzer>, if given,
+    otherwise via get_analyzer)"""
     # using the analyzer gives us access to DB session
     empty_df_with_good_cols = pd.DataFrame(columns=["contest", "count"])
-    an = Analyzer(dbname=dbname)
+    if analyzer is None:
+        an = get_analyzer(dbname=dbname)
+    else:
+        an = analyzer
     if not an:
         return empty_df_with_good_cols
     election_id = db.name_to_id(an.session, "Election", election)
@@ -1655,12 +1958,16 @@ def aggregate_results(
     )
     if e:
         print(e)
+        cursor.close()
+        connection.close()
         return empty_df_with_good_cols
     if len(datafile_list) == 0:
         print(
             f"No datafiles found for election {election} and jurisdiction {jurisdiction}"
             f"(election_id={election_id} and jurisdiction_id={jurisdiction_id})"
         )
+        cursor.close()
+        connection.close()
         return empty_df_with_good_cols
 
     df, err_str = db.export_rollup_from_db(
@@ -1675,6 +1982,8 @@ def aggregate_results(
         by_vote_type=True,
         contest=contest,
     )
+    cursor.close()
+    connection.close()
     if err_str or df.empty:
         return empty_df_with_good_cols
     if vote_type:
@@ -1685,7 +1994,7 @@ def aggregate_results(
 
 
 def data_exists(election, jurisdiction, p_path=None, dbname=None):
-    an = Analyzer(param_file=p_path, dbname=dbname)
+    an = get_analyzer(param_file=p_path, dbname=dbname)
     if not an:
         return False
 
@@ -1717,50 +2026,120 @@ def check_totals_match_vote_types(
 ):
     """Interesting if there are both total and other vote types;
     otherwise trivially true"""
-    an = Analyzer(dbname=dbname)
+    an = get_analyzer(dbname=dbname)
     active = db.active_vote_types(an.session, election, jurisdiction)
     if len(active) > 1 and 'total' in active:
-        # pull type 'total' only
-        df_candidate = aggregate_results(
-            election, 
-            jurisdiction, 
-            contest_type="Candidate",
-            vote_type='total',
-            sub_unit_type=sub_unit_type,
-            exclude_redundant_total=False,
-            dbname=dbname,
-        )
-        df_ballot = aggregate_results(
-            election, 
-            jurisdiction, 
-            contest_type="BallotMeasure",
-            vote_type='total',
-            sub_unit_type=sub_unit_type,
-            exclude_redundant_total=False,
-            dbname=dbname,
-        )
-        df_total_type_only = pd.concat([df_candidate, df_ballot])
-
-        df_candidate = aggregate_results(
+        # all vote types, including the redundant total, in one query
+        df = contest_totals(
             election,
             jurisdiction,
-            contest_type="Candidate",
-            sub_unit_type=sub_unit_type,
             dbname=dbname,
-        )
-        df_ballot = aggregate_results(
-            election,
-            jurisdiction,
-            contest_type="BallotMeasure",
             sub_unit_type=sub_unit_type,
-            dbname=dbname,
+            exclude_redundant_total=False,
         )
-        df_sum_nontotal_types = pd.concat([df_candidate, df_ballot])
-        return df_total_type_only["count"].sum() == df_sum_nontotal_types["count"].sum()
+        total_type_only = df[df.count_item_type == "total"]["count"].sum()
+        sum_nontotal_types = df[df.count_item_type != "total"]["count"].sum()
+        return total_type_only == sum_nontotal_types
     else:
         return True
 
 
+def contest_totals(
+        election,
+        jurisdiction,
+        dbname: Optional[str] = None,
+        sub_unit_type: str = "county",
+        contests: Optional[List[str]] = None,
+        exclude_redundant_total: bool = True,
+) -> pd.DataFrame:
+    """Returns a dataframe of total counts for each contest (or each of <contests>, if given),
+    each sub-unit of type <sub_unit_type> and each vote type, from one grouped query,
+    with columns contest, contest_type, reporting_unit, count_item_type and count"""
+    empty_df = pd.DataFrame(
+        columns=["contest", "contest_type", "reporting_unit", "count_item_type", "count"]
+    )
+    an = get_analyzer(dbname=dbname)
+    if not an:
+        return empty_df
+    connection = an.session.bind.raw_connection()
+    cursor = connection.cursor()
+    election_id = db.name_to_id_cursor(cursor, "Election", election)
+    jurisdiction_id = db.name_to_id_cursor(cursor, "ReportingUnit", jurisdiction)
+    sub_unit_type_id = db.name_to_id_cursor(cursor, "ReportingUnitType", sub_unit_type)
+    datafile_list, e = db.data_file_list(
+        cursor, election_id, reporting_unit_id=jurisdiction_id, by="Id"
+    )
+    if e or not datafile_list or not jurisdiction_id:
+        cursor.close()
+        connection.close()
+        return empty_df
+    if contests is None:
+        contest_ids = None
+    else:
+        # resolve all contest names at once
+        cursor.execute('SELECT "Id" FROM "Contest" WHERE "Name" = ANY(%s)', [list(contests)])
+        contest_ids = [x for (x,) in cursor.fetchall()]
+    df, err_str = db.contest_totals_from_ids(
+        cursor,
+        jurisdiction_id,
+        election_id,
+        sub_unit_type_id,
+        datafile_list,
+        contest_ids=contest_ids,
+        exclude_redundant_total=exclude_redundant_total,
+    )
+    cursor.close()
+    connection.close()
+    if err_str:
+        print(err_str)
+        return empty_df
+    return df
+
+
+def verify_contest_totals(
+        election,
+        jurisdiction,
+        expectations: list,
+        dbname: Optional[str] = None,
+        sub_unit_type: str = "county",
+        exclude_redundant_total: bool = True,
+        contest_type: Optional[str] = "Candidate",
+) -> pd.DataFrame:
+    """Checks many contest totals at once. Each item of <expectations> is a tuple
+    (contest, sub_unit, vote_type, expected count), where sub_unit (e.g., a county) and vote_type
+    may be None, meaning all of them -- so each gives the same total as contest_total would
+    with the same <contest_type> ("Candidate" or "BallotMeasure"). If <contest_type> is None,
+    contests of either type are totalled.
+    Returns a dataframe with one row per expectation, with columns contest, reporting_unit,
+    vote_type, expected, actual and match."""
+    comparison = pd.DataFrame(
+        expectations, columns=["contest", "reporting_unit", "vote_type", "expected"]
+    )
+    totals = contest_totals(
+        election,
+        jurisdiction,
+        dbname=dbname,
+        sub_unit_type=sub_unit_type,
+        contests=list(comparison.contest.unique()),
+        exclude_redundant_total=exclude_redundant_total,
+    )
+    actual = list()
+    for contest, sub_unit, vote_type in comparison[
+        ["contest", "reporting_unit", "vote_type"]
+    ].itertuples(index=False):
+        mask = totals.contest == contest
+        if contest_type:
+            mask &= totals.contest_type == contest_type
+        if sub_unit:
+            mask &= totals.reporting_unit == sub_unit
+        if vote_type:
+            mask &= totals.count_item_type == vote_type
+        actual.append(totals[mask]["count"].sum())
+    comparison["actual"] = actual
+    comparison["match"] = comparison.expected == comparison.actual
+    return comparison
+
+
 def contest_total(
         election,
         jurisdiction,
@@ -1810,7 +2189,7 @@ def count_type_total(election, jurisdiction, contest, count_item_type, sub_unit_
         return df["count"].sum()
 
 def check_count_types_standard(election, jurisdiction, dbname=None):
-    an = Analyzer(dbname=dbname)
+    an = get_analyzer(dbname=dbname)
     standard_ct_list = db.get_input_options(an.session,'count_item_type',False)
     # don't want type "other"
     standard_ct_list.remove("other")
@@ -11,6 +11,7 @@ import matplotlib.pyplot as plt
 from pathlib import Path
 from pandas.api.types import is_numeric_dtype
 from election_data_analysis import database as db
+from election_data_analysis import result_cache as rc
 import scipy.spatial.distance as dist
 from scipy import stats
 import math
@@ -37,6 +38,23 @@ def child_rus_by_id(session, parents, ru_type=None):
     return children
 
 
+def candidate_votecounts(session, election_id, top_ru_id, subdivision_type_id) -> pd.DataFrame:
+    """Results of database.get_candidate_votecounts, cached until the election's data changes"""
+    return rc.cached(
+        session.bind,
+        "get_candidate_votecounts",
+        {
+            "election_id": election_id,
+            "top_ru_id": top_ru_id,
+            "subdivision_type_id": subdivision_type_id,
+        },
+        [election_id],
+        lambda: db.get_candidate_votecounts(
+            session, election_id, top_ru_id, subdivision_type_id
+        ),
+    )
+
+
 def create_rollup(
     session,
     target_dir: str,
@@ -59,26 +77,13 @@ def create_rollup(
 
     connection = session.bind.raw_connection()
     cursor = connection.cursor()
-    if not datafile_list:
-        datafile_list, e = db.data_file_list(cursor, election_id, by="Id")
-        if e:
-            return e
-        by = "Id"
-        if len(datafile_list) == 0:
-            return f"No datafiles found for Election_Id {election_id}"
-    # set exclude_redundant_total
-    vote_type_list, err_str = db.vote_type_list(cursor, datafile_list, by=by)
+    datafile_ids, exclude_redundant_total, err_str = rollup_datafiles(
+        cursor, election_id, datafile_list, by=by
+    )
     if err_str:
         return err_str
-    elif len(vote_type_list) == 0:
-        return f"No vote types found for datafiles with {by} in {datafile_list} "
-
-    if len(vote_type_list) > 1 and "total" in vote_type_list:
-        exclude_redundant_total = True
-    else:
-        exclude_redundant_total = False
 
-    # get names from ids
+    # get names (for the export path) from ids
     top_ru = db.name_from_id(cursor, "ReportingUnit", top_ru_id)
     election = db.name_from_id(cursor, "Election", election_id)
     sub_rutype = db.name_from_id(cursor, "ReportingUnitType", sub_rutype_id)
@@ -109,27 +114,192 @@ def create_rollup(
                 f"There is already a file called {rollup_file}. Pick another name.\n"
             )
 
-        df, err_str = db.export_rollup_from_db(
-            cursor=cursor,
-            top_ru=top_ru,
-            sub_unit_type=sub_rutype,
+        # stream straight to the file, without holding the rollup in memory
+        err_str = db.export_rollup_to_file(
+            cursor,
+            os.path.join(leaf_dir, rollup_file),
+            top_ru_id=top_ru_id,
+            election_id=election_id,
+            sub_unit_type_id=sub_rutype_id,
             contest_type=contest_type,
-            datafile_list=datafile_list,
-            by=by,
+            datafile_ids=datafile_ids,
             exclude_redundant_total=exclude_redundant_total,
             by_vote_type=by_vote_type,
         )
         if not err_str:
             # create record for inventory.txt
             inv_df = inv_df.append(inventory, ignore_index=True).fillna("")
-            err_str = None
-            df.to_csv(os.path.join(leaf_dir, rollup_file), index=False, sep="\t")
 
     # export to inventory file
     inv_df.to_csv(inventory_file, index=False, sep="\t")
     return err_str
 
 
+def rollup_datafiles(
+    cursor, election_id: int, datafile_list: list = None, by: str = "Id"
+) -> (list, bool, str):
+    """Returns the Ids of the datafiles in <datafile_list> (entries from field <by> in _datafile;
+    all datafiles for the election if no list is given), whether the total vote type is redundant
+    for those files, and an error string"""
+    if not datafile_list:
+        datafile_list, e = db.data_file_list(cursor, election_id, by="Id")
+        if e:
+            return [], False, e
+        by = "Id"
+        if len(datafile_list) == 0:
+            return [], False, f"No datafiles found for Election_Id {election_id}"
+    # set exclude_redundant_total
+    vote_type_list, err_str = db.vote_type_list(cursor, datafile_list, by=by)
+    if err_str:
+        return [], False, err_str
+    elif len(vote_type_list) == 0:
+        return [], False, f"No vote types found for datafiles with {by} in {datafile_list} "
+
+    if len(vote_type_list) > 1 and "total" in vote_type_list:
+        exclude_redundant_total = True
+    else:
+        exclude_redundant_total = False
+
+    # the rollup queries themselves take Ids only
+    datafile_ids, err_str = db.datafile_ids_from_list(cursor, datafile_list, by=by)
+    return datafile_ids, exclude_redundant_total, err_str
+
+
+def create_multilevel_rollup(
+    session,
+    target_dir: str,
+    top_ru_id: int,
+    sub_rutype_ids: list,
+    election_id: int,
+    datafile_list: list = None,
+    by: str = "Id",
+    by_vote_type: list = [False],
+    long_format: bool = False,
+) -> str:
+    """As create_rollup, but for each of the ReportingUnitTypes in <sub_rutype_ids> and each
+    setting (True and/or False) in <by_vote_type>, all computed in one query per contest type.
+    If <long_format>, all levels go into one file in the <top_ru_id> directory, with columns
+    for the ReportingUnitType and the by_vote_type setting; otherwise each level goes into its
+    own by_<type> directory as with create_rollup, vote-type breakdowns (if totals are also
+    requested) in files ending _by_vote_type.
+    """
+    connection = session.bind.raw_connection()
+    cursor = connection.cursor()
+    try:
+        err_str = export_multilevel_rollups(
+            cursor,
+            target_dir,
+            top_ru_id,
+            sub_rutype_ids,
+            election_id,
+            datafile_list,
+            by,
+            by_vote_type,
+            long_format,
+        )
+    finally:
+        cursor.close()
+        connection.close()
+    return err_str
+
+
+def export_multilevel_rollups(
+    cursor,
+    target_dir: str,
+    top_ru_id: int,
+    sub_rutype_ids: list,
+    election_id: int,
+    datafile_list: list,
+    by: str,
+    by_vote_type: list,
+    long_format: bool,
+) -> str:
+    """Does the work of create_multilevel_rollup with the given <cursor>. Returns the errors
+    from both contest types (or None)"""
+    datafile_ids, exclude_redundant_total, err_str = rollup_datafiles(
+        cursor, election_id, datafile_list, by=by
+    )
+    if err_str:
+        return err_str
+
+    # get names (for the export paths) from ids
+    top_ru = db.name_from_id(cursor, "ReportingUnit", top_ru_id)
+    election = db.name_from_id(cursor, "Election", election_id)
+    sub_rutypes = {
+        i: db.name_from_id(cursor, "ReportingUnitType", i) for i in sub_rutype_ids
+    }
+    by_vote_type = sorted(set(by_vote_type))
+
+    # prepare inventory
+    inventory_file = os.path.join(target_dir, "inventory.txt")
+    if os.path.isfile(inventory_file):
+        inv_df = pd.read_csv(inventory_file, sep="\t")
+    else:
+        inv_df = pd.DataFrame()
+
+    err_list = list()
+    for contest_type in ["BallotMeasure", "Candidate"]:
+        base_name = f"{cursor.connection.info.dbname}_{contest_type}_results"
+        # assign a file path to each output
+        if long_format:
+            leaf_dirs = [os.path.join(target_dir, election, top_ru)]
+            file_names = {"long": os.path.join(leaf_dirs[0], f"{base_name}_multilevel.txt")}
+        else:
+            leaf_dirs = list()
+            file_names = dict()
+            for i, sub_rutype in sub_rutypes.items():
+                leaf_dir = os.path.join(target_dir, election, top_ru, f"by_{sub_rutype}")
+                leaf_dirs.append(leaf_dir)
+                for b in by_vote_type:
+                    if b and len(by_vote_type) > 1:
+                        file_names[(i, b)] = os.path.join(leaf_dir, f"{base_name}_by_vote_type.txt")
+                    else:
+                        file_names[(i, b)] = os.path.join(leaf_dir, f"{base_name}.txt")
+        for leaf_dir in leaf_dirs:
+            Path(leaf_dir).mkdir(parents=True, exist_ok=True)
+        for k, path in file_names.items():
+            while os.path.isfile(path):
+                path = os.path.join(
+                    os.path.dirname(path),
+                    input(
+                        f"There is already a file called {os.path.basename(path)}. Pick another name.\n"
+                    ),
+                )
+            file_names[k] = path
+
+        # export all levels at once
+        err_str = db.export_multilevel_rollup(
+            cursor,
+            top_ru_id,
+            election_id,
+            list(sub_rutypes.keys()),
+            contest_type,
+            datafile_ids,
+            by_vote_type=by_vote_type,
+            exclude_redundant_total=exclude_redundant_total,
+            long_out=file_names.pop("long", None),
+            level_outs=file_names,
+        )
+        if err_str:
+            err_list.append(f"{contest_type}: {err_str}")
+        else:
+            # create records for inventory.txt
+            for sub_rutype in sub_rutypes.values():
+                inventory = {
+                    "Election": election,
+                    "ReportingUnitType": sub_rutype,
+                    "source_db_url": cursor.connection.dsn,
+                    "timestamp": datetime.date.today(),
+                }
+                inv_df = inv_df.append(inventory, ignore_index=True).fillna("")
+
+    # export to inventory file
+    inv_df.to_csv(inventory_file, index=False, sep="\t")
+    if err_list:
+        return "\n".join(err_list)
+    return None
+
+
 def create_scatter(
     session,
     jurisdiction_id,
@@ -277,7 +447,7 @@ def get_data_for_scatter(
     count_type,
 ):
     # Since this could be data across 2 elections, grab data one election at a time
-    unsummed = db.get_candidate_votecounts(
+    unsummed = candidate_votecounts(
         session, election_id, jurisdiction_id, subdivision_type_id
     )
     keep_all = filter_str.startswith("All ")
@@ -348,7 +518,7 @@ def create_bar(
     connection = session.bind.raw_connection()
     cursor = connection.cursor()
 
-    unsummed = db.get_candidate_votecounts(
+    unsummed = candidate_votecounts(
         session, election_id, top_ru_id, subdivision_type_id
     )
 
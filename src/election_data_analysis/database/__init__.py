@@ -4,8 +4,13 @@
 import psycopg2
 import sqlalchemy
 import sqlalchemy.orm
+import sqlalchemy.event
+import sqlalchemy.exc
 import io
 import csv
+import uuid
+import concurrent.futures
+import time
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from pathlib import Path
 import numpy as np
@@ -18,12 +23,13 @@ import datetime
 from election_data_analysis import user_interface as ui
 from configparser import MissingSectionHeaderError
 import pandas as pd
+from pandas.api.types import is_numeric_dtype
 from election_data_analysis import munge as m
 import re
 from election_data_analysis.database import create_cdf_db as db_cdf
 import os
 from sqlalchemy import MetaData, Table, Column, Integer, Float
-from typing import Optional, List
+from typing import Optional, List, Dict, Tuple
 from election_data_analysis import user_interface as ui
 
 states = """Alabama
@@ -84,6 +90,9 @@ US Virgin Islands"""
 
 db_pars = ["host", "port", "dbname", "user", "password"]
 
+# new databases are copied from an empty CDF database named <cdf_template_prefix>_<vote count partitioning>
+cdf_template_prefix = "cdf_template"
+
 contest_types_model = [
     "state",
     "congressional",
@@ -158,56 +167,142 @@ def create_database(con, cur, db_name):
     return out1, out2
 
 
+def cdf_template(
+    con, cur, param_file: str, dirpath: str, vote_count_partitioning: str = "none"
+) -> (Optional[str], Optional[str]):
+    """Returns the name of an empty, fully built CDF database (tables, enumerations and
+    BallotMeasureSelections) to be used as a template for new databases, along with an error string
+    (or None). The template is (re)built only if it does not exist or if the schema definition
+    has changed since it was built (per the hash recorded as the template's comment).
+    <con> must be a connection to the postgres database, with autocommit. Callers should hold
+    the advisory lock on cdf_template_prefix (see create_or_reset_db), so that concurrent
+    rebuilds do not collide."""
+    name = f"{cdf_template_prefix}_{vote_count_partitioning}"
+    schema_hash = db_cdf.schema_definition_hash(dirpath, vote_count_partitioning)
+    try:
+        cur.execute(
+            "SELECT shobj_description(oid, 'pg_database') FROM pg_database WHERE datname = %s",
+            [name],
+        )
+        rows = cur.fetchall()
+        if rows and rows[0][0] == schema_hash:
+            return name, None
+
+        create_database(con, cur, name)
+        eng, err = sql_alchemy_connect(param_file, dbname=name)
+        if err:
+            return None, f"Unable to connect to template database {name}: {err}"
+        sess = sqlalchemy.orm.sessionmaker(bind=eng)()
+        db_cdf.create_common_data_format_tables(
+            sess, dirpath=dirpath, vote_count_partitioning=vote_count_partitioning
+        )
+        db_cdf.fill_standard_tables(sess, None, dirpath=dirpath)
+        sess.close()
+        # no connections to a template may remain open when it is copied
+        clear_enum_cache(eng)
+        eng.dispose()
+
+        # record the schema definition the template was built from
+        cur.execute(
+            sql.SQL("COMMENT ON DATABASE {name} IS %s").format(name=sql.Identifier(name)),
+            [schema_hash],
+        )
+        return name, None
+    except Exception as exc:
+        return None, f"Unable to build template database {name}: {exc}"
+
+
+def clone_cdf_template(cur, template: str, dbname: str) -> Optional[str]:
+    """Creates (or re-creates) database <dbname> as a copy of the database <template>.
+    Returns an error string (or None), e.g., if <dbname> is in use."""
+    try:
+        cur.execute(
+            sql.SQL("DROP DATABASE IF EXISTS {dbname}").format(dbname=sql.Identifier(dbname))
+        )
+        cur.execute(
+            sql.SQL("CREATE DATABASE {dbname} TEMPLATE {template}").format(
+                dbname=sql.Identifier(dbname), template=sql.Identifier(template)
+            )
+        )
+        return None
+    except Exception as exc:
+        return f"Unable to create {dbname} from template {template}: {exc}"
+
+
 # TODO move to more appropriate module?
-def append_to_composing_reporting_unit_join(engine, ru):
+def ancestor_names(names: List[str]) -> Dict[str, List[str]]:
+    """Returns dictionary giving, for each semicolon-nested ReportingUnit name in <names>,
+    the list of names of its ancestors, largest first and ending with the name itself.
+    Names are threaded through a trie of their components, so each ancestor name is built once."""
+    trie = dict()
+    ancestors = dict()
+    for name in names:
+        node = trie
+        path = list()
+        prefix = None
+        for part in name.split(";"):
+            if part not in node:
+                node[part] = (dict(), part if prefix is None else f"{prefix};{part}")
+            node, prefix = node[part]
+            path.append(prefix)
+        ancestors[name] = path
+    return ancestors
+
+
+def append_to_composing_reporting_unit_join(
+    engine, ru: pd.DataFrame, return_all: bool = False
+) -> pd.DataFrame:
     """<ru> is a dframe of reporting units, with cdf internal name in column 'Name'.
     cdf internal name indicates nesting via semicolons `;`.
-    This routine calculates the nesting relationships from the Names and uploads to db.
-    Returns the *all* composing-reporting-unit-join data from the db.
+    This routine calculates the nesting relationships for the reporting units in <ru>
+    from the Names and uploads them to db. Only the Ids of those reporting units and their
+    ancestors are read from the db.
+    Returns the new composing-reporting-unit-join pairs, or, if <return_all> is True,
+    *all* composing-reporting-unit-join data from the db.
     By convention, a ReportingUnit is it's own ancestor (ancestor_0)."""
-    working = ru.copy()
-    if not working.empty:
-        working["split"] = working["Name"].apply(lambda x: x.split(";"))
-        working["length"] = working["split"].apply(len)
-
-        # pull ReportingUnit to get ids matched to names
-        ru_cdf = pd.read_sql_table("ReportingUnit", engine, index_col=None)
-        ru_static = working.copy()
-
-        # add db Id column to ru_static, if it's not already there
-        if "Id" not in working.columns:
-            ru_static = ru_static.merge(ru_cdf[["Name", "Id"]], on="Name", how="left")
-
-        # create a list of rows to append to the ComposingReportingUnitJoin element
-        cruj_dframe_list = []
-        for i in range(working["length"].max()):
-            # check that all components of all Reporting Units are themselves ReportingUnits
-            ru_for_cruj = (
-                ru_static.copy()
-            )  # start fresh, without detritus from previous i
-
-            # get name of ith ancestor
-            #  E.g., ancestor_0 is largest ancestor (i.e., shortest string, often the state); ancestor_1 is the second-largest parent, etc.
-            ru_for_cruj[f"ancestor_{i}"] = ru_static["split"].apply(
-                lambda x: ";".join(x[: i + 1])
-            )
-            # get Id of ith ancestor
-            ru_for_cruj = ru_for_cruj.merge(
-                ru_cdf, left_on=f"ancestor_{i}", right_on="Name", suffixes=["", f"_{i}"]
-            )
-            cruj_dframe_list.append(
-                ru_for_cruj[["Id", f"Id_{i}"]].rename(
-                    columns={
-                        "Id": "ChildReportingUnit_Id",
-                        f"Id_{i}": "ParentReportingUnit_Id",
-                    }
-                )
-            )
-        if cruj_dframe_list:
-            cruj_dframe = pd.concat(cruj_dframe_list)
+    cruj_dframe = pd.DataFrame(
+        columns=["ParentReportingUnit_Id", "ChildReportingUnit_Id"]
+    )
+    if not ru.empty:
+        ancestors = ancestor_names(ru["Name"].unique())
+
+        # get Ids of the reporting units and all their ancestors
+        all_names = pd.DataFrame(
+            {"Name": sorted({a for path in ancestors.values() for a in path})}
+        )
+        id_map = (
+            append_id_to_dframe(engine, all_names, "ReportingUnit", {"Name": "Name"})
+            .set_index("Name")["ReportingUnit_Id"]
+            .to_dict()
+        )
+
+        # pair each reporting unit with each of its ancestors that is itself a ReportingUnit
+        pairs = [
+            (id_map[a], id_map[name])
+            for name, path in ancestors.items()
+            if id_map.get(name, 0) > 0
+            for a in path
+            if id_map.get(a, 0) > 0
+        ]
+        if pairs:
+            cruj_dframe = pd.DataFrame(
+                pairs, columns=["ParentReportingUnit_Id", "ChildReportingUnit_Id"]
+            ).astype("int64")
             insert_to_cdf_db(engine, cruj_dframe, "ComposingReportingUnitJoin")
 
-    cruj_dframe = pd.read_sql_table("ComposingReportingUnitJoin", engine)
+        # record depth and ancestor-Id path on each reporting unit
+        hierarchy = {
+            int(id_map[name]): (
+                len(path),
+                [int(id_map[a]) for a in path if id_map.get(a, 0) > 0],
+            )
+            for name, path in ancestors.items()
+            if id_map.get(name, 0) > 0
+        }
+        set_reporting_unit_hierarchy(engine, hierarchy)
+
+    if return_all:
+        cruj_dframe = pd.read_sql_table("ComposingReportingUnitJoin", engine)
 
     return cruj_dframe
 
@@ -279,8 +374,13 @@ def test_connection(paramfile="run_time.ini", dbname=None) -> (bool, dict):
 def create_or_reset_db(
     param_file: str = "run_time.ini",
     dbname: Optional[str] = None,
+    vote_count_partitioning: Optional[str] = None,
+    id_sequence_cache: Optional[int] = None,
 ) -> Optional[dict]:
-    """if no dbname is given, name will be taken from param_file"""
+    """if no dbname is given, name will be taken from param_file.
+    If no <vote_count_partitioning> (or <id_sequence_cache>) is given, it will be taken from the
+    optional vote_count_partitioning (or id_sequence_cache) parameter in the [election_data_analysis]
+    section of param_file, defaulting to "none" (or create_cdf_db.default_id_sequence_cache)"""
 
     project_root = Path(__file__).absolute().parents[1]
     params, err = ui.get_runtime_parameters(
@@ -289,6 +389,19 @@ def create_or_reset_db(
     if err:
         return err
 
+    eda_params, eda_err = ui.get_runtime_parameters(
+        required_keys=[],
+        optional_keys=["vote_count_partitioning", "id_sequence_cache"],
+        param_file=param_file,
+        header="election_data_analysis",
+    )
+    if vote_count_partitioning is None:
+        vote_count_partitioning = eda_params.get("vote_count_partitioning") or "none"
+    if id_sequence_cache is None:
+        id_sequence_cache = (
+            eda_params.get("id_sequence_cache") or db_cdf.default_id_sequence_cache
+        )
+
     # use dbname from param_file, unless another dbname was given
     if dbname is None:
         dbname = params["dbname"]
@@ -306,6 +419,34 @@ def create_or_reset_db(
         con = None  # to keep syntax-checker happy
 
     cur = con.cursor()
+    con.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    dirpath = os.path.join(project_root, "CDF_schema_def_info")
+
+    # copy an empty CDF database if possible (much faster than building the schema).
+    # Other processes creating databases wait (on the advisory lock, released when
+    #  <con> closes if not before) so that no two rebuild the template at once, and none copies it
+    #  mid-rebuild
+    cur.execute("SELECT pg_advisory_lock(hashtext(%s))", [cdf_template_prefix])
+    try:
+        template, template_err = cdf_template(
+            con, cur, param_file, dirpath, vote_count_partitioning
+        )
+        if template:
+            template_err = clone_cdf_template(cur, template, dbname)
+    finally:
+        cur.execute("SELECT pg_advisory_unlock(hashtext(%s))", [cdf_template_prefix])
+    if template and not template_err:
+        eng_new, err = sql_alchemy_connect(param_file, dbname=dbname)
+        if eng_new:
+            # enumeration Ids may change
+            clear_enum_cache(eng_new)
+            set_id_sequence_cache(eng_new, id_sequence_cache)
+            eng_new.dispose()
+        con.close()
+        return err
+
+    # otherwise (e.g., if the db is in use) build the schema in place
+    print(f"{template_err}\nBuilding database {dbname} from schema definition instead.")
     db_df = get_database_names(con)
 
     # if dbname already exists.
@@ -314,27 +455,31 @@ def create_or_reset_db(
         eng_new, err = sql_alchemy_connect(param_file, dbname=dbname)
         Session_new = sqlalchemy.orm.sessionmaker(bind=eng_new)
         sess_new = Session_new()
-        db_cdf.reset_db(
-            sess_new,
-            os.path.join(project_root, "CDF_schema_def_info"),
-        )
+        db_cdf.reset_db(sess_new, dirpath)
     else:
         create_database(con, cur, dbname)
         eng_new, err = sql_alchemy_connect(param_file, dbname=dbname)
         Session_new = sqlalchemy.orm.sessionmaker(bind=eng_new)
         sess_new = Session_new()
 
+    # enumeration Ids may change
+    clear_enum_cache(eng_new)
+
     # TODO tech debt: does reset duplicate work here?
     # load cdf tables
     db_cdf.create_common_data_format_tables(
         sess_new,
-        dirpath=os.path.join(project_root, "CDF_schema_def_info"),
+        dirpath=dirpath,
+        vote_count_partitioning=vote_count_partitioning,
     )
     db_cdf.fill_standard_tables(
         sess_new,
         None,
-        dirpath=os.path.join(project_root, "CDF_schema_def_info"),
+        dirpath=dirpath,
     )
+    set_id_sequence_cache(eng_new, id_sequence_cache)
+    sess_new.close()
+    eng_new.dispose()
     con.close()
     return err
 
@@ -361,9 +506,28 @@ def sql_alchemy_connect(
     engine = db.create_engine(
         url, client_encoding="utf8", pool_size=20, max_overflow=40
     )
+    add_fork_guard(engine)
     return engine, err
 
 
+def add_fork_guard(engine):
+    """Makes <engine> safe to use after os.fork(): a process never uses (or closes) pooled
+    connections opened by another process, but opens its own instead"""
+
+    @sqlalchemy.event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        connection_record.info["pid"] = os.getpid()
+
+    @sqlalchemy.event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        if connection_record.info["pid"] != os.getpid():
+            # detach without closing (closing would end the other process's session)
+            connection_record.connection = connection_proxy.connection = None
+            raise sqlalchemy.exc.DisconnectionError(
+                f"Connection belongs to process {connection_record.info['pid']}"
+            )
+
+
 def create_db_if_not_ok(dbname: Optional[str] = None) -> Optional[dict]:
     # create db if it does not already exist and have right tables
     ok, err = test_connection(dbname=dbname)
@@ -372,6 +536,490 @@ def create_db_if_not_ok(dbname: Optional[str] = None) -> Optional[dict]:
     return err
 
 
+def set_reporting_unit_hierarchy(engine, hierarchy: Dict[int, Tuple[int, List[int]]]):
+    """<hierarchy> maps ReportingUnit Ids to pairs (depth, path), where path is the list of
+    Ids of ancestors, largest first, ending with the ReportingUnit's own Id.
+    Updates the depth and path columns of ReportingUnit in one statement. If the path of any
+    ReportingUnit that already had one changes, everything derived from the paths is marked out
+    of date in the same transaction (see invalidate_reporting_unit_hierarchy)."""
+    if not hierarchy:
+        return
+    ids = list(hierarchy.keys())
+    # old.path is the path before the update
+    q = sql.SQL(
+        """UPDATE "ReportingUnit" ru SET depth = v.depth, path = v.path::integer[]
+        FROM unnest(%s::integer[], %s::integer[], %s::text[]) AS v(id, depth, path),
+            "ReportingUnit" old
+        WHERE ru."Id" = v.id AND old."Id" = ru."Id"
+        AND (ru.depth IS DISTINCT FROM v.depth OR ru.path IS DISTINCT FROM v.path::integer[])
+        RETURNING old.path IS NOT NULL"""
+    )
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    cursor.execute(
+        q,
+        [
+            ids,
+            [hierarchy[k][0] for k in ids],
+            [f'{{{",".join(str(x) for x in hierarchy[k][1])}}}' for k in ids],
+        ],
+    )
+    if any(had_path for (had_path,) in cursor.fetchall()):
+        invalidate_reporting_unit_hierarchy(cursor)
+    connection.commit()
+    cursor.close()
+    connection.close()
+    return
+
+
+def upgrade_database(engine) -> List[str]:
+    """Brings a database created by an earlier version of this package up to date (see each
+    step). Cheap if nothing needs doing, but the first run on an older database may rewrite or
+    index large tables, so this is called when loading (see DataLoader.connect_to_db), never
+    when only reading. Returns a list of error strings, one for each failed step."""
+    err_list = list()
+    for step in [
+        # ReportingUnit depth and path
+        add_reporting_unit_hierarchy,
+        # VoteCount Ids from their own sequence
+        add_table_id_sequences,
+        # derived tables (VoteCount summary, saved candidate vote counts, data versions)
+        add_derived_tables,
+        # composite covering indices on VoteCount
+        add_vote_count_covering_indexes,
+        # OtherCountItemType in its own lookup table (checked only: see slim_vote_count)
+        check_vote_count_is_slim,
+    ]:
+        e = step(engine)
+        if e:
+            err_list.append(e)
+    return err_list
+
+
+def has_reporting_unit_hierarchy(engine) -> bool:
+    """True if ReportingUnit has the depth and path columns (see add_reporting_unit_hierarchy)"""
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    col_list, type_map = get_column_names(cursor, "ReportingUnit")
+    cursor.close()
+    connection.close()
+    return "depth" in col_list and "path" in col_list
+
+
+def add_reporting_unit_hierarchy(engine) -> Optional[str]:
+    """Brings databases created before ReportingUnit had depth and path columns up to date:
+    adds the columns and their indices if necessary and fills them for any ReportingUnit
+    lacking them (from Names and ComposingReportingUnitJoin). Cheap if nothing needs doing.
+    Returns an error string (or None)."""
+    q_add = sql.SQL(
+        """ALTER TABLE "ReportingUnit" ADD COLUMN IF NOT EXISTS depth integer,
+            ADD COLUMN IF NOT EXISTS path integer[];
+        CREATE INDEX IF NOT EXISTS "ReportingUnit_depth_idx" ON "ReportingUnit" (depth);
+        CREATE INDEX IF NOT EXISTS "ReportingUnit_path_idx" ON "ReportingUnit" USING gin (path);"""
+    )
+    q_fill = sql.SQL(
+        """UPDATE "ReportingUnit" ru
+        SET depth = ARRAY_LENGTH(regexp_split_to_array(ru."Name", ';'), 1),
+            path = COALESCE(
+                (
+                    SELECT ARRAY_AGG(p."Id" ORDER BY ARRAY_LENGTH(regexp_split_to_array(p."Name", ';'), 1))
+                    FROM "ComposingReportingUnitJoin" cruj
+                    JOIN "ReportingUnit" p ON cruj."ParentReportingUnit_Id" = p."Id"
+                    WHERE cruj."ChildReportingUnit_Id" = ru."Id"
+                ),
+                -- a unit with no recorded parents is its own whole path
+                ARRAY[ru."Id"]
+            )
+        WHERE ru.depth IS NULL OR ru.path IS NULL"""
+    )
+    try:
+        connection = engine.raw_connection()
+    except Exception as exc:
+        return f"Unable to add depth and path to ReportingUnit table: {exc}"
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            """SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_schema = 'public' AND table_name = 'ReportingUnit'
+            AND column_name IN ('depth', 'path')"""
+        )
+        if cursor.fetchall()[0][0] < 2:
+            cursor.execute(q_add)
+        cursor.execute(q_fill)
+        if cursor.rowcount > 0:
+            # anything derived so far was computed without these paths
+            invalidate_reporting_unit_hierarchy(cursor)
+        connection.commit()
+        err_str = None
+    except Exception as exc:
+        connection.rollback()
+        err_str = f"Unable to add depth and path to ReportingUnit table: {exc}"
+    cursor.close()
+    connection.close()
+    return err_str
+
+
+def vote_count_is_slim(cursor) -> bool:
+    """True if VoteCount refers to OtherCountItemType by Id (see slim_vote_count)"""
+    cursor.execute(
+        """SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = 'VoteCount'
+        AND column_name = 'OtherCountItemType'"""
+    )
+    return cursor.fetchall()[0][0] == 0
+
+
+def vote_count_size(cursor) -> int:
+    """Bytes on disk taken by VoteCount, including its partitions, indexes and TOAST"""
+    cursor.execute(
+        """WITH RECURSIVE tree AS (
+            SELECT '"VoteCount"'::regclass::oid AS relid
+            UNION ALL
+            SELECT inh.inhrelid FROM pg_inherits inh JOIN tree ON inh.inhparent = tree.relid
+        )
+        SELECT COALESCE(SUM(pg_total_relation_size(relid)), 0) FROM tree"""
+    )
+    return int(cursor.fetchall()[0][0])
+
+
+def check_vote_count_is_slim(engine) -> Optional[str]:
+    """Returns an error string if VoteCount still holds OtherCountItemType as text, since
+    results cannot be loaded into it until slim_vote_count has been run (or None)"""
+    try:
+        connection = engine.raw_connection()
+    except Exception as exc:
+        return f"Unable to check VoteCount columns: {exc}"
+    cursor = connection.cursor()
+    try:
+        if vote_count_is_slim(cursor):
+            err_str = None
+        else:
+            err_str = (
+                f"VoteCount in database {engine.url.database} still holds OtherCountItemType as "
+                f"text, so results cannot be loaded into it. Convert it with "
+                f"DataLoader.slim_vote_count (which rewrites VoteCount, locking it meanwhile)."
+            )
+    except Exception as exc:
+        err_str = f"Unable to check VoteCount columns: {exc}"
+    cursor.close()
+    connection.close()
+    return err_str
+
+
+def slim_vote_count(engine) -> (Optional[Tuple[int, int]], Optional[str]):
+    """Brings databases created before VoteCount referred to OtherCountItemType by Id up to date:
+    moves the free-text values to the OtherCountItemType lookup table, replaces the text column
+    with OtherCountItemType_Id and drops the redundant whole-record unique constraint.
+    VoteCount is rewritten once, holding an exclusive lock on it meanwhile, so this is never
+    done implicitly (see DataLoader.slim_vote_count). Returns the size of VoteCount in bytes
+    before and after (or None if nothing needed doing) and an error string (or None)."""
+    q_lookup = sql.SQL(
+        """CREATE TABLE IF NOT EXISTS "OtherCountItemType" (
+            "Id" integer PRIMARY KEY DEFAULT nextval('id_seq'),
+            "Txt" varchar UNIQUE
+        );
+        INSERT INTO "OtherCountItemType" ("Txt")
+            SELECT DISTINCT COALESCE("OtherCountItemType", '') FROM "VoteCount"
+            UNION SELECT ''
+            ON CONFLICT DO NOTHING;
+        ALTER TABLE "VoteCount" DROP CONSTRAINT IF EXISTS vc_no_dupes,
+            DROP CONSTRAINT IF EXISTS vc_ux0;"""
+    )
+    # any other constraints or indices on the text column
+    q_dependent = """SELECT con.conname, i.indexrelid::regclass::text
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        LEFT JOIN pg_constraint con ON con.conindid = i.indexrelid AND con.conrelid = i.indrelid
+        WHERE i.indrelid = '"VoteCount"'::regclass AND a.attname = 'OtherCountItemType'"""
+    # replacing the column in place rewrites the table (and its indices) in one pass,
+    #  leaving neither the dead rows an UPDATE would nor the space held by the dropped text
+    q_rewrite = sql.SQL(
+        """ALTER TABLE "VoteCount" ALTER COLUMN "OtherCountItemType" TYPE integer
+            USING (CASE COALESCE("OtherCountItemType", '') {cases} END);
+        ALTER TABLE "VoteCount" RENAME COLUMN "OtherCountItemType" TO "OtherCountItemType_Id";
+        ALTER TABLE "VoteCount"
+            ADD CONSTRAINT "VoteCount_OtherCountItemType_Id_fkey"
+                FOREIGN KEY ("OtherCountItemType_Id") REFERENCES "OtherCountItemType" ("Id"),
+            ADD CONSTRAINT "vc_OtherCountItemType_Id_not_null" CHECK ("OtherCountItemType_Id" IS NOT NULL),
+            ADD CONSTRAINT vc_ux0 UNIQUE ("_datafile_Id", "Election_Id", "Contest_Id", "Selection_Id",
+                "CountItemType_Id", "ReportingUnit_Id", "OtherCountItemType_Id");"""
+    )
+    try:
+        connection = engine.raw_connection()
+    except Exception as exc:
+        return None, f"Unable to move OtherCountItemType values to lookup table: {exc}"
+    cursor = connection.cursor()
+    try:
+        if vote_count_is_slim(cursor):
+            sizes = None
+        else:
+            size_before = vote_count_size(cursor)
+            cursor.execute(q_lookup)
+            cursor.execute(q_dependent)
+            for constraint, index in cursor.fetchall():
+                if constraint:
+                    cursor.execute(
+                        sql.SQL('ALTER TABLE "VoteCount" DROP CONSTRAINT {}').format(
+                            sql.Identifier(constraint)
+                        )
+                    )
+                else:
+                    cursor.execute(sql.SQL("DROP INDEX {}").format(sql.SQL(index)))
+            cursor.execute('SELECT "Txt", "Id" FROM "OtherCountItemType"')
+            cases = sql.SQL(" ").join(
+                sql.SQL("WHEN {txt} THEN {id}").format(txt=sql.Literal(txt), id=sql.Literal(i))
+                for (txt, i) in cursor.fetchall()
+            )
+            cursor.execute(q_rewrite.format(cases=cases))
+            sizes = (size_before, vote_count_size(cursor))
+        connection.commit()
+        err_str = None
+    except Exception as exc:
+        connection.rollback()
+        sizes = None
+        err_str = f"Unable to move OtherCountItemType values to lookup table: {exc}"
+    cursor.close()
+    connection.close()
+    return sizes, err_str
+
+
+def add_table_id_sequences(engine) -> Optional[str]:
+    """Brings databases created before some tables had their own Id sequences (see
+    create_cdf_db.table_id_sequences) up to date: creates each missing sequence, starting
+    after the table's largest Id, and makes it the source of the table's Ids.
+    Cheap if nothing needs doing. Returns an error string (or None)."""
+    try:
+        connection = engine.raw_connection()
+    except Exception as exc:
+        return f"Unable to create Id sequences: {exc}"
+    cursor = connection.cursor()
+    try:
+        for table, seq in db_cdf.table_id_sequences.items():
+            cursor.execute("SELECT to_regclass(%s)", [f'"{seq}"'])
+            if cursor.fetchall()[0][0]:
+                continue
+            cursor.execute(
+                sql.SQL(
+                    """CREATE SEQUENCE {seq} CACHE %s OWNED BY {table}."Id";
+                    SELECT setval(%s, (SELECT COALESCE(MAX("Id"), 0) + 1 FROM {table}), false);
+                    ALTER TABLE {table} ALTER COLUMN "Id" SET DEFAULT nextval(%s)"""
+                ).format(seq=sql.Identifier(seq), table=sql.Identifier(table)),
+                [db_cdf.default_id_sequence_cache, f'"{seq}"', f'"{seq}"'],
+            )
+        connection.commit()
+        err_str = None
+    except Exception as exc:
+        connection.rollback()
+        err_str = f"Unable to create Id sequences: {exc}"
+    cursor.close()
+    connection.close()
+    return err_str
+
+
+def set_id_sequence_cache(engine, cache: int) -> Optional[str]:
+    """Sets the number of values each session preallocates from each Id sequence
+    (id_seq and those in create_cdf_db.table_id_sequences). Larger caches mean less contention
+    between parallel inserts, at the cost of gaps in the Ids. Returns an error string (or None)."""
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    try:
+        for seq in ["id_seq"] + list(db_cdf.table_id_sequences.values()):
+            cursor.execute(
+                sql.SQL("ALTER SEQUENCE {seq} CACHE %s").format(seq=sql.Identifier(seq)),
+                [int(cache)],
+            )
+        connection.commit()
+        err_str = None
+    except Exception as exc:
+        connection.rollback()
+        err_str = f"Unable to set cache for Id sequences: {exc}"
+    cursor.close()
+    connection.close()
+    return err_str
+
+
+def add_vote_count_covering_indexes(engine) -> Optional[str]:
+    """Creates any missing composite covering indices on VoteCount (per
+    create_cdf_db.vote_count_covering_indexes) and drops the indices they make redundant
+    (create_cdf_db.obsolete_vote_count_indexes), bringing databases created before those indices
+    up to date; cheap if nothing needs doing. Returns an error string (or None)."""
+    q_list = db_cdf.vote_count_covering_index_ddl() + [
+        sql.SQL("DROP INDEX IF EXISTS {idx}").format(idx=sql.Identifier(idx))
+        for idx in db_cdf.obsolete_vote_count_indexes
+    ]
+    try:
+        connection = engine.raw_connection()
+    except Exception as exc:
+        return f"Unable to create covering indices on VoteCount: {exc}"
+    cursor = connection.cursor()
+    try:
+        for q in q_list:
+            cursor.execute(q)
+        connection.commit()
+        err_str = None
+    except Exception as exc:
+        connection.rollback()
+        err_str = f"Unable to create covering indices on VoteCount: {exc}"
+    cursor.close()
+    connection.close()
+    return err_str
+
+
+def drop_deferrable_indexes(engine, tables: List[str]) -> (List[Tuple[str, str]], Optional[str]):
+    """Drops all non-unique indexes (i.e., those not needed to enforce constraints during loading)
+    on the given <tables>. Returns list of (table, index definition) pairs for the dropped indexes,
+    for use by rebuild_indexes, and an error string (or None)"""
+    q = sql.SQL(
+        """SELECT c.relname, i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relname = ANY(%s)
+            AND NOT i.indisunique AND NOT i.indisprimary
+            -- indexes on partitions are dropped along with the index on the partitioned table
+            AND NOT EXISTS (SELECT 1 FROM pg_inherits inh WHERE inh.inhrelid = i.indexrelid)"""
+    )
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    index_defs = list()
+    try:
+        cursor.execute(q, [tables])
+        for table, index_name, index_def in cursor.fetchall():
+            cursor.execute(sql.SQL("DROP INDEX {}").format(sql.SQL(index_name)))
+            # the definition of an index on a partitioned table reads "ON ONLY <table>", which
+            # would rebuild it as an invalid index on the parent alone, without the partitions
+            index_defs.append((table, index_def.replace(" ON ONLY ", " ON ", 1)))
+        connection.commit()
+        err_str = None
+    except Exception as exc:
+        connection.rollback()
+        index_defs = list()
+        err_str = f"Unable to drop indexes on {tables}: {exc}"
+    cursor.close()
+    connection.close()
+    return index_defs, err_str
+
+
+def rebuild_indexes(
+    engine, index_defs: List[Tuple[str, str]], max_workers: int = 4
+) -> Optional[str]:
+    """Recreates indexes from the (table, index definition) pairs in <index_defs> (as returned by
+    drop_deferrable_indexes), building up to <max_workers> indexes at once, each on its own
+    connection. Then analyzes the tables. Returns an error string (or None)"""
+
+    def build(index_def: str) -> Optional[str]:
+        connection = engine.raw_connection()
+        cursor = connection.cursor()
+        try:
+            cursor.execute(index_def)
+            connection.commit()
+            e = None
+        except Exception as exc:
+            connection.rollback()
+            e = f"{index_def}: {exc}"
+        cursor.close()
+        connection.close()
+        return e
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        index_errors = [e for e in executor.map(build, [d for (t, d) in index_defs]) if e]
+
+    # refresh planner statistics for the rebuilt tables
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    for table in sorted({t for (t, d) in index_defs}):
+        try:
+            cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table)))
+            connection.commit()
+        except Exception as exc:
+            connection.rollback()
+            index_errors.append(f"ANALYZE {table}: {exc}")
+    cursor.close()
+    connection.close()
+
+    if index_errors:
+        return "Errors rebuilding indexes:\n" + "\n".join(index_errors)
+    return None
+
+
+def table_change_counts(engine, tables: List[str]) -> Dict[str, Dict[str, int]]:
+    """For each of the given <tables>, returns the number of rows inserted, updated or deleted
+    since the statistics collector was last reset ("changed"), the number modified since the table
+    was last analyzed ("since_analyze") and the number of live rows ("live"), per the statistics
+    collector. Counts for a partitioned table are summed over its partitions."""
+    q = """WITH RECURSIVE tree AS (
+            SELECT c.oid, c.relname::text AS root FROM pg_class c
+                JOIN pg_namespace n ON c.relnamespace = n.oid
+                WHERE n.nspname = 'public' AND c.relname = ANY(%s)
+            UNION ALL
+            SELECT i.inhrelid, tree.root FROM pg_inherits i JOIN tree ON i.inhparent = tree.oid
+        )
+        SELECT tree.root,
+            COALESCE(SUM(s.n_tup_ins + s.n_tup_upd + s.n_tup_del), 0),
+            COALESCE(SUM(s.n_mod_since_analyze), 0),
+            COALESCE(SUM(s.n_live_tup), 0)
+        FROM tree LEFT JOIN pg_stat_user_tables s ON s.relid = tree.oid
+        GROUP BY tree.root"""
+    counts = {t: {"changed": 0, "since_analyze": 0, "live": 0} for t in tables}
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    try:
+        # make sure we see the latest statistics, not a snapshot from earlier in the transaction
+        cursor.execute("SELECT pg_stat_clear_snapshot()")
+        cursor.execute(q, [tables])
+        for table, changed, since_analyze, live in cursor.fetchall():
+            counts[table] = {
+                "changed": int(changed),
+                "since_analyze": int(since_analyze),
+                "live": int(live),
+            }
+        connection.commit()
+    except Exception:
+        # statistics are advisory; if unavailable, report no changes
+        connection.rollback()
+    cursor.close()
+    connection.close()
+    return counts
+
+
+def analyze_stale_tables(
+    engine,
+    tables: List[str],
+    min_rows: int = 1000,
+    fraction: float = 0.05,
+) -> (Dict[str, float], Optional[str]):
+    """Runs ANALYZE on each of the given <tables> in which more than <min_rows> rows, and more than
+    <fraction> of the rows existing before the changes, have been modified since it was last
+    analyzed (a more eager version of autovacuum's rule, which never analyzes partitioned tables).
+    Returns a dictionary of seconds spent analyzing each such table, and an error string (or None)."""
+    counts = table_change_counts(engine, tables)
+    stale = [
+        t
+        for t in tables
+        if counts[t]["since_analyze"] > max(
+            min_rows, fraction * (counts[t]["live"] - counts[t]["since_analyze"])
+        )
+    ]
+    seconds = dict()
+    err_list = list()
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    for table in stale:
+        start = time.perf_counter()
+        try:
+            cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table)))
+            connection.commit()
+        except Exception as exc:
+            connection.rollback()
+            err_list.append(f"ANALYZE {table}: {exc}")
+        seconds[table] = time.perf_counter() - start
+    cursor.close()
+    connection.close()
+    if err_list:
+        return seconds, "Errors refreshing planner statistics:\n" + "\n".join(err_list)
+    return seconds, None
+
+
 def get_cdf_db_table_names(eng):
     """This is postgresql-specific"""
     db_columns = pd.read_sql_table("columns", eng, schema="information_schema")
@@ -488,118 +1136,286 @@ def insert_to_cdf_db(
             engine, working, "ReportingUnit", {"Name": "Name"}
         )
 
-    # name temp table by username and timestamp to avoid conflict
+    # name temp table uniquely to avoid conflict with any other loader
     temp_table = table_named_to_avoid_conflict(engine, "__temp_insert")
 
-    if element in [
-        "BallotMeasureSelection",
-        "BallotMeasureContest",
-        "CandidateSelection",
-        "CandidateContest",
-    ]:
-        # create temp table with Id column
-        q = sql.SQL(
-            "CREATE TABLE {temp_table} AS TABLE {element} WITH NO DATA;"
-        ).format(element=sql.Identifier(element), temp_table=sql.Identifier(temp_table))
-    else:
-        # create temp table without Id
-        q = sql.SQL(
-            'CREATE TABLE {temp_table} AS TABLE {element} WITH NO DATA; ALTER TABLE {temp_table} DROP COLUMN "Id";'
-        ).format(element=sql.Identifier(element), temp_table=sql.Identifier(temp_table))
-
-    cursor.execute(q)
-    if timestamp:
-        # drop timestamp column
-        q = sql.SQL("ALTER TABLE {temp_table} DROP COLUMN {ts_col}").format(
-            ts_col=sql.Identifier(timestamp), temp_table=temp_table
+    # columns to load: all columns of <element> except Id (unless Id is part of the data,
+    # as for the subclasses of Selection and Contest) and the timestamp column (if any)
+    element_columns, type_map = get_column_names(cursor, element)
+    temp_columns = [
+        c
+        for c in element_columns
+        if c != timestamp
+        and not (
+            element == "ReportingUnit"
+            and c in db_cdf.reporting_unit_hierarchy_columns
+        )
+        and (
+            c != "Id"
+            or element
+            in [
+                "BallotMeasureSelection",
+                "BallotMeasureContest",
+                "CandidateSelection",
+                "CandidateContest",
+            ]
         )
-        cursor.execute(q)
-        working = working.drop([timestamp], axis=1)
-    connection.commit()
-
-    # make sure datatypes of working match the types of target
-    # get set <mixed_int> of cols with integers & nulls and kludge only those
-    temp_columns, type_map = get_column_names(cursor, temp_table)
-    mixed_int = [
-        c  # TODO Selection_Id was numerical but not int here for AZ (xml)
-        for c in temp_columns
-        if type_map[c] == "integer" and working[c].dtype != "int64"
     ]
-    for c in mixed_int:
-        # set nulls to 0 (kludge because pandas can't have NaN in 'int64' column)
-        working[c] = working[c].fillna(0).astype("int64", errors="ignore")
-
-    # Prepare data
-    output = io.StringIO()
-    temp_only_cols = [c for c in temp_columns if c not in working.columns]
+    if timestamp:
+        working = working.drop([timestamp], axis=1)
 
     # add any missing columns needed for temp table to working
-    for c in temp_only_cols:
+    for c in [c for c in temp_columns if c not in working.columns]:
         working = m.add_constant_column(working, c, None)
-    working[temp_columns].drop_duplicates().to_csv(
-        output,
+
+    # Prepare data
+    output = dframe_to_copy_buffer(
+        working.drop_duplicates(subset=temp_columns),
+        temp_columns,
+        type_map,
         sep=sep,
-        header=False,
         encoding=encoding,
-        index=False,
-        quoting=csv.QUOTE_MINIMAL,
     )
-    # set current position for the StringIO object to the beginning of the string
-    output.seek(0)
 
-    # Insert data
-    q_copy = sql.SQL("COPY {temp_table} FROM STDOUT").format(
-        temp_table=sql.Identifier(temp_table)
-    )
+    fields = sql.SQL(",").join([sql.Identifier(x) for x in temp_columns])
     try:
-        cursor.copy_expert(q_copy, output)
-        connection.commit()
+        # stage in a session-local temp table (unlogged, invisible to other loaders, and
+        # dropped automatically at the end of the transaction)
+        q = sql.SQL(
+            "CREATE TEMP TABLE {temp_table} ON COMMIT DROP AS TABLE {element} WITH NO DATA"
+        ).format(element=sql.Identifier(element), temp_table=sql.Identifier(temp_table))
+        cursor.execute(q)
 
-        #  undo kludge (see above) setting 0 values to nulls inside db in temp table
-        for c in mixed_int:
-            q_kludge = sql.SQL(
-                "UPDATE {temp_table} SET {c} = NULL WHERE {c} = 0"
-            ).format(temp_table=sql.Identifier(temp_table), c=sql.Identifier(c))
-            cursor.execute(q_kludge)
-        connection.commit()  # TODO when Selection_Id was in mixed_int, this emptied temp table, why?
+        # Insert data; \N marks nulls
+        q_copy = sql.SQL(
+            "COPY {temp_table}({fields}) FROM STDIN WITH (FORMAT text, DELIMITER {sep}, NULL {null})"
+        ).format(
+            temp_table=sql.Identifier(temp_table),
+            fields=fields,
+            sep=sql.Literal(sep),
+            null=sql.Literal("\\N"),
+        )
+        cursor.copy_expert(q_copy, output)
 
         # insert records from temp table into <element> table
         q = sql.SQL(
-            "INSERT INTO {t}({fields}) SELECT * FROM {temp_table} ON CONFLICT DO NOTHING"
+            "INSERT INTO {t}({fields}) SELECT {fields} FROM {temp_table} ON CONFLICT DO NOTHING"
         ).format(
             t=sql.Identifier(element),
-            fields=sql.SQL(",").join([sql.Identifier(x) for x in temp_columns]),
+            fields=fields,
             temp_table=sql.Identifier(temp_table),
         )
         cursor.execute(q)
         connection.commit()
         error_str = None
     except Exception as e:
+        connection.rollback()
         print(e)
         error_str = f"{e}"
 
-    # remove temp table
-    q = sql.SQL("DROP TABLE {temp_table}").format(temp_table=sql.Identifier(temp_table))
-    cursor.execute(q)
-
-    if element == "ReportingUnit":
+    if element == "ReportingUnit" and not error_str:
         # check get RUs not matched and process them
         mask = matched_with_old.ReportingUnit_Id > 0
         new_rus = matched_with_old[~mask]
         if not new_rus.empty:
             append_to_composing_reporting_unit_join(engine, new_rus)
 
-    connection.commit()
     cursor.close()
     connection.close()
     return error_str
 
 
+def dframe_to_copy_buffer(
+    df: pd.DataFrame,
+    columns: List[str],
+    type_map: dict,
+    sep: str = "\t",
+    encoding: str = "utf_8",
+) -> io.StringIO:
+    """Returns a buffer holding the <columns> of <df>, ready for
+    COPY ... WITH (FORMAT text, DELIMITER <sep>, NULL '\\N').
+    <type_map> gives the db datatype of each column. Integer columns with nulls are written
+    as integers with explicit nulls; nulls in other columns are written as empty strings."""
+    working = df[columns].copy()
+    for c in columns:
+        if type_map[c] == "integer":
+            if working[c].dtype != "int64":
+                # TODO Selection_Id was numerical but not int here for AZ (xml)
+                try:
+                    working[c] = working[c].astype("Int64")
+                except (TypeError, ValueError):
+                    pass
+        elif working[c].isnull().any():
+            working[c] = working[c].fillna("")
+
+    output = io.StringIO()
+    working.to_csv(
+        output,
+        sep=sep,
+        header=False,
+        encoding=encoding,
+        index=False,
+        quoting=csv.QUOTE_MINIMAL,
+        na_rep="\\N",
+    )
+    # set current position for the StringIO object to the beginning of the string
+    output.seek(0)
+    return output
+
+
+def upsert_and_return_ids(
+    engine,
+    df: pd.DataFrame,
+    element: str,
+    key_cols: List[str],
+    parent: Optional[str] = None,
+    sep: str = "\t",
+    encoding: str = "utf_8",
+) -> (pd.DataFrame, Optional[str]):
+    """Inserts any new records in <df> into <element> (ignoring conflicts) and returns a copy of <df>
+    with column <element>_Id holding the Id of the new or existing record matching each row on
+    <key_cols>, along with an error string (or None). All in one statement, in one transaction.
+    If <parent> is given (e.g., "Selection" for "CandidateSelection"), each new record
+    gets its Id from a new record in <parent>, and <key_cols> must be a unique constraint of <element>.
+    Rows with no Id (e.g., if a key is null) get 0; if a row with no null keys gets no Id (e.g., if a
+    concurrent load inserted the same record), nothing is inserted and an error string is returned."""
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    element_columns, type_map = get_column_names(cursor, element)
+    cols = [c for c in element_columns if c in df.columns and c != "Id"]
+
+    working = df.copy()
+    working.insert(0, "dataframe_position", range(working.shape[0]))
+    type_map["dataframe_position"] = "integer"
+    output = dframe_to_copy_buffer(
+        working, ["dataframe_position"] + cols, type_map, sep=sep, encoding=encoding
+    )
+
+    temp_table = table_named_to_avoid_conflict(engine, "__temp_upsert")
+    fields = sql.SQL(",").join([sql.Identifier(c) for c in cols])
+    keys = sql.SQL(",").join([sql.Identifier(c) for c in key_cols])
+
+    def match(left: str, right: str) -> sql.Composed:
+        return sql.SQL(" AND ").join(
+            [
+                sql.SQL("{l}.{c} = {r}.{c}").format(
+                    l=sql.Identifier(left), r=sql.Identifier(right), c=sql.Identifier(c)
+                )
+                for c in key_cols
+            ]
+        )
+
+    # one row per key, from the first input row having that key
+    distinct_rows = sql.SQL(
+        "SELECT DISTINCT ON ({keys}) {fields} FROM {tt} ORDER BY {keys}, dataframe_position"
+    ).format(keys=keys, fields=fields, tt=sql.Identifier(temp_table))
+    if parent:
+        # a conflict on any constraint other than <key_cols> is an error, not a skipped row
+        insert_ctes = sql.SQL(
+            """new AS (
+                SELECT nextval({seq}) AS "Id", d.* FROM ({distinct_rows}) d
+                WHERE NOT EXISTS (SELECT 1 FROM {t} t WHERE {match_new})
+            ),
+            par AS (INSERT INTO {parent}("Id") SELECT "Id" FROM new),
+            ins AS (
+                INSERT INTO {t}("Id", {fields}) SELECT "Id", {fields} FROM new
+                ON CONFLICT ({keys}) DO NOTHING RETURNING "Id", {keys}
+            )"""
+        ).format(
+            seq=sql.Literal(db_cdf.table_id_sequences.get(parent, "id_seq")),
+            distinct_rows=distinct_rows,
+            t=sql.Identifier(element),
+            match_new=match("t", "d"),
+            parent=sql.Identifier(parent),
+            fields=fields,
+            keys=keys,
+        )
+    else:
+        insert_ctes = sql.SQL(
+            """ins AS (
+                INSERT INTO {t}({fields}) {distinct_rows}
+                ON CONFLICT DO NOTHING RETURNING "Id", {keys}
+            )"""
+        ).format(
+            t=sql.Identifier(element),
+            fields=fields,
+            distinct_rows=distinct_rows,
+            keys=keys,
+        )
+    # NB: rows inserted by the CTE are not visible in <element> within the same statement,
+    #  so existing records come from <element> and new ones from the CTE
+    q = sql.SQL(
+        """WITH {insert_ctes}
+        SELECT DISTINCT ON (tt.dataframe_position) tt.dataframe_position, COALESCE(ins."Id", t."Id")
+        FROM {tt} tt
+        LEFT JOIN ins ON {match_ins}
+        LEFT JOIN {t} t ON {match_t}
+        ORDER BY tt.dataframe_position, t."Id" """
+    ).format(
+        insert_ctes=insert_ctes,
+        tt=sql.Identifier(temp_table),
+        t=sql.Identifier(element),
+        match_ins=match("tt", "ins"),
+        match_t=match("tt", "t"),
+    )
+
+    try:
+        cursor.execute(
+            sql.SQL(
+                "CREATE TEMP TABLE {tt} ON COMMIT DROP AS SELECT 0 AS dataframe_position, {fields} FROM {t} WITH NO DATA"
+            ).format(tt=sql.Identifier(temp_table), fields=fields, t=sql.Identifier(element))
+        )
+        cursor.copy_expert(
+            sql.SQL(
+                "COPY {tt}(dataframe_position, {fields}) FROM STDIN WITH (FORMAT text, DELIMITER {sep}, NULL {null})"
+            ).format(
+                tt=sql.Identifier(temp_table),
+                fields=fields,
+                sep=sql.Literal(sep),
+                null=sql.Literal("\\N"),
+            ),
+            output,
+        )
+        cursor.execute(q)
+        results = cursor.fetchall()
+        # a row with all keys gets no Id only if its record was inserted by another
+        #  transaction after this statement started (leaving any new <parent> record orphaned)
+        has_keys = df[key_cols].notnull().all(axis=1).values
+        missing = [pos for (pos, idx) in results if idx is None and has_keys[pos]]
+        if missing:
+            connection.rollback()
+            results = []
+            error_str = (
+                f"No {element} Id found for {len(missing)} rows (e.g., row {missing[0]}), "
+                f"perhaps because of a concurrent load. Nothing inserted."
+            )
+        else:
+            connection.commit()
+            error_str = None
+    except Exception as e:
+        connection.rollback()
+        results = []
+        error_str = f"{e}"
+    cursor.close()
+    connection.close()
+
+    id_by_position = pd.Series(
+        [idx for (pos, idx) in results], index=[pos for (pos, idx) in results], dtype="float64"
+    )
+    df_appended = df.copy()
+    df_appended[f"{element}_Id"] = (
+        id_by_position.reindex(range(df.shape[0])).fillna(0).astype("int64").values
+    )
+    return df_appended, error_str
+
+
 def table_named_to_avoid_conflict(engine, prefix: str) -> str:
+    """Returns a table name unique to this process and call, so that parallel loaders
+    never collide. Name is kept within postgresql's 63-character limit."""
     p = re.compile("postgresql://([^:]+)")
     user_name = p.findall(str(engine.url))[0]
-    ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-    temp_table = f"{prefix}_{user_name}_{ts}"
+    unique = f"{os.getpid()}_{uuid.uuid4().hex}"
+    temp_table = f"{prefix}_{user_name}"[: 62 - len(unique)] + f"_{unique}"
     return temp_table
 
 
@@ -620,17 +1436,44 @@ def append_id_to_dframe(
             if v == "BallotName" and k in df.columns:
                 df[k] = m.regularize_candidate_names(df[k])
 
-    connection = engine.raw_connection()
-
     temp_table = table_named_to_avoid_conflict(engine, "__temp_append")
 
     df_cols = list(col_map.keys())
 
-    # create temp db table with info from df, without index
+    # prepare keys from df, tagged by position so results can be aligned to the index of df
     id_cols = [c for c in df.columns if c[-3:] == "_Id"]
     df, err_df = m.clean_ids(df, id_cols)
-    df[df_cols].fillna("").to_sql(temp_table, engine, index_label="dataframe_index")
-    # TODO fillna('') probably redundant
+    keys = df[df_cols].copy()
+    for c in df_cols:
+        if not is_numeric_dtype(keys[c]):
+            keys[c] = keys[c].fillna("")
+    keys.insert(0, "dataframe_position", range(keys.shape[0]))
+    output = io.StringIO()
+    keys.to_csv(output, header=False, index=False, na_rep="\\N")
+    output.seek(0)
+
+    # temp table has same types as the columns of <element> it will be joined to
+    q_create = sql.SQL(
+        "CREATE TEMP TABLE {tt} ON COMMIT DROP AS SELECT 0 AS dataframe_position, {cols} FROM {t} WITH NO DATA"
+    ).format(
+        tt=sql.Identifier(temp_table),
+        t=sql.Identifier(element),
+        cols=sql.SQL(",").join(
+            [
+                sql.SQL("{t_col} AS {tt_col}").format(
+                    t_col=sql.Identifier(col_map[c]), tt_col=sql.Identifier(c)
+                )
+                for c in df_cols
+            ]
+        ),
+    )
+    q_copy = sql.SQL(
+        "COPY {tt}(dataframe_position, {cols}) FROM STDIN WITH (FORMAT csv, NULL {null})"
+    ).format(
+        tt=sql.Identifier(temp_table),
+        cols=sql.SQL(",").join([sql.Identifier(c) for c in df_cols]),
+        null=sql.Literal("\\N"),
+    )
 
     # join <table>_Id
     on_clause = sql.SQL(" AND ").join(
@@ -641,29 +1484,163 @@ def append_id_to_dframe(
             for c in df_cols
         ]
     )
-
     q = sql.SQL(
-        "SELECT t.*, tt.dataframe_index FROM {tt} tt LEFT JOIN {t} t ON {on_clause}"
+        """SELECT DISTINCT ON (tt.dataframe_position) tt.dataframe_position, t."Id"
+        FROM {tt} tt LEFT JOIN {t} t ON {on_clause}
+        ORDER BY tt.dataframe_position, t."Id" """
     ).format(
         tt=sql.Identifier(temp_table), t=sql.Identifier(element), on_clause=on_clause
     )
-    w = pd.read_sql_query(q, connection).set_index("dataframe_index")
 
-    # drop temp db table
-    q = sql.SQL("DROP TABLE {temp_table}").format(temp_table=sql.Identifier(temp_table))
+    # keys go to the server in one COPY; temp table disappears with the transaction
+    connection = engine.raw_connection()
     cur = connection.cursor()
-    cur.execute(q)
-    connection.commit()
-    connection.close()
-    df_appended = df.join(w[["Id"]]).rename(columns={"Id": f"{element}_Id"})
+    try:
+        cur.execute(q_create)
+        cur.copy_expert(q_copy, output)
+        cur.execute(q)
+        results = cur.fetchall()
+        connection.commit()
+    finally:
+        cur.close()
+        connection.close()
+
+    id_by_position = pd.Series(
+        [idx for (pos, idx) in results], index=[pos for (pos, idx) in results], dtype="float64"
+    )
+    df_appended = df.copy()
+    df_appended[f"{element}_Id"] = id_by_position.reindex(range(df.shape[0])).values
     df_appended, err_df = m.clean_ids(df_appended, "Id")
     return df_appended
 
 
+# enumeration tables, keyed by (database url, enumeration); filled once per process,
+#  since enumerations are loaded only when the database is created
+enum_cache = dict()
+
+
+def read_enum_table(engine, enum: str) -> pd.DataFrame:
+    """Returns the table for enumeration <enum> (e.g., "ReportingUnitType"),
+    reading it from the database only the first time it is requested"""
+    key = (str(engine.url), enum)
+    if key not in enum_cache:
+        enum_cache[key] = pd.read_sql_table(enum, engine)
+    return enum_cache[key].copy()
+
+
+def clear_enum_cache(engine=None):
+    """Forget cached enumeration tables (for the database of <engine>, or for all databases)"""
+    for key in list(enum_cache.keys()):
+        if engine is None or key[0] == str(engine.url):
+            del enum_cache[key]
+
+
+def append_ids_for_foreign_keys(
+    engine,
+    df: pd.DataFrame,
+    fk_map: Dict[str, Tuple[str, str]],
+) -> pd.DataFrame:
+    """<fk_map> maps each Id column to be appended (e.g., "PrimaryParty_Id") to a pair
+    (<df column holding names>, <referenced element>), e.g., ("PrimaryParty", "Party").
+    Returns a copy of <df> with all the Id columns appended, found with a single query joining
+    all the referenced tables. Unmatched items returned with null value for the Id."""
+    if not fk_map:
+        return df.copy()
+    id_cols = list(fk_map.keys())
+    df_cols = [fk_map[k][0] for k in id_cols]
+    refs = [fk_map[k][1] for k in id_cols]
+    name_fields = [get_name_field(r) for r in refs]
+
+    working = df.copy()
+    for c, r, nf in zip(df_cols, refs, name_fields):
+        if r == "Candidate" and nf == "BallotName":
+            working[c] = m.regularize_candidate_names(working[c])
+    working, err_df = m.clean_ids(
+        working, [c for c in working.columns if c[-3:] == "_Id"]
+    )
+
+    # prepare keys from df, tagged by position so results can be aligned to the index of df
+    keys = working[df_cols].copy()
+    keys.columns = [f"key_{i}" for i in range(len(df_cols))]
+    for c in keys.columns:
+        if not is_numeric_dtype(keys[c]):
+            keys[c] = keys[c].fillna("")
+    keys.insert(0, "dataframe_position", range(keys.shape[0]))
+    output = io.StringIO()
+    keys.to_csv(output, header=False, index=False, na_rep="\\N")
+    output.seek(0)
+
+    temp_table = table_named_to_avoid_conflict(engine, "__temp_fk")
+    aliases = [sql.Identifier(f"r_{i}") for i in range(len(refs))]
+    key_ids = [sql.Identifier(c) for c in keys.columns[1:]]
+
+    # temp table columns have the types of the columns they will be joined to
+    q_create = sql.SQL(
+        "CREATE TEMP TABLE {tt} ON COMMIT DROP AS SELECT 0 AS dataframe_position, {cols} FROM {tables} WITH NO DATA"
+    ).format(
+        tt=sql.Identifier(temp_table),
+        cols=sql.SQL(",").join(
+            [
+                sql.SQL("{a}.{nf} AS {k}").format(a=a, nf=sql.Identifier(nf), k=k)
+                for a, nf, k in zip(aliases, name_fields, key_ids)
+            ]
+        ),
+        tables=sql.SQL(",").join(
+            [sql.SQL("{r} {a}").format(r=sql.Identifier(r), a=a) for r, a in zip(refs, aliases)]
+        ),
+    )
+    q_copy = sql.SQL(
+        "COPY {tt}(dataframe_position, {cols}) FROM STDIN WITH (FORMAT csv, NULL {null})"
+    ).format(
+        tt=sql.Identifier(temp_table),
+        cols=sql.SQL(",").join(key_ids),
+        null=sql.Literal("\\N"),
+    )
+    # one join per referenced table. If a name matches several records, the one with the
+    #  smallest Id is used (as in append_id_to_dframe)
+    q = sql.SQL(
+        """SELECT DISTINCT ON (tt.dataframe_position) tt.dataframe_position, {ids}
+        FROM {tt} tt {joins}
+        ORDER BY tt.dataframe_position, {ids}"""
+    ).format(
+        ids=sql.SQL(",").join([sql.SQL('{a}."Id"').format(a=a) for a in aliases]),
+        tt=sql.Identifier(temp_table),
+        joins=sql.SQL(" ").join(
+            [
+                sql.SQL("LEFT JOIN {r} {a} ON {a}.{nf} = tt.{k}").format(
+                    r=sql.Identifier(r), a=a, nf=sql.Identifier(nf), k=k
+                )
+                for r, a, nf, k in zip(refs, aliases, name_fields, key_ids)
+            ]
+        ),
+    )
+
+    connection = engine.raw_connection()
+    cur = connection.cursor()
+    try:
+        cur.execute(q_create)
+        cur.copy_expert(q_copy, output)
+        cur.execute(q)
+        results = cur.fetchall()
+        connection.commit()
+    finally:
+        cur.close()
+        connection.close()
+
+    found = pd.DataFrame(
+        [list(r) for r in results], columns=["dataframe_position"] + id_cols
+    ).set_index("dataframe_position")
+    found = found.reindex(range(working.shape[0]))
+    for c in id_cols:
+        working[c] = found[c].astype("float64").values
+    return working
+
+
 def get_column_names(cursor, table: str) -> (list, dict):
     q = sql.SQL(
         """SELECT column_name, data_type FROM information_schema.columns 
-        WHERE table_schema = 'public' AND table_name = %s"""
+        WHERE table_schema = 'public' AND table_name = %s
+        ORDER BY ordinal_position"""
     )
     cursor.execute(q, [table])
     results = cursor.fetchall()
@@ -674,13 +1651,12 @@ def get_column_names(cursor, table: str) -> (list, dict):
 
 def add_records_to_selection_table(engine, n: int) -> list:
     "Returns a list of the Ids of the inserted records"
-    id_list = []
     connection = engine.raw_connection()
     cursor = connection.cursor()
-    q = sql.SQL('INSERT INTO "Selection" DEFAULT VALUES RETURNING "Id";')
-    for k in range(n):
-        cursor.execute(q)
-        id_list.append(cursor.fetchall()[0][0])
+    # one statement for all <n> records, each taking its Id from the column default
+    q = sql.SQL('INSERT INTO "Selection" SELECT FROM generate_series(1, %s) RETURNING "Id"')
+    cursor.execute(q, [n])
+    id_list = [x for (x,) in cursor.fetchall()]
     connection.commit()
     cursor.close()
     connection.close()
@@ -794,13 +1770,166 @@ def active_vote_types(session, election, jurisdiction):
     return active_list
 
 
+def vote_count_partition_name(election_id: int, datafile_id: Optional[int] = None) -> str:
+    """Returns name of the VoteCount partition for the given election (and datafile)"""
+    if datafile_id is None:
+        return f"VoteCount_{election_id}"
+    else:
+        return f"VoteCount_{election_id}_{datafile_id}"
+
+
+def vote_count_partitioning(cursor) -> str:
+    """Returns the partitioning of the VoteCount table in the db: one of
+    create_cdf_db.vote_count_partitioning_options"""
+    cursor.execute(
+        """SELECT to_regclass('"VoteCount"')::oid IN (SELECT partrelid FROM pg_partitioned_table),
+        to_regclass('"VoteCount_default"')::oid IN (SELECT partrelid FROM pg_partitioned_table)"""
+    )
+    by_election, by_datafile = cursor.fetchall()[0]
+    if by_datafile:
+        return "election_and_datafile"
+    elif by_election:
+        return "election"
+    else:
+        return "none"
+
+
+def ensure_vote_count_partition(engine, election_id: int, datafile_id: int) -> Optional[str]:
+    """If VoteCount is partitioned, creates (if necessary) the partition for <election_id>
+    and, if VoteCount is sub-partitioned by datafile, the sub-partition for <datafile_id>.
+    Any VoteCounts that belong in a new partition but are in a default partition (e.g., loaded
+    while the partition was missing) are moved into it. Returns an error string (or None)"""
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    try:
+        partitioning = vote_count_partitioning(cursor)
+        if partitioning != "none":
+            election_partition = vote_count_partition_name(election_id)
+            e = sql.Literal(int(election_id))
+            # serialize with other loads into the same election, since two concurrent
+            #  CREATE TABLE statements can both try to create the table
+            #  (lock is released at commit or rollback)
+            cursor.execute(
+                sql.SQL("SELECT pg_advisory_xact_lock(hashtext('VoteCount partition'), {e})").format(
+                    e=e
+                )
+            )
+            if not relation_exists(cursor, election_partition):
+                q = sql.SQL('CREATE TABLE {p} PARTITION OF "VoteCount" FOR VALUES IN ({e})').format(
+                    p=sql.Identifier(election_partition), e=e
+                )
+                if partitioning == "election_and_datafile":
+                    q += sql.SQL(
+                        """ PARTITION BY LIST ("_datafile_Id");
+                        CREATE TABLE {p_default} PARTITION OF {p} DEFAULT"""
+                    ).format(
+                        p=sql.Identifier(election_partition),
+                        p_default=sql.Identifier(f"{election_partition}_default"),
+                    )
+                create_vote_count_partition(
+                    cursor, q, sql.SQL('"Election_Id" = {e}').format(e=e)
+                )
+            datafile_partition = vote_count_partition_name(election_id, datafile_id)
+            if partitioning == "election_and_datafile" and not relation_exists(
+                cursor, datafile_partition
+            ):
+                d = sql.Literal(int(datafile_id))
+                create_vote_count_partition(
+                    cursor,
+                    sql.SQL("CREATE TABLE {p_d} PARTITION OF {p} FOR VALUES IN ({d})").format(
+                        p_d=sql.Identifier(datafile_partition),
+                        p=sql.Identifier(election_partition),
+                        d=d,
+                    ),
+                    sql.SQL('"Election_Id" = {e} AND "_datafile_Id" = {d}').format(e=e, d=d),
+                )
+        connection.commit()
+        err_str = None
+    except Exception as exc:
+        connection.rollback()
+        err_str = f"Unable to create VoteCount partition: {exc}"
+    cursor.close()
+    connection.close()
+    return err_str
+
+
+def relation_exists(cursor, name: str) -> bool:
+    """True if the table (or other relation) <name> exists"""
+    cursor.execute("SELECT to_regclass(quote_ident(%s)) IS NOT NULL", [name])
+    return cursor.fetchall()[0][0]
+
+
+def create_vote_count_partition(cursor, create: sql.Composable, condition: sql.Composable):
+    """Executes <create>, which creates a partition of VoteCount for the rows meeting
+    <condition>. Postgres refuses to create a partition while a default partition holds rows
+    that belong in it, so any such rows are set aside first and then put back into VoteCount
+    (and so into the new partition). Does not commit."""
+    cursor.execute(
+        sql.SQL('SELECT EXISTS (SELECT 1 FROM "VoteCount" WHERE {condition})').format(
+            condition=condition
+        )
+    )
+    misplaced = cursor.fetchall()[0][0]
+    if misplaced:
+        cursor.execute(
+            sql.SQL(
+                """CREATE TEMP TABLE _misplaced_vote_count (LIKE "VoteCount");
+                WITH moved AS (DELETE FROM "VoteCount" WHERE {condition} RETURNING *)
+                INSERT INTO _misplaced_vote_count SELECT * FROM moved"""
+            ).format(condition=condition)
+        )
+    cursor.execute(create)
+    if misplaced:
+        cursor.execute(
+            """INSERT INTO "VoteCount" SELECT * FROM _misplaced_vote_count;
+            DROP TABLE _misplaced_vote_count"""
+        )
+    return
+
+
+def delete_vote_counts_for_datafile(cursor, election_id: int, datafile_id: int):
+    """Removes all VoteCounts from the datafile, dropping or truncating partitions
+    where possible rather than deleting row by row. Does not commit."""
+    partitioning = vote_count_partitioning(cursor)
+    if partitioning == "election_and_datafile":
+        # datafile has its own partition (unless loaded to the default)
+        cursor.execute(
+            sql.SQL("DROP TABLE IF EXISTS {p}").format(
+                p=sql.Identifier(vote_count_partition_name(election_id, datafile_id))
+            )
+        )
+    elif partitioning == "election":
+        # if no other datafile shares the election's partition, empty the whole partition
+        cursor.execute(
+            """SELECT COUNT(*) FROM _datafile WHERE "Election_Id" = %s AND "Id" != %s""",
+            [election_id, datafile_id],
+        )
+        if cursor.fetchall()[0][0] == 0:
+            cursor.execute("SELECT to_regclass(%s)", [f'"{vote_count_partition_name(election_id)}"'])
+            if cursor.fetchall()[0][0]:
+                cursor.execute(
+                    sql.SQL("TRUNCATE {p}").format(
+                        p=sql.Identifier(vote_count_partition_name(election_id))
+                    )
+                )
+    # remove anything left (e.g., in a default partition); filtering on Election_Id prunes partitions
+    cursor.execute(
+        'DELETE FROM "VoteCount" WHERE "Election_Id" = %s AND "_datafile_Id" = %s',
+        [election_id, datafile_id],
+    )
+    return
+
+
 def remove_vote_counts(connection, cursor, id: int, active_confirm: bool = True) -> str:
     """Remove all VoteCount data from a particular file, and remove that file from _datafile"""
     try:
         q = 'SELECT * FROM _datafile WHERE _datafile."Id"=%s;'
         cursor.execute(q, [id])
         record = cursor.fetchall()[0]
-    except KeyError as exc:
+        q = 'SELECT "Election_Id", "ReportingUnit_Id", short_name FROM _datafile WHERE _datafile."Id"=%s;'
+        cursor.execute(q, [id])
+        election_id, juris_id, short_name = cursor.fetchall()[0]
+    except (KeyError, IndexError) as exc:
         return f"No datafile found with Id = {id}"
     if active_confirm:
         confirm = input(
@@ -811,18 +1940,113 @@ def remove_vote_counts(connection, cursor, id: int, active_confirm: bool = True)
         confirm = "y"
     if confirm == "y":
         try:
-            q = 'DELETE FROM "VoteCount" where "_datafile_Id"=%s;Delete from _datafile where "Id"=%s;'
-            cursor.execute(q, [id, id])
+            delete_vote_counts_for_datafile(cursor, election_id, id)
+            q = 'Delete from _datafile where "Id"=%s;'
+            cursor.execute(q, [id])
+            refresh_candidate_votecount_slices(cursor, election_id, juris_id)
+            bump_data_versions(cursor, [election_id])
             connection.commit()
-            print(f'VoteCounts deleted from results file {record["short_name"]}')
+            print(f"VoteCounts deleted from results file {short_name}")
             err_str = None
         except Exception as exc:
+            connection.rollback()
             err_str = f"Error deleting data: {exc}"
     else:
         err_str = "Deletion not confirmed by user"
     return err_str
 
 
+def remove_datafiles(
+    engine,
+    datafile_ids: Optional[List[int]] = None,
+    election_id: Optional[int] = None,
+    juris_id: Optional[int] = None,
+    vacuum: bool = True,
+) -> (Dict[str, int], Optional[str]):
+    """Removes the given datafiles -- or all datafiles for <election_id> (and <juris_id>, if given) --
+    and all their VoteCounts, in one transaction, without asking for confirmation. Saved candidate
+    vote counts affected by the removal are recomputed in the same transaction.
+    Returns a dictionary of the number of rows deleted from each table, and an error string (or None).
+    If <vacuum>, VoteCount and _datafile are vacuumed and analyzed afterwards."""
+    counts = {"VoteCount": 0, "_datafile": 0}
+    if datafile_ids is None and election_id is None:
+        return counts, "No datafiles or election specified for removal"
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    try:
+        # all datafiles to be removed, with their elections
+        q = sql.SQL('SELECT "Id", "Election_Id", "ReportingUnit_Id" FROM _datafile WHERE TRUE')
+        str_vars = list()
+        if datafile_ids is not None:
+            q += sql.SQL(' AND "Id" = ANY(%s)')
+            str_vars.append(list(datafile_ids))
+        if election_id is not None:
+            q += sql.SQL(' AND "Election_Id" = %s')
+            str_vars.append(election_id)
+        if juris_id is not None:
+            q += sql.SQL(' AND "ReportingUnit_Id" = %s')
+            str_vars.append(juris_id)
+        cursor.execute(q, str_vars)
+        files = cursor.fetchall()
+        ids = [d for (d, e, r) in files]
+
+        if vote_count_partitioning(cursor) == "none":
+            # everything in one statement (the foreign key is checked at the end of the statement)
+            cursor.execute(
+                """WITH vc AS (
+                    DELETE FROM "VoteCount" WHERE "_datafile_Id" = ANY(%s) RETURNING 1
+                ), d AS (
+                    DELETE FROM _datafile WHERE "Id" = ANY(%s) RETURNING 1
+                )
+                SELECT (SELECT COUNT(*) FROM vc), (SELECT COUNT(*) FROM d)""",
+                [ids, ids],
+            )
+            counts["VoteCount"], counts["_datafile"] = cursor.fetchall()[0]
+        else:
+            # count, then drop or truncate partitions where possible
+            for datafile_id, e_id, r_id in files:
+                cursor.execute(
+                    """SELECT COUNT(*) FROM "VoteCount" WHERE "Election_Id" = %s AND "_datafile_Id" = %s""",
+                    [e_id, datafile_id],
+                )
+                counts["VoteCount"] += cursor.fetchall()[0][0]
+                delete_vote_counts_for_datafile(cursor, e_id, datafile_id)
+            cursor.execute('DELETE FROM _datafile WHERE "Id" = ANY(%s)', [ids])
+            counts["_datafile"] = cursor.rowcount
+        for e_id, r_id in {(e, r) for (d, e, r) in files}:
+            refresh_candidate_votecount_slices(cursor, e_id, r_id)
+        bump_data_versions(cursor, list({e for (d, e, r) in files}))
+        connection.commit()
+        err_str = None
+    except Exception as exc:
+        connection.rollback()
+        counts = {"VoteCount": 0, "_datafile": 0}
+        err_str = f"Error removing data: {exc}"
+    cursor.close()
+    connection.close()
+
+    if vacuum and not err_str and counts["_datafile"] > 0:
+        err_str = vacuum_analyze(engine, ["VoteCount", "_datafile"])
+    return counts, err_str
+
+
+def vacuum_analyze(engine, tables: List[str]) -> Optional[str]:
+    """Reclaims space and refreshes planner statistics for the given <tables>
+    (e.g., after a large delete). Returns an error string (or None)."""
+    # VACUUM cannot run inside a transaction block
+    conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    err_list = list()
+    for table in tables:
+        try:
+            conn.execute(f'VACUUM (ANALYZE) "{table}"')
+        except Exception as exc:
+            err_list.append(f"{table}: {exc}")
+    conn.close()
+    if err_list:
+        return f"Error vacuuming tables: {'; '.join(err_list)}"
+    return None
+
+
 def get_input_options(session, input, verbose):
     """Returns a list of response options based on the input"""
     # input comes as a pythonic (snake case) input, need to
@@ -1244,17 +2468,16 @@ def get_jurisdiction_hierarchy(session, jurisdiction_id):
         SELECT  *
         FROM    (
         SELECT  rut."Id"
-        FROM    "ComposingReportingUnitJoin" cruj
-                JOIN "ReportingUnit" ru on cruj."ChildReportingUnit_Id" = ru."Id"
+        FROM    "ReportingUnit" top
+                JOIN "ReportingUnit" ru on ru.path @> ARRAY[top."Id"] AND ru.depth = top.depth + 1
                 JOIN "ReportingUnitType" rut on ru."ReportingUnitType_Id" = rut."Id"
         WHERE   rut."Txt" not in %s
-                AND ARRAY_LENGTH(regexp_split_to_array("Name", ';'), 1) = 2
-                AND "ParentReportingUnit_Id" = %s
+                AND top."Id" = %s
         UNION
         -- This union accommodates Alaska without breaking other states
         SELECT  rut."Id"
-        FROM    "ComposingReportingUnitJoin" cruj
-                JOIN "ReportingUnit" ru on cruj."ChildReportingUnit_Id" = ru."Id"
+        FROM    "ReportingUnit" top
+                JOIN "ReportingUnit" ru on ru.path @> ARRAY[top."Id"] AND ru.depth = top.depth + 1
                 JOIN "ReportingUnitType" rut on ru."ReportingUnitType_Id" = rut."Id"
         WHERE   rut."Txt" not in (    
                     'state',
@@ -1262,8 +2485,7 @@ def get_jurisdiction_hierarchy(session, jurisdiction_id):
                     'judicial',
                     'state-senate'
                 )
-                AND ARRAY_LENGTH(regexp_split_to_array("Name", ';'), 1) = 2
-                AND "ParentReportingUnit_Id" = %s
+                AND top."Id" = %s
         ) c
         LIMIT   1
     """
@@ -1282,29 +2504,41 @@ def get_jurisdiction_hierarchy(session, jurisdiction_id):
     return subdivision_type_id
 
 
-def get_candidate_votecounts(session, election_id, top_ru_id, subdivision_type_id):
-    connection = session.bind.raw_connection()
-    cursor = connection.cursor()
-    q = sql.SQL(
-        """
-        WITH RECURSIVE unit_hierarchy AS (
-            SELECT  c.*
-            FROM    "ComposingReportingUnitJoin" c
-            WHERE   "ParentReportingUnit_Id" = %s
-            UNION
-            SELECT  c.*
-            FROM    unit_hierarchy h
-                    JOIN "ComposingReportingUnitJoin" c ON h."ChildReportingUnit_Id" = c."ParentReportingUnit_Id"
-                    JOIN "ReportingUnit" ru ON c."ParentReportingUnit_Id" = ru."Id"
-            WHERE   ru."ReportingUnitType_Id" = %s
-        )
-        , unit_hierarchy_named AS (
-            SELECT  DISTINCT c."ParentReportingUnit_Id", c."ChildReportingUnit_Id", 
+# columns of the result of get_candidate_votecounts, in the order of candidate_votecounts_query
+candidate_votecounts_columns = [
+    "VoteCount_Id",
+    "Count",
+    "CountItemType_Id",
+    "ReportingUnit_Id",
+    "Contest_Id",
+    "Selection_Id",
+    "Election_Id",
+    "ParentReportingUnit_Id",
+    "Name",
+    "ReportingUnitType_Id",
+    "ParentName",
+    "ParentReportingUnitType_Id",
+    "CountItemType",
+    "Contest",
+    "Selection",
+    "ElectionDistrict_Id",
+    "Candidate_Id",
+    "contest_type",
+    "contest_district_type",
+    "Party",
+]
+
+# parameters: top_ru_id, subdivision_type_id, subdivision_type_id, election_id
+candidate_votecounts_query = """
+        -- pairs (subdivision of top RU, any RU nested in that subdivision)
+        WITH unit_hierarchy_named AS (
+            SELECT  pru."Id" AS "ParentReportingUnit_Id", cru."Id" AS "ChildReportingUnit_Id",
                     pru."Name" AS "ParentName", pru."ReportingUnitType_Id" AS "ParentReportingUnitType_Id",
                     cru."Name" AS "ChildName", cru."ReportingUnitType_Id" AS "ChildReportingUnitType_Id"
-            FROM    unit_hierarchy c
-                    JOIN "ReportingUnit" pru ON c."ParentReportingUnit_Id" = pru."Id"
-                    JOIN "ReportingUnit" cru ON c."ChildReportingUnit_Id" = cru."Id"
+            FROM    "ReportingUnit" pru
+                    JOIN "ReportingUnit" cru ON cru.path @> ARRAY[pru."Id"]
+            WHERE   pru.path @> ARRAY[%s]::integer[]
+                    AND pru."ReportingUnitType_Id" = %s
         )
             SELECT  vc."Id" AS "VoteCount_Id", "Count", "CountItemType_Id",
                     vc."ReportingUnit_Id", "Contest_Id", "Selection_Id",
@@ -1326,36 +2560,351 @@ def get_candidate_votecounts(session, election_id, top_ru_id, subdivision_type_i
                     JOIN "ReportingUnit" ED ON O."ElectionDistrict_Id" = ED."Id"
                     JOIN "ReportingUnitType" EDRUT ON ED."ReportingUnitType_Id" = EDRUT."Id"
                     JOIN "Party" p on CS."Party_Id" = p."Id"
-    """
+"""
+
+
+def get_candidate_votecounts(
+    session, election_id, top_ru_id, subdivision_type_id, use_materialized: bool = True
+):
+    """Candidate vote counts for <election_id> in every unit within <top_ru_id>, each with
+    the subdivision (of type <subdivision_type_id>) containing it. If <use_materialized>,
+    results are read from (or, the first time, saved to) the table _candidate_votecounts"""
+    connection = session.bind.raw_connection()
+    cursor = connection.cursor()
+    result = None
+    if use_materialized:
+        try:
+            result = materialized_candidate_votecounts(
+                cursor, election_id, top_ru_id, subdivision_type_id
+            )
+            connection.commit()
+        except Exception:
+            # e.g., database is read-only; fall back to the query itself
+            connection.rollback()
+            result = None
+    if result is None:
+        cursor.execute(
+            candidate_votecounts_query,
+            [top_ru_id, subdivision_type_id, subdivision_type_id, election_id],
+        )
+        result = cursor.fetchall()
+    cursor.close()
+    connection.close()
+    result_df = pd.DataFrame(result, columns=candidate_votecounts_columns)
+    return result_df
+
+
+def materialized_candidate_votecounts(
+    cursor, election_id: int, top_ru_id: int, subdivision_type_id: int
+) -> Optional[list]:
+    """Reads the slice of _candidate_votecounts for the given election, top ReportingUnit and
+    subdivision type, computing and saving it first if necessary (caller must commit).
+    Returns None if the database has no _candidate_votecounts table"""
+    cursor.execute("SELECT to_regclass('_candidate_votecounts_status')")
+    if not cursor.fetchall()[0][0]:
+        return None
+    key = [election_id, top_ru_id, subdivision_type_id]
+    q_fresh = """SELECT 1 FROM _candidate_votecounts_status
+        WHERE "Election_Id" = %s AND "TopReportingUnit_Id" = %s AND "SubdivisionType_Id" = %s"""
+    cursor.execute(q_fresh, key)
+    if not cursor.fetchall():
+        # serialize computation of the slice; another session may have finished it meanwhile
+        cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [election_id, top_ru_id])
+        cursor.execute(q_fresh, key)
+        if not cursor.fetchall():
+            compute_candidate_votecount_slice(cursor, election_id, top_ru_id, subdivision_type_id)
+    q = sql.SQL(
+        """SELECT {columns} FROM _candidate_votecounts
+        WHERE "Slice_Election_Id" = %s AND "TopReportingUnit_Id" = %s AND "SubdivisionType_Id" = %s"""
+    ).format(columns=sql.SQL(", ").join(map(sql.Identifier, candidate_votecounts_columns)))
+    cursor.execute(q, key)
+    return cursor.fetchall()
+
+
+def compute_candidate_votecount_slice(
+    cursor, election_id: int, top_ru_id: int, subdivision_type_id: int
+):
+    """(Re)computes the slice of _candidate_votecounts for the given election, top ReportingUnit
+    and subdivision type, and marks it up to date (caller must commit)"""
+    key = [election_id, top_ru_id, subdivision_type_id]
+    cursor.execute(
+        """DELETE FROM _candidate_votecounts
+        WHERE "Slice_Election_Id" = %s AND "TopReportingUnit_Id" = %s AND "SubdivisionType_Id" = %s""",
+        key,
+    )
+    q = sql.SQL(
+        """INSERT INTO _candidate_votecounts ("Slice_Election_Id", "TopReportingUnit_Id",
+            "SubdivisionType_Id", {columns})
+        SELECT %s, %s, %s, q.* FROM ({query}) q"""
+    ).format(
+        columns=sql.SQL(", ").join(map(sql.Identifier, candidate_votecounts_columns)),
+        query=sql.SQL(candidate_votecounts_query),
     )
     cursor.execute(
-        q, [top_ru_id, subdivision_type_id, subdivision_type_id, election_id]
+        q, key + [top_ru_id, subdivision_type_id, subdivision_type_id, election_id]
     )
-    result = cursor.fetchall()
-    result_df = pd.DataFrame(result)
-    result_df.columns = [
-        "VoteCount_Id",
-        "Count",
-        "CountItemType_Id",
-        "ReportingUnit_Id",
-        "Contest_Id",
-        "Selection_Id",
-        "Election_Id",
-        "ParentReportingUnit_Id",
-        "Name",
-        "ReportingUnitType_Id",
-        "ParentName",
-        "ParentReportingUnitType_Id",
-        "CountItemType",
-        "Contest",
-        "Selection",
-        "ElectionDistrict_Id",
-        "Candidate_Id",
-        "contest_type",
-        "contest_district_type",
-        "Party",
-    ]
-    return result_df
+    cursor.execute(
+        """INSERT INTO _candidate_votecounts_status
+            ("Election_Id", "TopReportingUnit_Id", "SubdivisionType_Id")
+        VALUES (%s, %s, %s)
+        ON CONFLICT ("Election_Id", "TopReportingUnit_Id", "SubdivisionType_Id")
+        DO UPDATE SET refreshed_at = now()""",
+        key,
+    )
+    return
+
+
+def refresh_candidate_votecount_slices(cursor, election_id: int, jurisdiction_id: int) -> int:
+    """Recomputes every saved slice of _candidate_votecounts for <election_id> whose top
+    ReportingUnit contains, or is contained in, <jurisdiction_id> -- i.e., every slice
+    that data for that election and jurisdiction can affect (caller must commit).
+    Returns the number of slices recomputed."""
+    cursor.execute("SELECT to_regclass('_candidate_votecounts_status')")
+    if not cursor.fetchall()[0][0]:
+        return 0
+    cursor.execute(
+        """SELECT s."TopReportingUnit_Id", s."SubdivisionType_Id"
+        FROM _candidate_votecounts_status s
+        JOIN "ReportingUnit" t ON s."TopReportingUnit_Id" = t."Id"
+        JOIN "ReportingUnit" j ON j."Id" = %s
+        WHERE s."Election_Id" = %s
+            AND (t.path @> ARRAY[j."Id"] OR j.path @> ARRAY[t."Id"])""",
+        [jurisdiction_id, election_id],
+    )
+    slices = cursor.fetchall()
+    for top_ru_id, subdivision_type_id in slices:
+        compute_candidate_votecount_slice(cursor, election_id, top_ru_id, subdivision_type_id)
+    return len(slices)
+
+
+def refresh_candidate_votecounts(
+    engine, election_id: int, jurisdiction_id: int
+) -> (int, Optional[str]):
+    """Recomputes, in one transaction, the saved candidate vote counts affected by data for
+    <election_id> in <jurisdiction_id> (see refresh_candidate_votecount_slices).
+    Returns the number of slices recomputed and an error string (or None)."""
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    try:
+        n = refresh_candidate_votecount_slices(cursor, election_id, jurisdiction_id)
+        connection.commit()
+        err_str = None
+    except Exception as exc:
+        connection.rollback()
+        n = 0
+        err_str = f"Unable to refresh saved candidate vote counts: {exc}"
+    cursor.close()
+    connection.close()
+    return n, err_str
+
+
+def bump_data_versions(cursor, election_ids: List[int]):
+    """Gives each election in <election_ids>, and the database as a whole, a new data version
+    (see create_cdf_db.data_version_ddl), invalidating cached results (caller must commit)"""
+    cursor.execute("SELECT to_regclass('_data_version')")
+    if not cursor.fetchall()[0][0]:
+        return
+    cursor.execute(
+        """INSERT INTO _data_version ("Election_Id", version)
+        SELECT e, md5(random()::text || clock_timestamp()::text)
+        FROM unnest(%s::integer[]) AS e
+        ON CONFLICT ("Election_Id") DO UPDATE SET version = EXCLUDED.version, updated_at = now()""",
+        [sorted({int(e) for e in election_ids} | {0})],
+    )
+    return
+
+
+def record_data_change(engine, election_ids: List[int]) -> Optional[str]:
+    """Records that data for the elections in <election_ids> (or just, if the list is empty,
+    something in the database) has changed, by bumping data versions (see bump_data_versions).
+    Returns an error string (or None)."""
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    try:
+        bump_data_versions(cursor, election_ids)
+        connection.commit()
+        err_str = None
+    except Exception as exc:
+        connection.rollback()
+        err_str = f"Unable to record data change: {exc}"
+    cursor.close()
+    connection.close()
+    return err_str
+
+
+def data_versions(engine, election_ids: List[int]) -> Optional[Dict[int, str]]:
+    """Current data versions of the elections in <election_ids> (0 for the database as a whole),
+    with "" for any never changed; or None if the database does not track data versions"""
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT to_regclass('_data_version')")
+        if cursor.fetchall()[0][0]:
+            ids = [int(e) for e in election_ids]
+            cursor.execute(
+                """SELECT "Election_Id", version FROM _data_version WHERE "Election_Id" = ANY(%s)""",
+                [ids],
+            )
+            versions = {e: "" for e in ids}
+            versions.update(dict(cursor.fetchall()))
+        else:
+            versions = None
+    except Exception:
+        versions = None
+    cursor.close()
+    connection.close()
+    return versions
+
+
+def add_derived_tables(engine) -> Optional[str]:
+    """Brings databases created before the derived tables (see
+    create_cdf_db.vote_count_rollup_ddl, create_cdf_db.candidate_votecounts_ddl and
+    create_cdf_db.data_version_ddl) up to date by creating them, empty. Summaries are filled by refresh_vote_count_rollup (until then,
+    rollups read VoteCount directly); saved candidate vote counts are filled as they are read.
+    Cheap if nothing needs doing. Returns an error string (or None)."""
+    try:
+        connection = engine.raw_connection()
+    except Exception as exc:
+        return f"Unable to create derived tables: {exc}"
+    cursor = connection.cursor()
+    try:
+        for q in (
+            db_cdf.vote_count_rollup_ddl()
+            + db_cdf.candidate_votecounts_ddl()
+            + db_cdf.data_version_ddl()
+        ):
+            cursor.execute(q)
+        connection.commit()
+        err_str = None
+    except Exception as exc:
+        connection.rollback()
+        err_str = f"Unable to create derived tables: {exc}"
+    cursor.close()
+    connection.close()
+    return err_str
+
+
+def invalidate_vote_count_rollup(engine, datafile_id: int) -> Optional[str]:
+    """Marks the summary of the VoteCounts from datafile <datafile_id> as out of date
+    (e.g., before more VoteCounts are loaded from it). Returns an error string (or None)."""
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            'DELETE FROM _vote_count_rollup_status WHERE "_datafile_Id" = %s', [datafile_id]
+        )
+        connection.commit()
+        err_str = None
+    except Exception as exc:
+        connection.rollback()
+        err_str = f"Unable to invalidate VoteCount summary: {exc}"
+    cursor.close()
+    connection.close()
+    return err_str
+
+
+def invalidate_all_vote_count_rollups(cursor):
+    """Marks the summaries of the VoteCounts from all datafiles as out of date
+    (e.g., when the nesting of ReportingUnits changes), within the transaction of <cursor>"""
+    cursor.execute("SELECT to_regclass('_vote_count_rollup_status')")
+    if cursor.fetchall()[0][0]:
+        cursor.execute("DELETE FROM _vote_count_rollup_status")
+    return
+
+
+def invalidate_reporting_unit_hierarchy(cursor):
+    """Marks everything derived from the nesting of ReportingUnits as out of date (e.g., when
+    the path of a ReportingUnit changes), within the transaction of <cursor>: the summaries of
+    the VoteCounts from all datafiles, all saved candidate vote counts and the data versions of
+    all elections (and so any cached results)"""
+    invalidate_all_vote_count_rollups(cursor)
+    cursor.execute("SELECT to_regclass('_candidate_votecounts_status')")
+    if cursor.fetchall()[0][0]:
+        cursor.execute("DELETE FROM _candidate_votecounts_status")
+    cursor.execute('SELECT "Id" FROM "Election"')
+    bump_data_versions(cursor, [e for (e,) in cursor.fetchall()])
+    return
+
+
+def refresh_vote_count_rollup(
+    engine, datafile_ids: Optional[List[int]] = None
+) -> (int, Optional[str]):
+    """Recomputes, in one transaction, the summary of VoteCounts for the given datafiles
+    (or for all datafiles whose summary is out of date) and marks those summaries as up to date.
+    Returns the number of datafiles refreshed and an error string (or None)."""
+    q_files = """SELECT d."Id" FROM _datafile d
+        LEFT JOIN _vote_count_rollup_status s ON d."Id" = s."_datafile_Id"
+        WHERE s."_datafile_Id" IS NULL"""
+    q_refresh = """DELETE FROM _vote_count_rollup WHERE "_datafile_Id" = ANY(%(ids)s);
+        INSERT INTO _vote_count_rollup ("Election_Id", "ParentReportingUnit_Id", "Contest_Id",
+            "Selection_Id", "CountItemType_Id", "_datafile_Id", "Count")
+        SELECT vc."Election_Id", p.parent, vc."Contest_Id", vc."Selection_Id", vc."CountItemType_Id",
+            vc."_datafile_Id", SUM(vc."Count")
+        FROM "VoteCount" vc
+        JOIN "ReportingUnit" ru ON vc."ReportingUnit_Id" = ru."Id"
+        -- each unit is counted in every unit containing it (its path), including itself
+        CROSS JOIN LATERAL unnest(ru.path) AS p(parent)
+        WHERE vc."_datafile_Id" = ANY(%(ids)s)
+        GROUP BY vc."Election_Id", p.parent, vc."Contest_Id", vc."Selection_Id",
+            vc."CountItemType_Id", vc."_datafile_Id";
+        INSERT INTO _vote_count_rollup_status ("_datafile_Id")
+        SELECT "Id" FROM _datafile WHERE "Id" = ANY(%(ids)s)
+        ON CONFLICT ("_datafile_Id") DO UPDATE SET refreshed_at = now();"""
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    try:
+        if datafile_ids is None:
+            cursor.execute(q_files)
+            datafile_ids = [x for (x,) in cursor.fetchall()]
+        if datafile_ids:
+            cursor.execute(q_refresh, {"ids": list(datafile_ids)})
+        connection.commit()
+        err_str = None
+    except Exception as exc:
+        connection.rollback()
+        datafile_ids = []
+        err_str = f"Unable to refresh VoteCount summary: {exc}"
+    cursor.close()
+    connection.close()
+    return len(datafile_ids), err_str
+
+
+def vote_count_rollup_is_fresh(cursor, datafile_list: iter, by: str = "Id") -> bool:
+    """True if the VoteCount summary is up to date for every datafile in <datafile_list>
+    (Ids if by="Id", short_names if by="short_name")"""
+    if not datafile_list:
+        return False
+    cursor.execute("SELECT to_regclass('_vote_count_rollup_status')")
+    if not cursor.fetchall()[0][0]:
+        return False
+    q = sql.SQL(
+        """SELECT COUNT(*) FROM _datafile d
+        LEFT JOIN _vote_count_rollup_status s ON d."Id" = s."_datafile_Id"
+        WHERE d.{by} IN %s AND s."_datafile_Id" IS NULL"""
+    ).format(by=sql.Identifier(by))
+    cursor.execute(q, [tuple(datafile_list)])
+    return cursor.fetchall()[0][0] == 0
+
+
+# columns of rollups, in the order of the query built by rollup_query
+rollup_columns = [
+    "contest_type",
+    "contest",
+    "contest_district_type",
+    "selection",
+    "reporting_unit",
+    "count_item_type",
+    "count",
+]
+# parameters of rollup queries, in order, with their types
+rollup_parameters = [
+    ("election_id", "integer"),
+    ("top_ru_id", "integer"),
+    ("sub_unit_type_id", "integer"),
+    ("datafile_ids", "integer[]"),
+    ("excluded_count_item_type_id", "integer"),
+    ("contest_id", "integer"),
+]
 
 
 def export_rollup_from_db(
@@ -1368,150 +2917,492 @@ def export_rollup_from_db(
     by: str = "Id",
     exclude_redundant_total: bool = False,
     by_vote_type: bool = False,
-    contest: Optional[str] = None
+    contest: Optional[str] = None,
+    use_rollup: bool = True,
 ) -> (pd.DataFrame, Optional[str]):
     """Return a dataframe of rolled-up results and an error string.
     If by_vote_type, return separate rows for each vote type.
-    If exclude_redundant_total then, if both total and other vote types are given, exclude total"""
+    If exclude_redundant_total then, if both total and other vote types are given, exclude total.
+    If <use_rollup> and the VoteCount summary is up to date for all the datafiles,
+    read from the summary rather than summing VoteCount.
+    Names are resolved to Ids here; see export_rollup_from_ids"""
+    election_id = name_to_id_cursor(cursor, "Election", election)
+    top_ru_id = name_to_id_cursor(cursor, "ReportingUnit", top_ru)
+    sub_unit_type_id = name_to_id_cursor(cursor, "ReportingUnitType", sub_unit_type)
+    datafile_ids, err_str = datafile_ids_from_list(cursor, datafile_list, by=by)
+    if err_str:
+        return pd.DataFrame(columns=rollup_columns), err_str
+    if contest:
+        contest_id = name_to_id_cursor(cursor, "Contest", contest)
+        if contest_id is None:
+            return pd.DataFrame(columns=rollup_columns), None
+    else:
+        contest_id = None
+    return export_rollup_from_ids(
+        cursor,
+        top_ru_id,
+        election_id,
+        sub_unit_type_id,
+        contest_type,
+        datafile_ids,
+        exclude_redundant_total=exclude_redundant_total,
+        by_vote_type=by_vote_type,
+        contest_id=contest_id,
+        use_rollup=use_rollup,
+    )
+
+
+def export_rollup_from_ids(
+    cursor,
+    top_ru_id: int,
+    election_id: int,
+    sub_unit_type_id: int,
+    contest_type: str,
+    datafile_ids: List[int],
+    exclude_redundant_total: bool = False,
+    by_vote_type: bool = False,
+    contest_id: Optional[int] = None,
+    use_rollup: bool = True,
+) -> (pd.DataFrame, Optional[str]):
+    """As export_rollup_from_db, but with everything given by Id. The query is prepared once
+    per connection (for each contest type, by_vote_type and source of counts), so repeated
+    rollups are not re-planned."""
+    if contest_type not in ["Candidate", "BallotMeasure"]:
+        err_str = f"Unrecognized contest_type: {contest_type}. No results exported"
+        return pd.DataFrame(columns=rollup_columns), err_str
+    use_rollup = use_rollup and vote_count_rollup_is_fresh(cursor, datafile_ids)
+    parameters = rollup_parameter_values(
+        cursor,
+        top_ru_id,
+        election_id,
+        sub_unit_type_id,
+        datafile_ids,
+        exclude_redundant_total,
+        contest_id,
+    )
+    try:
+        name = prepare_rollup_query(cursor, contest_type, by_vote_type, use_rollup)
+        q = sql.SQL("EXECUTE {name} ({values})").format(
+            name=sql.Identifier(name),
+            values=sql.SQL(", ").join(sql.Placeholder() * len(rollup_parameters)),
+        )
+        cursor.execute(q, [parameters[p] for (p, t) in rollup_parameters])
+        results = cursor.fetchall()
+        results_df = pd.DataFrame(results)
+        if not results_df.empty:
+            results_df.columns = rollup_columns
+        err_str = None
+    except Exception as exc:
+        results_df = pd.DataFrame()
+        err_str = f"No results exported due to database error: {exc}"
+    return results_df, err_str
+
+
+def export_rollup_to_file(
+    cursor,
+    out,
+    top_ru_id: int,
+    election_id: int,
+    sub_unit_type_id: int,
+    contest_type: str,
+    datafile_ids: List[int],
+    exclude_redundant_total: bool = False,
+    by_vote_type: bool = False,
+    contest_id: Optional[int] = None,
+    use_rollup: bool = True,
+) -> Optional[str]:
+    """Streams rolled-up results (as from export_rollup_from_ids) as tab-separated text, with a
+    header row, to <out> (a file path or a writable stream), via COPY ... TO STDOUT.
+    Rows go straight from the database to <out>, so memory use does not grow with the
+    size of the rollup. Returns an error string (or None)."""
+    if contest_type not in ["Candidate", "BallotMeasure"]:
+        return f"Unrecognized contest_type: {contest_type}. No results exported"
+    use_rollup = use_rollup and vote_count_rollup_is_fresh(cursor, datafile_ids)
+    parameters = rollup_parameter_values(
+        cursor,
+        top_ru_id,
+        election_id,
+        sub_unit_type_id,
+        datafile_ids,
+        exclude_redundant_total,
+        contest_id,
+    )
+    try:
+        # COPY cannot run a prepared statement and takes no parameters, so the values are bound here
+        q = rollup_query(contest_type, by_vote_type, use_rollup).as_string(cursor)
+        copy_q = sql.SQL(
+            "COPY ({q}) TO STDOUT WITH (FORMAT csv, DELIMITER E'\\t')"
+        ).format(q=sql.SQL(cursor.mogrify(q, parameters).decode()))
+        header = "\t".join(rollup_columns) + "\n"
+        if isinstance(out, str):
+            with open(out, "w", newline="") as f:
+                f.write(header)
+                cursor.copy_expert(copy_q, f)
+        else:
+            out.write(header)
+            cursor.copy_expert(copy_q, out)
+        err_str = None
+    except Exception as exc:
+        cursor.connection.rollback()
+        if isinstance(out, str) and os.path.isfile(out):
+            os.remove(out)
+        err_str = f"No results exported due to database error: {exc}"
+    return err_str
+
+
+def datafile_ids_from_list(
+    cursor, datafile_list: iter, by: str = "Id"
+) -> (List[int], Optional[str]):
+    """Ids of the datafiles in <datafile_list> (Ids if by="Id", short_names if by="short_name")"""
+    if by == "Id":
+        return [int(x) for x in datafile_list], None
+    q = sql.SQL('SELECT "Id" FROM _datafile WHERE {by} = ANY(%s)').format(
+        by=sql.Identifier(by)
+    )
+    try:
+        cursor.execute(q, [list(datafile_list)])
+        ids = [x for (x,) in cursor.fetchall()]
+        err_str = None
+    except Exception as exc:
+        ids = list()
+        err_str = f"Database error pulling Ids of datafiles: {exc}"
+    return ids, err_str
+
+
+def rollup_parameter_values(
+    cursor,
+    top_ru_id: int,
+    election_id: int,
+    sub_unit_type_id: int,
+    datafile_ids: List[int],
+    exclude_redundant_total: bool,
+    contest_id: Optional[int],
+) -> dict:
+    """Values of the parameters of rollup queries (see rollup_parameters)"""
+    excluded_count_item_type_id = None
+    if exclude_redundant_total:
+        active = active_vote_types_from_ids(
+            cursor, election_id=election_id, jurisdiction_id=top_ru_id
+        )
+        if len(active) > 1 and "total" in active:
+            excluded_count_item_type_id = name_to_id_cursor(cursor, "CountItemType", "total")
+    return {
+        "election_id": election_id,
+        "top_ru_id": top_ru_id,
+        "sub_unit_type_id": sub_unit_type_id,
+        "datafile_ids": [int(x) for x in datafile_ids],
+        "excluded_count_item_type_id": excluded_count_item_type_id,
+        "contest_id": contest_id,
+    }
+
+
+def prepare_rollup_query(
+    cursor, contest_type: str, by_vote_type: bool, use_rollup: bool
+) -> str:
+    """Prepares the rollup query for the given options on the cursor's connection, unless it is
+    already prepared there. Returns the name of the prepared statement."""
+    name = f"rollup_{contest_type}_{'by_vote_type' if by_vote_type else 'total'}_{'summary' if use_rollup else 'vote_count'}".lower()
+    cursor.execute("SELECT 1 FROM pg_prepared_statements WHERE name = %s", [name])
+    if not cursor.fetchall():
+        # prepared statements take positional parameters $1, $2, ...
+        q = rollup_query(contest_type, by_vote_type, use_rollup).as_string(cursor) % {
+            p: f"${i + 1}" for i, (p, t) in enumerate(rollup_parameters)
+        }
+        cursor.execute(
+            sql.SQL("PREPARE {name} ({types}) AS {q}").format(
+                name=sql.Identifier(name),
+                types=sql.SQL(", ").join(sql.SQL(t) for (p, t) in rollup_parameters),
+                q=sql.SQL(q),
+            )
+        )
+    return name
 
-    # define the 'where' sql clause based on restrictions from parameters
-    # and the string variables to be passed to query
-    restrict = ""
-    group_and_order_by = """C."Name", EDRUT."Txt", Cand."BallotName", IntermediateRU."Name" """
-    string_vars = [election, top_ru, sub_unit_type, tuple(datafile_list)]
 
+def rollup_query(contest_type: str, by_vote_type: bool, use_rollup: bool) -> sql.Composed:
+    """Query for rolled-up results (see export_rollup_from_ids), filtering on Ids only,
+    with named placeholders for the values in rollup_parameters.
+    If <use_rollup>, counts are read from the VoteCount summary; otherwise from VoteCount"""
+    group_and_order_by = """C."Name", EDRUT."Txt", Sel."Name", IntermediateRU."Name" """
     if by_vote_type:
         count_item_type_sql = sql.SQL("CIT.{txt}").format(txt=sql.Identifier("Txt"))
         group_and_order_by += """, CIT."Txt" """
     else:
         count_item_type_sql = sql.SQL("'total'")
 
-    if exclude_redundant_total:
-        election_id = name_to_id_cursor(cursor, "Election", election)
-        jurisdiction_id = name_to_id_cursor(cursor, "ReportingUnit", top_ru)
-        active = active_vote_types_from_ids(cursor, election_id=election_id, jurisdiction_id=jurisdiction_id)
-        if len(active) > 1 and 'total' in active:
-            restrict += """ AND CIT."Txt" != 'total' """
-
-    if contest:
-        restrict += """ AND C."Name" = %s """
-        string_vars.append(contest)
-
-    columns = [
-        "contest_type",
-        "contest",
-        "contest_district_type",
-        "selection",
-        "reporting_unit",
-        "count_item_type",
-        "count",
-    ]
-    if contest_type == "Candidate":
-        q = sql.SQL(
-            """
-        SELECT 'Candidate' contest_type,
+    return sql.SQL(
+        """
+        SELECT {contest_type} contest_type,
             C."Name" "Contest",
             EDRUT."Txt" contest_district_type,
-            Cand."BallotName" "Selection",
+            Sel."Name" "Selection",
             IntermediateRU."Name" "ReportingUnit",
             {count_item_type_sql} "CountItemType",
             sum(vc."Count") "Count"
-        FROM "VoteCount" vc
-        LEFT JOIN _datafile d on vc."_datafile_Id" = d."Id"
-        LEFT JOIN "Contest" C on vc."Contest_Id" = C."Id"
-        LEFT JOIN "CandidateSelection" CS on CS."Id" = vc."Selection_Id"
-        LEFT JOIN "Candidate" Cand on CS."Candidate_Id" = Cand."Id"
-        LEFT JOIN "Election" e on vc."Election_Id" = e."Id"
-        -- sum over all children
-        LEFT JOIN "ReportingUnit" ChildRU on vc."ReportingUnit_Id" = ChildRU."Id"
-        LEFT JOIN "ComposingReportingUnitJoin" CRUJ_sum on ChildRU."Id" = CRUJ_sum."ChildReportingUnit_Id"
-        -- roll up to the intermediate RUs
-        LEFT JOIN "ReportingUnit" IntermediateRU on CRUJ_sum."ParentReportingUnit_Id" =IntermediateRU."Id"
-        LEFT JOIN "ReportingUnitType" IntermediateRUT on IntermediateRU."ReportingUnitType_Id" = IntermediateRUT."Id"
-        -- intermediate RUs must nest in top RU
-        LEFT JOIN "ComposingReportingUnitJoin" CRUJ_top on IntermediateRU."Id" = CRUJ_top."ChildReportingUnit_Id"
-        LEFT JOIN "ReportingUnit" TopRU on CRUJ_top."ParentReportingUnit_Id" = TopRU."Id"
-        LEFT JOIN "CountItemType" CIT on vc."CountItemType_Id" = CIT."Id"
-        LEFT JOIN "CandidateContest" on C."Id" = "CandidateContest"."Id"
-        LEFT JOIN "Office" O on "CandidateContest"."Office_Id" = O."Id"
-        LEFT JOIN "ReportingUnit" ED on O."ElectionDistrict_Id" = ED."Id"
-        LEFT JOIN "ReportingUnitType" EDRUT on ED."ReportingUnitType_Id" = EDRUT."Id"
-        WHERE C.contest_type = 'Candidate'
-            AND e."Name" = %s -- election name
-            AND TopRU."Name" = %s  -- top RU
-            AND IntermediateRUT."Txt" = %s  -- intermediate_reporting_unit_type
-            AND d.{by} in %s  -- tuple of datafile short_names (if by='short_name) or Ids (if by="Id")
-            {restrict}
+        {source_sql}
+            AND IntermediateRU."ReportingUnitType_Id" = %(sub_unit_type_id)s
         GROUP BY {group_and_order_by}
-        ORDER BY {group_and_order_by};
+        ORDER BY {group_and_order_by}
         """
-        ).format(
-            count_item_type_sql=count_item_type_sql,
-            by=sql.Identifier(by),
-            group_and_order_by=sql.SQL(group_and_order_by),
-            restrict=sql.SQL(restrict),
-        )
+    ).format(
+        contest_type=sql.Literal(contest_type),
+        count_item_type_sql=count_item_type_sql,
+        source_sql=rollup_source_sql(contest_type, use_rollup),
+        group_and_order_by=sql.SQL(group_and_order_by),
+    )
 
-    elif contest_type == "BallotMeasure":
-        q = sql.SQL(
-            """
-        SELECT 'Candidate' contest_type,
+
+def multilevel_rollup_query(
+    contest_type: str, by_vote_type: List[bool], use_rollup: bool
+) -> sql.Composed:
+    """Query for rolled-up results at several levels at once (see export_multilevel_rollup),
+    with named placeholders for the values in rollup_parameters, except that
+    %(sub_unit_type_ids)s, an array, replaces %(sub_unit_type_id)s.
+    One grouping set for each setting in <by_vote_type>."""
+    base = """IntermediateRU."ReportingUnitType_Id", IntermediateRUT."Txt", C."Name", EDRUT."Txt", Sel."Name", IntermediateRU."Name" """
+    grouping_sets = [f'({base}, CIT."Txt")' if b else f"({base})" for b in sorted(set(by_vote_type))]
+    if True in by_vote_type:
+        # vote-type rows are those grouped by CountItemType
+        by_vote_type_sql = sql.SQL("""GROUPING(CIT."Txt") = 0""")
+        count_item_type_sql = sql.SQL(
+            """CASE WHEN GROUPING(CIT."Txt") = 0 THEN CIT."Txt" ELSE 'total' END"""
+        )
+    else:
+        by_vote_type_sql = sql.SQL("FALSE")
+        count_item_type_sql = sql.SQL("'total'")
+    return sql.SQL(
+        """
+        SELECT IntermediateRU."ReportingUnitType_Id",
+            {by_vote_type_sql} by_vote_type,
+            {contest_type} contest_type,
             C."Name" "Contest",
             EDRUT."Txt" contest_district_type,
-            BMS."Name" "Selection",
+            Sel."Name" "Selection",
+            IntermediateRUT."Txt" "ReportingUnitType",
             IntermediateRU."Name" "ReportingUnit",
-            CIT."Txt" "CountItemType",
+            {count_item_type_sql} "CountItemType",
             sum(vc."Count") "Count"
-        FROM "VoteCount" vc
-        LEFT JOIN _datafile d on vc."_datafile_Id" = d."Id"
-        LEFT JOIN "Contest" C on vc."Contest_Id" = C."Id"
-        LEFT JOIN "BallotMeasureContest" BMC on vc."Contest_Id" = BMC."Id"
-        LEFT JOIN "BallotMeasureSelection" BMS on BMS."Id" = vc."Selection_Id"
-        LEFT JOIN "Election" e on vc."Election_Id" = e."Id"
-        -- sum over all children
-        LEFT JOIN "ReportingUnit" ChildRU on vc."ReportingUnit_Id" = ChildRU."Id"
-        LEFT JOIN "ComposingReportingUnitJoin" CRUJ_sum on ChildRU."Id" = CRUJ_sum."ChildReportingUnit_Id"
+        {source_sql}
+            AND IntermediateRU."ReportingUnitType_Id" = ANY(%(sub_unit_type_ids)s::integer[])
+        GROUP BY GROUPING SETS ({grouping_sets})
+        -- all rows for each level (and vote type setting) together
+        ORDER BY 1, 2, C."Name", EDRUT."Txt", Sel."Name", IntermediateRU."Name", 9
+        """
+    ).format(
+        by_vote_type_sql=by_vote_type_sql,
+        count_item_type_sql=count_item_type_sql,
+        contest_type=sql.Literal(contest_type),
+        source_sql=rollup_source_sql(contest_type, use_rollup),
+        grouping_sets=sql.SQL(", ").join(sql.SQL(g) for g in grouping_sets),
+    )
+
+
+def intermediate_vote_counts_sql(use_rollup: bool) -> (sql.SQL, sql.SQL):
+    """Source of counts (vc) for rollup queries, and the join making each count count toward
+    every intermediate ReportingUnit (IntermediateRU) containing its unit"""
+    # read counts from the summary, already rolled up to each intermediate RU;
+    # otherwise sum over all children
+    if use_rollup:
+        vote_counts_sql = sql.SQL("_vote_count_rollup vc")
+        intermediate_join_sql = sql.SQL(
+            """JOIN "ReportingUnit" IntermediateRU on IntermediateRU."Id" = vc."ParentReportingUnit_Id" """
+        )
+    else:
+        vote_counts_sql = sql.SQL(""""VoteCount" vc""")
+        intermediate_join_sql = sql.SQL(
+            """JOIN "ReportingUnit" ChildRU on vc."ReportingUnit_Id" = ChildRU."Id"
+        -- roll up to the intermediate RUs (ancestors of the child, per its path)
+        JOIN "ReportingUnit" IntermediateRU on IntermediateRU."Id" = ANY(ChildRU.path)"""
+        )
+    return vote_counts_sql, intermediate_join_sql
+
+
+def rollup_source_sql(contest_type: str, use_rollup: bool) -> sql.Composed:
+    """FROM and WHERE clauses shared by rollup queries: counts (from the VoteCount summary if
+    <use_rollup>, otherwise from VoteCount) for each intermediate ReportingUnit, with names of
+    contests, selections and vote types. Restricting the type of IntermediateRU is left
+    to the caller, as an extra AND condition"""
+    vote_counts_sql, intermediate_join_sql = intermediate_vote_counts_sql(use_rollup)
+
+    if contest_type == "Candidate":
+        selection_join_sql = sql.SQL(
+            """LEFT JOIN "CandidateSelection" CS on CS."Id" = vc."Selection_Id"
+        LEFT JOIN (SELECT "Id", "BallotName" "Name" FROM "Candidate") Sel on CS."Candidate_Id" = Sel."Id"
+        LEFT JOIN "CandidateContest" CC on vc."Contest_Id" = CC."Id"
+        LEFT JOIN "Office" O on CC."Office_Id" = O."Id"
+        LEFT JOIN "ReportingUnit" ED on O."ElectionDistrict_Id" = ED."Id" """
+        )
+    else:
+        selection_join_sql = sql.SQL(
+            """LEFT JOIN "BallotMeasureContest" BMC on vc."Contest_Id" = BMC."Id"
+        LEFT JOIN "BallotMeasureSelection" Sel on Sel."Id" = vc."Selection_Id"
+        LEFT JOIN "ReportingUnit" ED on BMC."ElectionDistrict_Id" = ED."Id" """
+        )
+
+    return sql.SQL(
+        """FROM {vote_counts_sql}
+        JOIN "Contest" C on vc."Contest_Id" = C."Id" AND C.contest_type = {contest_type}
         -- roll up to the intermediate RUs
-        LEFT JOIN "ReportingUnit" IntermediateRU on CRUJ_sum."ParentReportingUnit_Id" =IntermediateRU."Id"
+        {intermediate_join_sql}
         LEFT JOIN "ReportingUnitType" IntermediateRUT on IntermediateRU."ReportingUnitType_Id" = IntermediateRUT."Id"
-        -- intermediate RUs must nest in top RU
-        LEFT JOIN "ComposingReportingUnitJoin" CRUJ_top on IntermediateRU."Id" = CRUJ_top."ChildReportingUnit_Id"
-        LEFT JOIN "ReportingUnit" TopRU on CRUJ_top."ParentReportingUnit_Id" = TopRU."Id"
+        {selection_join_sql}
         LEFT JOIN "CountItemType" CIT on vc."CountItemType_Id" = CIT."Id"
-        LEFT JOIN "ReportingUnit" ED on BMC."ElectionDistrict_Id" = ED."Id"
         LEFT JOIN "ReportingUnitType" EDRUT on ED."ReportingUnitType_Id" = EDRUT."Id"
-        WHERE C.contest_type = 'BallotMeasure'
-            AND e."Name" = %s -- election name
-            AND TopRU."Name" = %s  -- top RU
-            AND IntermediateRUT."Txt" = %s  -- intermediate_reporting_unit_type
-            AND d.{by} in %s  -- tuple of datafile short_names
-            {restrict}
-        GROUP BY {group_and_order_by}
-        ORDER BY {group_and_order_by}
-        ;
+        WHERE vc."Election_Id" = %(election_id)s  -- (prunes partitions)
+            -- intermediate RUs must nest in top RU
+            AND %(top_ru_id)s = ANY(IntermediateRU.path)
+            AND vc."_datafile_Id" = ANY(%(datafile_ids)s::integer[])
+            AND vc."CountItemType_Id" IS DISTINCT FROM %(excluded_count_item_type_id)s::integer
+            AND (%(contest_id)s::integer IS NULL OR vc."Contest_Id" = %(contest_id)s::integer)"""
+    ).format(
+        contest_type=sql.Literal(contest_type),
+        vote_counts_sql=vote_counts_sql,
+        intermediate_join_sql=intermediate_join_sql,
+        selection_join_sql=selection_join_sql,
+    )
+
+
+def contest_totals_from_ids(
+    cursor,
+    top_ru_id: int,
+    election_id: int,
+    sub_unit_type_id: int,
+    datafile_ids: List[int],
+    contest_ids: Optional[List[int]] = None,
+    exclude_redundant_total: bool = False,
+    use_rollup: bool = True,
+) -> (pd.DataFrame, Optional[str]):
+    """Returns a dataframe of total counts for each contest (of either type), sub-unit
+    (of type <sub_unit_type_id>, within <top_ru_id>) and vote type, all in one query,
+    with columns contest, contest_type, reporting_unit, count_item_type and count.
+    If <contest_ids> is given, only those contests are totalled. Returns an error string too."""
+    columns = ["contest", "contest_type", "reporting_unit", "count_item_type", "count"]
+    use_rollup = use_rollup and vote_count_rollup_is_fresh(cursor, datafile_ids)
+    parameters = rollup_parameter_values(
+        cursor,
+        top_ru_id,
+        election_id,
+        sub_unit_type_id,
+        datafile_ids,
+        exclude_redundant_total,
+        None,
+    )
+    parameters["contest_ids"] = None if contest_ids is None else [int(c) for c in contest_ids]
+    vote_counts_sql, intermediate_join_sql = intermediate_vote_counts_sql(use_rollup)
+    q = sql.SQL(
+        """SELECT C."Name", C.contest_type, IntermediateRU."Name", CIT."Txt", sum(vc."Count")
+        FROM {vote_counts_sql}
+        JOIN "Contest" C on vc."Contest_Id" = C."Id"
+        {intermediate_join_sql}
+        LEFT JOIN "CountItemType" CIT on vc."CountItemType_Id" = CIT."Id"
+        WHERE vc."Election_Id" = %(election_id)s  -- (prunes partitions)
+            AND %(top_ru_id)s = ANY(IntermediateRU.path)
+            AND IntermediateRU."ReportingUnitType_Id" = %(sub_unit_type_id)s
+            AND vc."_datafile_Id" = ANY(%(datafile_ids)s::integer[])
+            AND vc."CountItemType_Id" IS DISTINCT FROM %(excluded_count_item_type_id)s::integer
+            AND (%(contest_ids)s::integer[] IS NULL OR vc."Contest_Id" = ANY(%(contest_ids)s::integer[]))
+        GROUP BY C."Name", C.contest_type, IntermediateRU."Name", CIT."Txt"
         """
-        ).format(
-            count_item_type_sql=count_item_type_sql,
-            by=sql.Identifier(by),
-            group_and_order_by=sql.SQL(group_and_order_by),
-            restrict=sql.SQL(restrict),
-        )
-    else:
-        err_str = f"Unrecognized contest_type: {contest_type}. No results exported"
-        return pd.DataFrame(columns=columns), err_str
+    ).format(vote_counts_sql=vote_counts_sql, intermediate_join_sql=intermediate_join_sql)
     try:
-        cursor.execute(q, string_vars)
-        results = cursor.fetchall()
-        results_df = pd.DataFrame(results)
-        if not results_df.empty:
-            results_df.columns = columns
+        cursor.execute(q, parameters)
+        results_df = pd.DataFrame(cursor.fetchall(), columns=columns)
         err_str = None
     except Exception as exc:
-        results_df = pd.DataFrame()
-        err_str = f"No results exported due to database error: {exc}"
+        cursor.connection.rollback()
+        results_df = pd.DataFrame(columns=columns)
+        err_str = f"Unable to total contests due to database error: {exc}"
     return results_df, err_str
 
 
+# columns of multi-level rollups in long format, in the order of multilevel_rollup_query
+#  (after the first two, the level and the by_vote_type setting)
+multilevel_rollup_columns = [
+    "by_vote_type",
+    "contest_type",
+    "contest",
+    "contest_district_type",
+    "selection",
+    "reporting_unit_type",
+    "reporting_unit",
+    "count_item_type",
+    "count",
+]
+
+
+def export_multilevel_rollup(
+    cursor,
+    top_ru_id: int,
+    election_id: int,
+    sub_unit_type_ids: List[int],
+    contest_type: str,
+    datafile_ids: List[int],
+    by_vote_type: List[bool] = [False],
+    exclude_redundant_total: bool = False,
+    contest_id: Optional[int] = None,
+    use_rollup: bool = True,
+    long_out=None,
+    level_outs: Optional[Dict[Tuple[int, bool], object]] = None,
+) -> Optional[str]:
+    """Rolls up results to each of the ReportingUnitTypes in <sub_unit_type_ids>, once for each
+    setting (True and/or False) in <by_vote_type>, in one pass over the counts (GROUPING SETS).
+    Writes tab-separated text with a header row to <long_out> (a file path or writable stream),
+    all levels together, in long format (see multilevel_rollup_columns); and/or, to
+    <level_outs>[(sub_unit_type_id, by_vote_type setting)], each level separately, with the
+    same columns as export_rollup_to_file. Rows are fetched in batches from a server-side cursor,
+    so memory use does not grow with the size of the rollup. Returns an error string (or None)."""
+    if contest_type not in ["Candidate", "BallotMeasure"]:
+        return f"Unrecognized contest_type: {contest_type}. No results exported"
+    if level_outs is None:
+        level_outs = dict()
+    use_rollup = use_rollup and vote_count_rollup_is_fresh(cursor, datafile_ids)
+    parameters = rollup_parameter_values(
+        cursor,
+        top_ru_id,
+        election_id,
+        None,
+        datafile_ids,
+        exclude_redundant_total,
+        contest_id,
+    )
+    parameters["sub_unit_type_ids"] = [int(x) for x in sub_unit_type_ids]
+    q = multilevel_rollup_query(contest_type, by_vote_type, use_rollup)
+
+    # open outputs, each with its header
+    opened = list()
+    writers = dict()
+    try:
+        for key, out in [("long", long_out)] + list(level_outs.items()):
+            if out is None:
+                continue
+            if isinstance(out, str):
+                out = open(out, "w", newline="")
+                opened.append(out)
+            writers[key] = csv.writer(out, delimiter="\t", lineterminator="\n")
+            if key == "long":
+                writers[key].writerow(multilevel_rollup_columns)
+            else:
+                writers[key].writerow(rollup_columns)
+
+        named_cursor = cursor.connection.cursor(name=f"multilevel_rollup_{uuid.uuid4().hex}")
+        named_cursor.itersize = 10000
+        named_cursor.execute(q, parameters)
+        for row in named_cursor:
+            if "long" in writers:
+                writers["long"].writerow(row[1:])
+            level_writer = writers.get((row[0], row[1]))
+            if level_writer:
+                # same columns as a single-level rollup
+                level_writer.writerow(row[2:6] + row[7:])
+        named_cursor.close()
+        err_str = None
+    except Exception as exc:
+        cursor.connection.rollback()
+        err_str = f"No results exported due to database error: {exc}"
+    for f in opened:
+        f.close()
+    return err_str
+
+
 def read_vote_count(
     session,
     election_id,
@@ -1545,6 +3436,8 @@ def read_vote_count(
     cursor = connection.cursor()
     cursor.execute(q, [election_id, reporting_unit_id])
     results = cursor.fetchall()
+    cursor.close()
+    connection.close()
     results_df = pd.DataFrame(results, columns=aliases)
     return results_df
 
@@ -16,32 +16,271 @@ from sqlalchemy import (
     Index,
 )
 from sqlalchemy import Date, TIMESTAMP
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.schema import CreateSequence, CreateTable, CreateIndex
 from psycopg2 import sql
 import os
+import hashlib
 import pandas as pd
 from election_data_analysis import database as db
 
 
 # constants
 bmselections = ["Yes", "No", "none or unknown"]
-
-
-def create_common_data_format_tables(session, dirpath="CDF_schema_def_info/"):
-    """schema example: 'cdf'; Creates cdf tables in the given schema
-    (or directly in the db if schema == None)
-    e_table_list is a list of enumeration tables for the CDF, e.g., ['ReportingUnitType','CountItemType', ... ]
+# columns of ReportingUnit maintained by the system (not loaded from files):
+#  depth is the number of ;-separated components of the Name;
+#  path is the array of Ids of the ReportingUnit's ancestors, largest first, ending with its own Id
+reporting_unit_hierarchy_columns = ["depth", "path"]
+# ways to partition VoteCount: not at all, by Election_Id, or by Election_Id and then by _datafile_Id
+#  (each _datafile has a single top ReportingUnit, so the latter separates election-jurisdiction pairs)
+vote_count_partitioning_options = ["none", "election", "election_and_datafile"]
+# for these elements, the free-text Other<enumeration> values are kept in a lookup table
+#  Other<enumeration> (Id, Txt) and referenced by integer Other<enumeration>_Id, so that
+#  large tables (and their unique constraints) hold no text columns
+other_text_lookups = {"VoteCount": ["CountItemType"]}
+# tables whose Ids come from a sequence of their own rather than the shared id_seq. Ids of
+#  referenced elements must be unique throughout the database, so only tables whose Ids are never
+#  referenced (like VoteCount, by far the largest) are listed here.
+table_id_sequences = {"VoteCount": "VoteCount_Id_seq"}
+# number of sequence values each database session preallocates (CACHE), unless specified
+#  by the id_sequence_cache parameter (see database.set_id_sequence_cache)
+default_id_sequence_cache = 100
+# tables derived from VoteCount and maintained by the loader, not defined in CDF_schema_def_info
+#  (see vote_count_rollup_ddl, candidate_votecounts_ddl and data_version_ddl)
+derived_tables = [
+    "_vote_count_rollup",
+    "_vote_count_rollup_status",
+    "_candidate_votecounts",
+    "_candidate_votecounts_status",
+    "_data_version",
+]
+# composite indices on VoteCount matching the read queries (filter by election and datafile or
+#  reporting unit, group by contest, selection and count item type), each a pair (key columns,
+#  included columns). Including Count (and Id) lets rollups and candidate vote counts be answered
+#  from the index alone.
+vote_count_covering_indexes = {
+    "VoteCount_election_datafile_cover_idx": (
+        [
+            "Election_Id",
+            "_datafile_Id",
+            "ReportingUnit_Id",
+            "Contest_Id",
+            "Selection_Id",
+            "CountItemType_Id",
+        ],
+        ["Count", "Id"],
+    ),
+    "VoteCount_election_contest_cover_idx": (
+        ["Election_Id", "Contest_Id", "Selection_Id"],
+        ["ReportingUnit_Id", "CountItemType_Id", "Count", "_datafile_Id"],
+    ),
+}
+# indices on VoteCount made redundant by the covering indices (e.g., by a prefix of their keys),
+#  dropped from older databases (see database.add_vote_count_covering_indexes)
+obsolete_vote_count_indexes = ["VoteCount_Election_Id_idx", "VoteCount_election_ru_cover_idx"]
+
+
+# compiled DDL for the CDF schema is cached here, one file per schema definition hash
+ddl_cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "election_data_analysis")
+
+
+def create_common_data_format_tables(
+    session, dirpath="CDF_schema_def_info/", vote_count_partitioning: str = "none"
+):
+    """Creates cdf tables (with their sequence, indices and any default VoteCount partitions)
+    in the db, running the compiled DDL (see cdf_ddl) in one batch, in one transaction.
     Does *not* fill enumeration tables.
+    <vote_count_partitioning> is one of vote_count_partitioning_options. If VoteCount is partitioned,
+    only the default partition is created here; partitions for particular elections (and datafiles)
+    are created as data is loaded (see database.ensure_vote_count_partition).
     """
-    eng = session.bind
-    metadata = MetaData(bind=eng)
+    if vote_count_partitioning not in vote_count_partitioning_options:
+        raise Exception(
+            f"VoteCount partitioning {vote_count_partitioning} not recognized"
+        )
+    ddl = cdf_ddl(dirpath, vote_count_partitioning)
+    connection = session.bind.raw_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.execute(ddl)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+        connection.close()
+    return
+
+
+def cdf_ddl(dirpath: str, vote_count_partitioning: str = "none") -> str:
+    """Returns the DDL script creating the CDF schema, from the cache in ddl_cache_dir
+    if the schema definition has been compiled before; otherwise compiles and caches it."""
+    schema_hash = schema_definition_hash(dirpath, vote_count_partitioning)
+    cache_file = os.path.join(ddl_cache_dir, f"cdf_schema_{schema_hash}.sql")
+    if os.path.isfile(cache_file):
+        with open(cache_file, "r") as f:
+            return f.read()
+
+    ddl = compile_cdf_ddl(dirpath, vote_count_partitioning)
+    try:
+        os.makedirs(ddl_cache_dir, exist_ok=True)
+        # write to a temporary file first, so no other process reads a partial file
+        temp_file = f"{cache_file}.{os.getpid()}"
+        with open(temp_file, "w") as f:
+            f.write(ddl)
+        os.replace(temp_file, cache_file)
+    except OSError:
+        # caching is only an optimization
+        pass
+    return ddl
+
+
+def compile_cdf_ddl(dirpath: str, vote_count_partitioning: str = "none") -> str:
+    """Returns the DDL script (for postgresql) creating the id sequence, all cdf tables
+    and their indices, any default VoteCount partitions and the VoteCount covering indices"""
+    metadata = cdf_metadata(dirpath, vote_count_partitioning)
+    dialect = postgresql.dialect()
+    statements = [
+        CreateSequence(sa.Sequence(s)) for s in ["id_seq"] + list(table_id_sequences.values())
+    ]
+    for t in metadata.sorted_tables:
+        statements.append(CreateTable(t))
+        statements.extend(
+            CreateIndex(idx) for idx in sorted(t.indexes, key=lambda x: x.name)
+        )
+    ddl_list = [str(s.compile(dialect=dialect)).strip() for s in statements]
+    ddl_list.extend(vote_count_default_partition_ddl(vote_count_partitioning))
+    ddl_list.extend(vote_count_covering_index_ddl())
+    ddl_list.extend(vote_count_rollup_ddl())
+    ddl_list.extend(candidate_votecounts_ddl())
+    ddl_list.extend(data_version_ddl())
+    # drop the tables' own sequences along with the tables
+    ddl_list.extend(
+        f'ALTER SEQUENCE "{s}" OWNED BY "{t}"."Id"' for t, s in table_id_sequences.items()
+    )
+    return ";\n\n".join(ddl_list) + ";\n"
+
+
+def vote_count_default_partition_ddl(vote_count_partitioning: str) -> list:
+    """DDL for the catch-all partition(s) of VoteCount, for any rows without a partition of their own"""
+    if vote_count_partitioning == "none":
+        return []
+    elif vote_count_partitioning == "election":
+        return ['CREATE TABLE "VoteCount_default" PARTITION OF "VoteCount" DEFAULT']
+    else:
+        return [
+            """CREATE TABLE "VoteCount_default" PARTITION OF "VoteCount" DEFAULT
+            PARTITION BY LIST ("_datafile_Id")""",
+            'CREATE TABLE "VoteCount_default_default" PARTITION OF "VoteCount_default" DEFAULT',
+        ]
 
-    # create the single sequence for all db ids
+
+def vote_count_covering_index_ddl() -> list:
+    """DDL for the composite covering indices on VoteCount (INCLUDE is not expressible via sa.Index)"""
+    return [
+        f"""CREATE INDEX IF NOT EXISTS "{name}" ON "VoteCount" """
+        f"""({", ".join(f'"{c}"' for c in keys)}) INCLUDE ({", ".join(f'"{c}"' for c in included)})"""
+        for name, (keys, included) in vote_count_covering_indexes.items()
+    ]
+
+
+def vote_count_rollup_ddl() -> list:
+    """DDL for the summary of VoteCount rolled up to every ReportingUnit containing the counted unit
+    (_vote_count_rollup) and for the list of datafiles whose summary is up to date
+    (_vote_count_rollup_status). Rows disappear with their _datafile."""
+    return [
+        """CREATE TABLE IF NOT EXISTS _vote_count_rollup (
+            "Election_Id" integer NOT NULL,
+            "ParentReportingUnit_Id" integer NOT NULL REFERENCES "ReportingUnit" ("Id"),
+            "Contest_Id" integer NOT NULL,
+            "Selection_Id" integer NOT NULL,
+            "CountItemType_Id" integer NOT NULL,
+            "_datafile_Id" integer NOT NULL REFERENCES _datafile ("Id") ON DELETE CASCADE,
+            "Count" bigint NOT NULL,
+            PRIMARY KEY ("Election_Id", "ParentReportingUnit_Id", "Contest_Id", "Selection_Id",
+                "CountItemType_Id", "_datafile_Id")
+        )""",
+        """CREATE INDEX IF NOT EXISTS "_vote_count_rollup__datafile_Id_idx"
+            ON _vote_count_rollup ("_datafile_Id")""",
+        """CREATE TABLE IF NOT EXISTS _vote_count_rollup_status (
+            "_datafile_Id" integer PRIMARY KEY REFERENCES _datafile ("Id") ON DELETE CASCADE,
+            refreshed_at timestamp NOT NULL DEFAULT now()
+        )""",
+    ]
+
+
+def candidate_votecounts_ddl() -> list:
+    """DDL for the materialized results of database.get_candidate_votecounts
+    (_candidate_votecounts), one slice per (election, top ReportingUnit, subdivision type),
+    and for the list of slices materialized so far (_candidate_votecounts_status)"""
+    return [
+        """CREATE TABLE IF NOT EXISTS _candidate_votecounts (
+            "Slice_Election_Id" integer NOT NULL,
+            "TopReportingUnit_Id" integer NOT NULL,
+            "SubdivisionType_Id" integer NOT NULL,
+            "VoteCount_Id" integer,
+            "Count" integer,
+            "CountItemType_Id" integer,
+            "ReportingUnit_Id" integer,
+            "Contest_Id" integer,
+            "Selection_Id" integer,
+            "Election_Id" integer,
+            "ParentReportingUnit_Id" integer,
+            "Name" varchar,
+            "ReportingUnitType_Id" integer,
+            "ParentName" varchar,
+            "ParentReportingUnitType_Id" integer,
+            "CountItemType" varchar,
+            "Contest" varchar,
+            "Selection" varchar,
+            "ElectionDistrict_Id" integer,
+            "Candidate_Id" integer,
+            "contest_type" varchar,
+            "contest_district_type" varchar,
+            "Party" varchar
+        )""",
+        """CREATE INDEX IF NOT EXISTS "_candidate_votecounts_slice_idx" ON _candidate_votecounts
+            ("Slice_Election_Id", "TopReportingUnit_Id", "SubdivisionType_Id")""",
+        """CREATE TABLE IF NOT EXISTS _candidate_votecounts_status (
+            "Election_Id" integer NOT NULL,
+            "TopReportingUnit_Id" integer NOT NULL,
+            "SubdivisionType_Id" integer NOT NULL,
+            refreshed_at timestamp NOT NULL DEFAULT now(),
+            PRIMARY KEY ("Election_Id", "TopReportingUnit_Id", "SubdivisionType_Id")
+        )""",
+    ]
+
+
+def data_version_ddl() -> list:
+    """DDL for the table of data versions (_data_version): a token for each election, changed
+    whenever the election's results are loaded or removed, plus one (Election_Id 0) for the
+    database as a whole. Cached query results are valid only as long as their tokens are unchanged."""
+    return [
+        """CREATE TABLE IF NOT EXISTS _data_version (
+            "Election_Id" integer PRIMARY KEY,
+            version varchar NOT NULL,
+            updated_at timestamp NOT NULL DEFAULT now()
+        )""",
+    ]
+
+
+def cdf_metadata(dirpath: str, vote_count_partitioning: str = "none") -> MetaData:
+    """Returns (unbound) metadata for all cdf tables, per the schema definition in <dirpath>"""
+    metadata = MetaData()
+
+    # create the sequence for all db ids (except those of tables with their own sequence)
     id_seq = sa.Sequence("id_seq", metadata=metadata)
+    own_seq = {t: sa.Sequence(s, metadata=metadata) for t, s in table_id_sequences.items()}
 
     # create enumeration tables
     e_table_list = enum_table_list(dirpath)
     for t in e_table_list:
         create_table(metadata, id_seq, t, "enumerations", dirpath)
+    # and lookup tables for free-text Other<enumeration> values
+    for t in other_text_lookup_tables():
+        create_table(metadata, id_seq, t, "enumerations", dirpath)
 
     # create element tables (cdf and metadata) and push to db
     element_path = os.path.join(dirpath, "elements")
@@ -66,19 +305,18 @@ def create_common_data_format_tables(session, dirpath="CDF_schema_def_info/"):
                 pass
         # create indices for efficiency
         if element == "VoteCount":
+            # Election_Id is served by the covering indices (see vote_count_covering_indexes)
             create_indices = [
                 "CountItemType_Id",
-                "OtherCountItemType",
                 "ReportingUnit_Id",
                 "Contest_Id",
                 "Selection_Id",
-                "Election_Id",
                 "_datafile_Id",
             ]
         elif element == "CandidateSelection":
             create_indices = ["Candidate_Id", "Party_Id"]
         elif element == "ReportingUnit":
-            create_indices = ["ReportingUnitType_Id"]
+            create_indices = ["ReportingUnitType_Id", "depth"]
         else:
             # create_indices = [[db.get_name_field(element)]]
             create_indices = None
@@ -87,11 +325,12 @@ def create_common_data_format_tables(session, dirpath="CDF_schema_def_info/"):
         # create db table for element
         create_table(
             metadata,
-            id_seq,
+            own_seq.get(element, id_seq),
             element,
             "elements",
             dirpath,
             create_indices=create_indices,
+            partitioning=vote_count_partitioning if element == "VoteCount" else "none",
         )
         # remove element from list of yet-to-be-processed
         elements_to_process.remove(element)
@@ -128,17 +367,21 @@ def create_common_data_format_tables(session, dirpath="CDF_schema_def_info/"):
         # remove element from list of yet-to-be-processed
         joins_to_process.remove(j)
 
-    # push all tables to db
-    metadata.create_all()
-    session.flush()
     return metadata
 
 
 def create_table(
-    metadata, id_seq, name, table_type, dirpath, create_indices: list = None
+    metadata,
+    id_seq,
+    name,
+    table_type,
+    dirpath,
+    create_indices: list = None,
+    partitioning: str = "none",
 ):
     """Each element of the list <create_indices>, should be a list of
-    columns on which an index should be created."""
+    columns on which an index should be created.
+    <partitioning> (for VoteCount only) is one of vote_count_partitioning_options."""
     t_path = os.path.join(dirpath, table_type, name)
     if name == "Selection":
         # Selection table has only Id column
@@ -189,8 +432,22 @@ def create_table(
         ]
         # omit 'foreign keys' that refer to more than one table,
         #  e.g. Contest_Id to BallotMeasureContest and CandidateContest
+        # partition keys must be part of the primary key
+        if partitioning == "election":
+            partition_keys = ["Election_Id"]
+            partition_kwargs = {"postgresql_partition_by": 'LIST ("Election_Id")'}
+        elif partitioning == "election_and_datafile":
+            partition_keys = ["Election_Id", "_datafile_Id"]
+            partition_kwargs = {"postgresql_partition_by": 'LIST ("Election_Id")'}
+        else:
+            partition_keys = []
+            partition_kwargs = {}
         foreign_key_list = [
-            Column(r["fieldname"], ForeignKey(f'{r["refers_to"]}.Id'))
+            Column(
+                r["fieldname"],
+                ForeignKey(f'{r["refers_to"]}.Id'),
+                primary_key=(r["fieldname"] in partition_keys),
+            )
             for i, r in df["foreign_keys"].iterrows()
             if ";" not in r["refers_to"]
         ]
@@ -201,16 +458,19 @@ def create_table(
             Column(f'{r["enumeration"]}_Id', ForeignKey(f'{r["enumeration"]}.Id'))
             for i, r in df["enumerations"].iterrows()
         ]
+        looked_up = other_text_lookups.get(name, [])
         enum_other_list = [
-            Column(f'Other{r["enumeration"]}', String)
+            Column(
+                f'Other{r["enumeration"]}_Id', ForeignKey(f'Other{r["enumeration"]}.Id')
+            )
+            if r["enumeration"] in looked_up
+            else Column(f'Other{r["enumeration"]}', String)
             for i, r in df["enumerations"].iterrows()
         ]
         enum_id_names = [
             f'{r["enumeration"]}_Id' for i, r in df["enumerations"].iterrows()
         ]
-        enum_other_names = [
-            f'Other{r["enumeration"]}' for i, r in df["enumerations"].iterrows()
-        ]
+        enum_other_names = [c.name for c in enum_other_list]
 
         # specified unique constraints
         df["unique_constraints"]["arg_list"] = df["unique_constraints"][
@@ -221,19 +481,30 @@ def create_table(
             for i, r in df["unique_constraints"].iterrows()
         ]
 
-        # require uniqueness for entire record (except `Id` and `timestamp`)
+        # require uniqueness for entire record (except `Id` and `timestamp`),
+        #  unless already implied by a specified constraint (saves a wide, redundant index)
         all_content_fields = (
             field_col_names + enum_id_names + enum_other_names + foreign_ish_keys
         )
-        unique_constraint_list.append(
-            UniqueConstraint(*all_content_fields, name=f"{short_name}_no_dupes")
-        )
+        if not any(
+            set(r["arg_list"]).issubset(all_content_fields)
+            for i, r in df["unique_constraints"].iterrows()
+        ):
+            unique_constraint_list.append(
+                UniqueConstraint(*all_content_fields, name=f"{short_name}_no_dupes")
+            )
 
         # add timestamp to _datafile
         if name == "_datafile":
             time_stamp_list = [Column("created_at", sa.DateTime, default=sa.func.now())]
         else:
             time_stamp_list = []
+
+        # add nesting info to ReportingUnit
+        if name == "ReportingUnit":
+            hierarchy_list = [Column("depth", Integer), Column("path", ARRAY(Integer))]
+        else:
+            hierarchy_list = []
         if name in [
             "CandidateContest",
             "CandidateSelection",
@@ -252,6 +523,7 @@ def create_table(
                 *null_constraint_list,
                 *unique_constraint_list,
                 *time_stamp_list,
+                *hierarchy_list,
             )
             Index(f"{t}_parent", t.c.Id)
         else:
@@ -273,6 +545,8 @@ def create_table(
                 *null_constraint_list,
                 *unique_constraint_list,
                 *time_stamp_list,
+                *hierarchy_list,
+                **partition_kwargs,
             )
             Index(f"{t}_parent", t.c.Id)
 
@@ -337,9 +611,36 @@ def create_table(
     if create_indices:
         for li in create_indices:
             Index(f"{t}_{li}_idx", t.c[li])
+    if name == "ReportingUnit":
+        # GIN index supports subtree queries, e.g. path @> ARRAY[<ancestor Id>]
+        Index(f"{t}_path_idx", t.c.path, postgresql_using="gin")
     return
 
 
+def schema_definition_hash(dirpath: str, vote_count_partitioning: str = "none") -> str:
+    """Returns a hash of everything that determines the empty CDF database: the files in <dirpath>
+    (e.g., CDF_schema_def_info), the code in this module and the <vote_count_partitioning> option"""
+    h = hashlib.sha256()
+    h.update(vote_count_partitioning.encode())
+    for root, dirs, files in os.walk(dirpath):
+        dirs.sort()
+        for f in sorted(files):
+            if f[0] == ".":
+                continue
+            path = os.path.join(root, f)
+            h.update(os.path.relpath(path, dirpath).encode())
+            with open(path, "rb") as fh:
+                h.update(fh.read())
+    with open(__file__, "rb") as fh:
+        h.update(fh.read())
+    return h.hexdigest()
+
+
+def other_text_lookup_tables() -> list:
+    """names of the lookup tables for free-text Other<enumeration> values"""
+    return sorted({f"Other{e}" for v in other_text_lookups.values() for e in v})
+
+
 def enum_table_list(dirpath="CDF_schema_def_info"):
     enum_path = os.path.join(dirpath, "enumerations")
     file_list = os.listdir(enum_path)
@@ -388,29 +689,19 @@ def load_bms(engine, bms_list: list):
 
 def reset_db(session, dirpath):
     """Resets DB to a clean state with no tables/sequences.
-    Used if a DB is created for a user but not populated, for example."""
-
-    eng = session.bind
-    conn = eng.connect()
-    conn.execute("DROP SEQUENCE IF EXISTS id_seq CASCADE;")
-    session.commit()
-
-    # create enumeration tables
-    e_table_list = enum_table_list(dirpath)
-    for table in e_table_list:
-        conn.execute(f'DROP TABLE IF EXISTS "{table}" CASCADE;')
-        session.commit()
-
-    element_path = os.path.join(dirpath, "elements")
-    elements_to_process = [f for f in os.listdir(element_path) if f[0] != "."]
-    # dynamic list of elements whose tables haven't been created yet
-    for table in elements_to_process:
-        conn.execute(f'DROP TABLE IF EXISTS "{table}" CASCADE;')
-        session.commit()
-
-    join_path = os.path.join(dirpath, "Joins")
-    joins_to_process = [f for f in os.listdir(join_path) if f[0] != "."]
-    for table in joins_to_process:
-        conn.execute(f'DROP TABLE IF EXISTS "{table}" CASCADE;')
-        session.commit()
-    conn.close()
+    Used if a DB is created for a user but not populated, for example.
+    Drops everything in one statement."""
+    tables = enum_table_list(dirpath) + other_text_lookup_tables() + derived_tables
+    for subdir in ["elements", "Joins"]:
+        tables += [f for f in os.listdir(os.path.join(dirpath, subdir)) if f[0] != "."]
+    sequences = ["id_seq"] + list(table_id_sequences.values())
+    q = sql.SQL("DROP TABLE IF EXISTS {tables} CASCADE; DROP SEQUENCE IF EXISTS {sequences} CASCADE;").format(
+        tables=sql.SQL(", ").join(sql.Identifier(t) for t in tables),
+        sequences=sql.SQL(", ").join(sql.Identifier(s) for s in sequences),
+    )
+    connection = session.bind.raw_connection()
+    cursor = connection.cursor()
+    cursor.execute(q)
+    connection.commit()
+    cursor.close()
+    connection.close()
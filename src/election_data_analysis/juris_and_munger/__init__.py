@@ -90,33 +90,37 @@ class Jurisdiction:
                 error[f"{contest_type}Contest"] = {}
             error[f"{contest_type}Contest"]["found_duplicates"] = True
 
-        # insert into in Contest table
-        e = db.insert_to_cdf_db(engine, df[["Name", "contest_type"]], "Contest")
-
-        # append Contest_Id
-        col_map = {"Name": "Name", "contest_type": "contest_type"}
-        df = db.append_id_to_dframe(engine, df, "Contest", col_map=col_map)
+        # insert into in Contest table and append Contest_Id
+        df, e = db.upsert_and_return_ids(
+            engine, df, "Contest", ["Name", "contest_type"]
+        )
+        if e:
+            if f"{contest_type}Contest" not in error:
+                error[f"{contest_type}Contest"] = {}
+            error[f"{contest_type}Contest"]["database"] = e
+            return error
 
         if contest_type == "BallotMeasure":
             # append ElectionDistrict_Id, Election_Id
-            for fk, ref in [
-                ("ElectionDistrict", "ReportingUnit"),
-                ("Election", "Election"),
-            ]:
-                col_map = {fk: "Name"}
-                df = (
-                    db.append_id_to_dframe(engine, df, ref, col_map=col_map)
-                    .rename(columns={f"{ref}_Id": f"{fk}_Id"})
-                    .drop(fk, axis=1)
-                )
+            df = db.append_ids_for_foreign_keys(
+                engine,
+                df,
+                {
+                    "ElectionDistrict_Id": ("ElectionDistrict", "ReportingUnit"),
+                    "Election_Id": ("Election", "Election"),
+                },
+            ).drop(["ElectionDistrict", "Election"], axis=1)
 
         else:
             # append Office_Id, PrimaryParty_Id
-            for fk, ref in [("Office", "Office"), ("PrimaryParty", "Party")]:
-                col_map = {fk: "Name"}
-                df = db.append_id_to_dframe(engine, df, ref, col_map=col_map).rename(
-                    columns={f"{ref}_Id": f"{fk}_Id"}
-                )
+            df = db.append_ids_for_foreign_keys(
+                engine,
+                df,
+                {
+                    "Office_Id": ("Office", "Office"),
+                    "PrimaryParty_Id": ("PrimaryParty", "Party"),
+                },
+            )
 
         # create entries in <contest_type>Contest table
         # commit info in df to <contest_type>Contest table to db
@@ -885,9 +889,9 @@ def load_juris_dframe_into_cdf(
     # replace plain text enumerations from file system with id/othertext from db
     if os.path.isfile(enum_file):  # (if not, there are no enums for this element)
         enums = pd.read_csv(enum_file, sep="\t")
-        # get all relevant enumeration tables
+        # get all relevant enumeration tables (from cache where possible)
         for e in enums["enumeration"]:  # e.g., e = "ReportingUnitType"
-            cdf_e = pd.read_sql_table(e, session.bind)
+            cdf_e = db.read_enum_table(session.bind, e)
             # for every instance of the enumeration in the current table, add id and othertype columns to the dataframe
             if e in df.columns:
                 df = m.enum_col_to_id_othertext(df, e, cdf_e)
@@ -895,18 +899,15 @@ def load_juris_dframe_into_cdf(
             df, err_df = m.clean_ids(df, [f"{e}_Id"])
             df[f"Other{e}"] = df[f"Other{e}"].fillna("")
 
-    # get Ids for any foreign key (or similar) in the table, e.g., Party_Id, etc.
+    # get Ids for any foreign key (or similar) in the table, e.g., Party_Id, etc., all in one query
     if os.path.isfile(fk_file):
         foreign_keys = pd.read_csv(fk_file, sep="\t", index_col="fieldname")
-
-        for fn in foreign_keys.index:
-            ref = foreign_keys.loc[
-                fn, "refers_to"
-            ]  # NB: juris elements have no multiple referents (as joins may)
-            col_map = {fn[:-3]: db.get_name_field(ref)}
-            df = db.append_id_to_dframe(session.bind, df, ref, col_map=col_map).rename(
-                columns={f"{ref}_Id": fn}
-            )
+        # NB: juris elements have no multiple referents (as joins may)
+        fk_map = {
+            fn: (fn[:-3], foreign_keys.loc[fn, "refers_to"])
+            for fn in foreign_keys.index
+        }
+        df = db.append_ids_for_foreign_keys(session.bind, df, fk_map)
 
     # commit info in df to corresponding cdf table to db
     err_string = db.insert_to_cdf_db(session.bind, df, element)
@@ -915,7 +916,7 @@ def load_juris_dframe_into_cdf(
             error,
             "system",
             "juris_and_munger.load_juris_dframe_into_cdf",
-            f"Error loading {element} to database: {e}",
+            f"Error loading {element} to database: {err_string}",
         )
     return error
 
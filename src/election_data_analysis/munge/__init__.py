@@ -10,6 +10,20 @@ import numpy as np
 from sqlalchemy.orm.session import Session
 
 
+def coerce_count_block(
+    df: pd.DataFrame,
+    cols: List[str],
+) -> (pd.DataFrame, pd.Index):
+    """Coerces all the given columns of <df> to integers in a single pass,
+    replacing any non-integer values with 0. Returns the coerced block and the index
+    of any rows in which at least one value was changed."""
+    raw = df[cols]
+    numeric = raw.apply(pd.to_numeric, errors="coerce")
+    # a row is bad if any of its count values does not survive coercion unchanged
+    bad_rows = df.index[(raw != numeric).any(axis=1).values]
+    return numeric.fillna(0).astype("int64"), bad_rows
+
+
 def clean_count_cols(
     df: pd.DataFrame,
     cols: Optional[List[str]],
@@ -18,23 +32,18 @@ def clean_count_cols(
     values with 0 and reporting a dataframe of any rows so changed."""
     if cols is None:
         return df, pd.DataFrame(columns=df.columns)
-    else:
+    present = [c for c in cols if c in df.columns]
+    working = df.copy()
+    if not present:
+        return working, pd.DataFrame()
+    block, bad_rows = coerce_count_block(working, present)
+    # only build the error dataframe (with original values) when there is something to report
+    if bad_rows.empty:
         err_df = pd.DataFrame()
-        working = df.copy()
-        for c in cols:
-            if c in working.columns:
-                mask = working[c] != pd.to_numeric(working[c], errors="coerce")
-                if mask.any():
-                    # return bad rows for error reporting
-                    err_df = pd.concat([err_df, working[mask]]).drop_duplicates()
-
-                    # cast as int, changing any non-integer values to 0
-                    working[c] = (
-                        pd.to_numeric(working[c], errors="coerce").fillna(0).astype("int64")
-                    )
-                else:
-                    working[c] = working[c].astype("int64")
-        return working, err_df
+    else:
+        err_df = working.loc[bad_rows].drop_duplicates()
+    working[present] = block
+    return working, err_df
 
 
 def clean_ids(
@@ -465,8 +474,8 @@ def replace_raw_with_internal_ids(
                 | (working["cdf_internal_name"].notnull())
             ]
             if drop_extraneous:
+                # NB: munge_and_melt prunes most of these before melting; this catches the rest
                 working = working[working["cdf_internal_name"] != "row should be dropped"]
-            # TODO tech debt more efficient to drop these earlier, before melting
 
     # unmatched elements get nan in fields from dictionary table. Change these to "none or unknown"
     if not drop_unmatched:
@@ -568,6 +577,22 @@ def enum_col_from_id_othertext(df, enum, enum_df, drop_old=True):
     return df
 
 
+def other_text_to_id(engine, df: pd.DataFrame, enum: str) -> (pd.DataFrame, Optional[str]):
+    """Returns a copy of dataframe <df>, replacing the free-text Other<enum> column
+    (e.g., 'OtherCountItemType') with the Other<enum>_Id column, referring to the lookup table
+    Other<enum> (to which any new texts are added), along with an error string (or None)"""
+    working = df.copy()
+    working[f"Other{enum}"] = working[f"Other{enum}"].fillna("")
+    texts = working[[f"Other{enum}"]].drop_duplicates().rename(columns={f"Other{enum}": "Txt"})
+    texts, err_str = db.upsert_and_return_ids(engine, texts, f"Other{enum}", ["Txt"])
+    if err_str:
+        return df, err_str
+    working = working.merge(
+        texts, how="left", left_on=f"Other{enum}", right_on="Txt"
+    ).drop([f"Other{enum}", "Txt"], axis=1)
+    return working, None
+
+
 def enum_col_to_id_othertext(df, type_col, enum_df, drop_old=True):
     """Returns a copy of dataframe <df>, replacing a plaintext <type_col> column (e.g., 'CountItemType') with
     the corresponding two id and othertext columns (e.g., 'CountItemType_Id' and 'OtherCountItemType
@@ -631,15 +656,107 @@ def good_syntax(s):
     return good
 
 
+def extraneous_raw_identifiers(juris: jm.Jurisdiction) -> Dict[str, set]:
+    """Returns dictionary whose keys are cdf_elements and whose values are the sets of
+    raw identifiers that dictionary.txt maps to 'row should be dropped' for that element"""
+    raw_identifiers = pd.read_csv(
+        os.path.join(juris.path_to_juris_dir, "dictionary.txt"), sep="\t"
+    )
+    to_drop = raw_identifiers[
+        raw_identifiers["cdf_internal_name"] == "row should be dropped"
+    ]
+    return {
+        e: set(to_drop[to_drop["cdf_element"] == e]["raw_identifier_value"])
+        for e in to_drop["cdf_element"].unique()
+    }
+
+
+def prune_extraneous(
+    mu: jm.Munger, juris: jm.Jurisdiction, raw: pd.DataFrame, count_cols: List[str]
+) -> (pd.DataFrame, List[str]):
+    """Returns <raw> without the rows and count columns whose munged raw identifiers are mapped
+    to 'row should be dropped' in the jurisdiction's dictionary.txt, along with the pruned list
+    of count columns. Pruning is best-effort: if the munger's formulas cannot be applied here,
+    nothing is pruned and any error is left for munge_and_melt to report."""
+    to_drop = extraneous_raw_identifiers(juris)
+    if not to_drop:
+        return raw, count_cols
+    working = raw
+
+    # drop count columns whose header info munges to an extraneous raw identifier
+    column_elements = [
+        t for t in mu.cdf_elements[mu.cdf_elements.source == "column"].index if t in to_drop
+    ]
+    if column_elements and count_cols:
+        # one row per count column, holding the values melt would put in variable_0, variable_1, ...
+        headers = pd.DataFrame(
+            [c if isinstance(c, tuple) else (c,) for c in count_cols]
+        )
+        headers.columns = [f"variable_{j}" for j in headers.columns]
+        keep = pd.Series(True, index=headers.index)
+        for t in column_elements:
+            headers, new_err = add_munged_column(headers, mu, t, None, mode="column")
+            if new_err:
+                keep = pd.Series(True, index=headers.index)
+                break
+            keep &= ~headers[f"{t}_raw"].isin(to_drop[t])
+        # if every count column would be dropped, leave the work (and the reporting) to the melt
+        if keep.any() and not keep.all():
+            dropped = [c for c, k in zip(count_cols, keep) if not k]
+            count_cols = [c for c, k in zip(count_cols, keep) if k]
+            working = working[[c for c in working.columns if c not in dropped]]
+
+    # drop rows whose row-sourced info munges to an extraneous raw identifier
+    row_elements = [
+        t for t in mu.cdf_elements[mu.cdf_elements.source == "row"].index if t in to_drop
+    ]
+    if row_elements and not working.empty:
+        # name the non-count columns as munge_clean will name them after the melt
+        non_count_cols = [c for c in working.columns if c not in count_cols]
+        source = working[non_count_cols].copy()
+        source.columns = [
+            f'{str(c[mu.options["field_name_row"]] if isinstance(c, tuple) else c).strip()}_SOURCE'
+            for c in non_count_cols
+        ]
+        source = source.loc[:, ~source.columns.duplicated()]
+        keep = pd.Series(True, index=source.index)
+        for t in row_elements:
+            source, new_err = add_munged_column(source, mu, t, None, mode="row")
+            if new_err:
+                return working, count_cols
+            keep &= ~source[f"{t}_raw"].isin(to_drop[t])
+        if not keep.all():
+            working = working[keep.values]
+
+    return working, count_cols
+
+
 def munge_and_melt(
-    mu: jm.Munger, raw: pd.DataFrame, count_cols: List[str], err: Optional[dict]
+    mu: jm.Munger,
+    raw: pd.DataFrame,
+    count_cols: List[str],
+    err: Optional[dict],
+    juris: Optional[jm.Jurisdiction] = None,
 ) -> (pd.DataFrame, Optional[dict]):
     """Does not alter raw; returns transformation of raw:
      all row- and column-sourced mungeable info into columns (but doesn't translate via dictionary)
     new column names are, e.g., ReportingUnit_raw, Candidate_raw, etc.
+    If <juris> is given, rows and count columns that its dictionary marks as
+    'row should be dropped' are removed before melting.
     """
     working = raw.copy()
 
+    if juris is not None:
+        try:
+            working, count_cols = prune_extraneous(mu, juris, working, count_cols)
+        except Exception as exc:
+            err = ui.add_new_error(
+                err,
+                "warn-munger",
+                mu.name,
+                f"Could not remove extraneous rows before melting; they will be removed later: {exc}",
+            )
+
     # melt all column (multi-) index info into columns
     non_count_cols = [x for x in working.columns if x not in count_cols]
     working = working.melt(id_vars=non_count_cols)
@@ -821,36 +938,25 @@ def add_selection_id(
         c_df, err_df = clean_ids(c_df, ["Candidate_Id", "Party_Id"])
         c_df = c_df[c_df.Candidate_Id != 0]
 
-        # pull any existing Ids into a new CandidateSelection_Id column
-        col_map = {c: c for c in ["Party_Id", "Candidate_Id"]}
-        c_df = db.append_id_to_dframe(
-            engine, c_df, "CandidateSelection", col_map=col_map
+        # insert any new CandidateSelections (with new Selection records) and
+        # pull Ids, new or existing, into a new CandidateSelection_Id column
+        c_df, e = db.upsert_and_return_ids(
+            engine,
+            c_df,
+            "CandidateSelection",
+            ["Candidate_Id", "Party_Id"],
+            parent="Selection",
         )
-
-        # find unmatched records
-        # TODO this throws error (FutureWarning: elementwise comparison failed),
-        #  maybe because CandidateSelection_Id cannot be compared to ""?
-        c_df_unmatched = c_df[
-            (c_df.CandidateSelection_Id == 0)
-            | (c_df.CandidateSelection_Id == "")
-            | (c_df.CandidateSelection_Id.isnull())
-        ].copy()
-
-        if not c_df_unmatched.empty:
-            #  Load CandidateSelections to Selection table (for unmatched)
-            id_list = db.add_records_to_selection_table(engine, c_df_unmatched.shape[0])
-
-            # Load unmatched records into CandidateSelection table
-            c_df_unmatched["Id"] = pd.Series(id_list, index=c_df_unmatched.index)
-            db.insert_to_cdf_db(engine, c_df_unmatched, "CandidateSelection")
-
-            # update CandidateSelection_Id column for previously unmatched, merging on Candidate_Id and Party_Id
-            c_df.loc[c_df_unmatched.index, "CandidateSelection_Id"] = c_df_unmatched[
-                "Id"
-            ]
+        if e:
+            err = ui.add_new_error(
+                err,
+                "system",
+                "munge.add_selection_id",
+                f"Error loading CandidateSelection records:\n{e}",
+            )
         # recast Candidate_Id and Party_Id to int in w['Candidate'];
         # Note that neither should have nulls, but rather the 'none or unknown' Id
-        #  NB: c_df had this recasting done in the append_id_to_dframe routine
+        #  NB: c_df had this recasting done above
         w["Candidate"], err_df = clean_ids(w["Candidate"], ["Candidate_Id", "Party_Id"])
         if not err_df.empty:
             # show all columns of dataframe with problem in Party_Id or Candidate_Id
@@ -898,7 +1004,7 @@ def raw_elements_to_cdf(
     working = raw.copy()
 
     try:
-        working, new_err = munge_and_melt(mu, working, count_cols, err)
+        working, new_err = munge_and_melt(mu, working, count_cols, err, juris=juris)
         if new_err:
             err = ui.consolidate_errors([err, new_err])
             if ui.fatal_error(new_err):
@@ -976,7 +1082,7 @@ def raw_elements_to_cdf(
                 ).rename(columns={"cdf_internal_name": "CountItemType"})
 
                 # join CountItemType_Id and OtherCountItemType
-                cit = pd.read_sql_table("CountItemType", session.bind)
+                cit = db.read_enum_table(session.bind, "CountItemType")
                 working = enum_col_to_id_othertext(working, "CountItemType", cit)
                 working, err_df = clean_ids(working, ["CountItemType_Id"])
                 working = clean_strings(working, ["OtherCountItemType"])
@@ -1037,11 +1143,22 @@ def raw_elements_to_cdf(
         )
         return err
 
+    # replace free-text OtherCountItemType by the Id of its entry in the lookup table
+    working, e = other_text_to_id(session.bind, working, "CountItemType")
+    if e:
+        err = ui.add_new_error(
+            err,
+            "system",
+            "munge.raw_elements_to_cdf",
+            f"Unable to look up OtherCountItemType values: {e}",
+        )
+        return err
+
     # restrict to just the VoteCount columns (so that groupby.sum will work)
     vc_cols = [
         "Count",
         "CountItemType_Id",
-        "OtherCountItemType",
+        "OtherCountItemType_Id",
         "ReportingUnit_Id",
         "Contest_Id",
         "Selection_Id",
@@ -1061,6 +1178,19 @@ def raw_elements_to_cdf(
 
     # Fill VoteCount
     try:
+        # make sure there is a VoteCount partition for the data (if VoteCount is partitioned)
+        e = db.ensure_vote_count_partition(
+            session.bind, constants["Election_Id"], constants["_datafile_Id"]
+        )
+        if e:
+            # rows in the default partition would stay there, outside the election's partition
+            err = ui.add_new_error(
+                err,
+                "system",
+                "munge.raw_elements_to_cdf",
+                f"VoteCounts not loaded: {e}",
+            )
+            return err
         e = db.insert_to_cdf_db(session.bind, working, "VoteCount")
         if e:
             err = ui.add_new_error(
@@ -0,0 +1,172 @@
+import collections
+import copy
+import hashlib
+import json
+import os
+import pickle
+import threading
+from typing import Callable, Dict, List, Optional
+from election_data_analysis import database as db
+
+# Results of Analyzer queries, cached in memory (least recently used dropped first) and, optionally,
+#  on disk. Each result is stored with the data versions (see database.data_versions) of the elections
+#  it depends on, and is used only while those versions are current, so any load or removal of
+#  results for an election invalidates everything cached for that election.
+
+# default number of results held in memory for each database
+default_cache_size = 128
+
+
+class ResultCache:
+    def __init__(
+        self,
+        size: int = default_cache_size,
+        directory: Optional[str] = None,
+        identity: Optional[str] = None,
+    ):
+        """<size> results held in memory; if <directory> is given, results are also stored
+        there (one pickle file per result), and so survive the process. <identity> is the
+        database_identity of the database whose results are cached"""
+        self.size = size
+        self.directory = directory
+        self.identity = identity
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str, versions: Dict[int, str]) -> (bool, object):
+        """Returns (True, result) if a result for <key> is cached with the given data
+        <versions>, (False, None) otherwise"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        if entry is None and self.directory:
+            try:
+                with open(os.path.join(self.directory, f"{key}.pkl"), "rb") as f:
+                    entry = pickle.load(f)
+            except Exception:
+                entry = None
+            if entry is not None:
+                self.remember(key, entry)
+        if entry is None or entry[0] != versions:
+            return False, None
+        # callers may modify what they get back
+        return True, copy.deepcopy(entry[1])
+
+    def put(self, key: str, versions: Dict[int, str], value):
+        entry = (versions, copy.deepcopy(value))
+        self.remember(key, entry)
+        if self.directory:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(self.directory, f"{key}.pkl")
+                # write to a temporary file first, so no other process reads a partial file
+                temp_file = f"{path}.{os.getpid()}"
+                with open(temp_file, "wb") as f:
+                    pickle.dump(entry, f)
+                os.replace(temp_file, path)
+            except Exception:
+                # caching is only an optimization
+                pass
+        return
+
+    def remember(self, key: str, entry: tuple):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return
+
+    def clear(self):
+        """Forgets all cached results, in memory and on disk"""
+        with self.lock:
+            self.entries.clear()
+        if self.directory and os.path.isdir(self.directory):
+            for f in os.listdir(self.directory):
+                if f.endswith(".pkl"):
+                    try:
+                        os.remove(os.path.join(self.directory, f))
+                    except OSError:
+                        pass
+        return
+
+
+# caches by database (see database_key)
+caches: Dict[str, ResultCache] = dict()
+
+
+def database_key(engine) -> str:
+    return f"{engine.url.host}:{engine.url.port}/{engine.url.database}"
+
+
+def database_identity(engine) -> Optional[str]:
+    """Identifies the database of <engine> as it now exists: unlike its name, the identity
+    changes if the database is dropped and created again. None if it cannot be read."""
+    try:
+        connection = engine.raw_connection()
+    except Exception:
+        return None
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT oid FROM pg_database WHERE datname = current_database()")
+        identity = str(cursor.fetchall()[0][0])
+    except Exception:
+        identity = None
+    cursor.close()
+    connection.close()
+    return identity
+
+
+def configure(engine, size: int = default_cache_size, directory: Optional[str] = None):
+    """Sets up caching of results from the database of <engine>. An existing cache for that
+    database is kept if it has the same <size> and <directory> and the database has not been
+    created again since; otherwise it is replaced. A <size> of 0 turns caching off."""
+    key = database_key(engine)
+    if size <= 0:
+        caches.pop(key, None)
+        return
+    identity = database_identity(engine)
+    cache = caches.get(key)
+    if (
+        cache is None
+        or cache.size != size
+        or cache.directory != directory
+        or cache.identity != identity
+    ):
+        caches[key] = ResultCache(size, directory, identity)
+    return
+
+
+def result_key(engine, name: str, args: dict, identity: Optional[str] = None) -> str:
+    """Key of the result of <name> called with <args> on the database of <engine> (with the
+    given database_identity), the same however the arguments were written (e.g., positionally
+    or by keyword). Results stored on disk for a database of the same name that has since been
+    dropped have other keys."""
+    normalized = json.dumps(
+        [database_key(engine), identity, name, args],
+        sort_keys=True,
+        # e.g., numpy integers
+        default=lambda x: x.item() if hasattr(x, "item") else str(x),
+    )
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def cached(engine, name: str, args: dict, election_ids: List[int], compute: Callable):
+    """Returns the result of <compute>(), the function <name> called with <args> on the database
+    of <engine>, from the cache if it is there and still valid for the data versions of the
+    elections in <election_ids> (0 for the database as a whole). Otherwise computes and caches it."""
+    cache = caches.get(database_key(engine))
+    if cache is None:
+        return compute()
+    versions = db.data_versions(engine, election_ids)
+    if versions is None:
+        # database does not track data versions
+        return compute()
+    key = result_key(engine, name, args, cache.identity)
+    hit, value = cache.get(key, versions)
+    if hit:
+        return value
+    value = compute()
+    cache.put(key, versions, value)
+    return value
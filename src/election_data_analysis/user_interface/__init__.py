@@ -1102,9 +1102,9 @@ def reload_juris_election(
     db_params["dbname"] = temp_db
     db.create_or_reset_db(dbname=temp_db)
 
-    # load all data into temp db
+    # load all data into temp db (which is new, so indexes can wait until the end)
     dl.change_db(temp_db)
-    dl.load_all(move_files=False)
+    dl.load_all(move_files=False, bulk_load=True)
 
     # run test files on temp db
     results = run_tests(
@@ -1130,6 +1130,14 @@ def reload_juris_election(
     election_id = db.name_to_id(dl.session, "Election", election_name)
     juris_id = db.name_to_id(dl.session, "ReportingUnit", juris_name)
 
+    # Remove existing data for juris-election pair from live db
+    #  (before archiving its files, so that archive and db still match if removal fails)
+    err_str = dl.remove_data(election_id, juris_id, (not from_cron))
+    if err_str:
+        print(f"Existing data not removed, new data not loaded: {err_str}")
+        db.remove_database(db_params)
+        return
+
     # Move *.ini and results files for juris-election pair to 'unloaded' directory
     archive_directory = dl.d["archive_dir"]
     if dl.d["unloaded_dir"]:
@@ -1152,9 +1160,6 @@ def reload_juris_election(
             # move the *.ini file and its results file (and any aux_data_directory) to the unloaded directory
             archive_from_param_file(param_file, archive_directory, unloaded_directory)
 
-    # Remove existing data for juris-election pair from live db
-    dl.remove_data(election_id, juris_id, (not from_cron))
-
     # Load new data into live db (and move successful to archive)
     dl.load_all()
 
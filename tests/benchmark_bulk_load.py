@@ -0,0 +1,96 @@
+import sys
+import datetime
+import statistics
+import time
+from typing import Optional
+import election_data_analysis as eda
+from election_data_analysis import user_interface as ui
+from load_and_test_all import io, get_testing_data, close_and_erase
+
+
+def time_load(
+    dbname: str,
+    bulk_load: bool,
+    election_jurisdiction_list: Optional[list],
+    results_dir: str = "TestingData",
+) -> float:
+    """Loads the files in <results_dir> into a new db <dbname>, removes the db and returns the
+    seconds taken by the load"""
+    dl = eda.DataLoader()
+    dl.change_db(dbname)
+    dl.change_dir("results_dir", results_dir)
+    start = time.perf_counter()
+    err, success = dl.load_all(
+        move_files=False,
+        election_jurisdiction_list=election_jurisdiction_list,
+        bulk_load=bulk_load,
+    )
+    elapsed = time.perf_counter() - start
+    if not success:
+        print(f"At least one file did not load correctly into {dbname}.")
+    close_and_erase(dl)
+    return elapsed
+
+
+def run(
+    election_jurisdiction_list: Optional[list] = None,
+    rounds: int = 3,
+    results_dir: Optional[str] = None,
+):
+    """Compares end-to-end load times into new databases with and without bulk-load mode
+    (deferred VoteCount indexes), using the files in <results_dir> (by default, TestingData,
+    fetched if necessary). Each mode is timed <rounds> times, alternating which mode goes first
+    in each round (so neither mode always gets the warmer caches), and the median times are compared."""
+    if results_dir is None:
+        results_dir = "TestingData"
+        get_testing_data(
+            url="https://github.com/ElectionDataAnalysis/TestingData.git",
+            results_dir=results_dir,
+        )
+    if not election_jurisdiction_list:
+        election_jurisdiction_list = ui.election_juris_list(results_dir)
+
+    ts = datetime.datetime.now().strftime("%m%d_%H%M")
+    times = {False: list(), True: list()}
+    for i in range(rounds):
+        order = [False, True] if i % 2 == 0 else [True, False]
+        for bulk_load in order:
+            mode = "bulk" if bulk_load else "std"
+            times[bulk_load].append(
+                time_load(
+                    f"bench_{mode}_{ts}_{i}", bulk_load, election_jurisdiction_list, results_dir
+                )
+            )
+    standard = statistics.median(times[False])
+    bulk = statistics.median(times[True])
+    print(f"Standard load: {standard:.1f} seconds (median; each run: {format_times(times[False])})")
+    print(
+        f"Bulk load (including index rebuild and ANALYZE): {bulk:.1f} seconds "
+        f"(median; each run: {format_times(times[True])})"
+    )
+    print(f"Savings: {standard - bulk:.1f} seconds ({100 * (standard - bulk) / standard:.0f}%)")
+    return
+
+
+def format_times(times: list) -> str:
+    return ", ".join(f"{t:.1f}" for t in times)
+
+
+if __name__ == "__main__":
+    # optional first arguments: number of rounds, then -d <results directory>
+    args = sys.argv[1:]
+    if args and args[0].isdigit():
+        n = int(args.pop(0))
+    else:
+        n = 3
+    if args[:1] == ["-d"] and len(args) > 1:
+        directory = args[1]
+        args = args[2:]
+    else:
+        directory = None
+    if not args:
+        ejs = None
+    else:
+        ejs = io(args)
+    run(election_jurisdiction_list=ejs, rounds=n, results_dir=directory)
+    exit()
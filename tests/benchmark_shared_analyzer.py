@@ -0,0 +1,70 @@
+import os
+import sys
+import statistics
+import time
+from pathlib import Path
+from typing import Optional
+import election_data_analysis as eda
+from election_data_analysis import user_interface as ui
+from load_and_test_all import io
+
+
+def time_test_suite(dbname: str, shared: bool, election_jurisdiction_list: Optional[list]) -> float:
+    """Returns the wall-clock seconds taken by the jurisdiction tests (run by pytest, as in
+    load_and_test_all.py) against <dbname>. If not <shared>, the helper functions called by the tests
+    get a new Analyzer for each call (reading run_time.ini and connecting anew), as before
+    the shared Analyzers existed."""
+    test_dir = Path(__file__).parent.absolute()
+    if shared:
+        os.environ.pop(eda.share_analyzers_variable, None)
+    else:
+        os.environ[eda.share_analyzers_variable] = "0"
+    start = time.perf_counter()
+    result = ui.run_tests(test_dir, dbname, election_jurisdiction_list=election_jurisdiction_list)
+    elapsed = time.perf_counter() - start
+    os.environ.pop(eda.share_analyzers_variable, None)
+    if result != 0:
+        print(f"At least one test failed or did not run (shared Analyzers: {shared}).")
+    return elapsed
+
+
+def run(dbname: str, election_jurisdiction_list: Optional[list] = None, rounds: int = 3):
+    """Compares the wall-clock time taken by the jurisdiction test suite with and without the
+    shared Analyzers. Each mode is timed <rounds> times, alternating which mode goes first in
+    each round, and the median times are compared."""
+    times = {False: list(), True: list()}
+    for i in range(rounds):
+        order = [False, True] if i % 2 == 0 else [True, False]
+        for shared in order:
+            times[shared].append(time_test_suite(dbname, shared, election_jurisdiction_list))
+    fresh = statistics.median(times[False])
+    shared = statistics.median(times[True])
+    print(f"New Analyzer for each call: {fresh:.1f} seconds (median; each run: {format_times(times[False])})")
+    print(f"Shared Analyzer: {shared:.1f} seconds (median; each run: {format_times(times[True])})")
+    print(f"Savings: {fresh - shared:.1f} seconds ({100 * (fresh - shared) / fresh:.0f}%)")
+    return
+
+
+def format_times(times: list) -> str:
+    return ", ".join(f"{t:.1f}" for t in times)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(
+            "Usage: python benchmark_shared_analyzer.py <dbname> [<rounds>] "
+            "[-e <election>] [-j <jurisdiction>]"
+        )
+        exit(2)
+    db_name = sys.argv[1]
+    args = sys.argv[2:]
+    if args and args[0].isdigit():
+        n = int(args.pop(0))
+    else:
+        n = 3
+    if not args:
+        ejs = None
+    else:
+        ejs = io(args)
+    run(db_name, election_jurisdiction_list=ejs, rounds=n)
+    exit()
@@ -1,3 +1,4 @@
+import election_data_analysis as e
 import pytest
 
 
@@ -10,4 +11,62 @@ def pytest_generate_tests(metafunc):
     # if the argument is specified in the list of test "fixturenames".
     option_value = metafunc.config.option.dbname
     if "dbname" in metafunc.fixturenames and option_value is not None:
-        metafunc.parametrize("dbname", [option_value])
+        # module scope, so that module-scoped fixtures (e.g., sample) can use it
+        metafunc.parametrize("dbname", [option_value], scope="module")
+
+
+@pytest.fixture(scope="module")
+def sample(dbname):
+    """engine plus ids and names of an election, its jurisdiction, a datafile and a
+    subdivision type for which the database has vote counts. Uses the Analyzer shared with
+    the helper functions (so its result cache is not reset), disposed after the module's tests."""
+    analyzer = e.get_analyzer(dbname=dbname)
+    if analyzer is None:
+        pytest.skip("Unable to connect to database")
+    engine = analyzer.session.bind
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    cursor.execute(
+        """SELECT d."Election_Id", el."Name", d."ReportingUnit_Id", ru."Name", d."Id"
+        FROM _datafile d
+        JOIN "Election" el ON d."Election_Id" = el."Id"
+        JOIN "ReportingUnit" ru ON d."ReportingUnit_Id" = ru."Id"
+        WHERE EXISTS (SELECT 1 FROM "VoteCount" vc WHERE vc."_datafile_Id" = d."Id")
+        LIMIT 1"""
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        cursor.close()
+        connection.close()
+        e.dispose_analyzers()
+        pytest.skip("No vote counts in database")
+    election_id, election, top_ru_id, top_ru, datafile_id = rows[0]
+    cursor.execute(
+        """SELECT ru."ReportingUnitType_Id", rut."Txt"
+        FROM "ReportingUnit" ru JOIN "ReportingUnitType" rut ON ru."ReportingUnitType_Id" = rut."Id"
+        JOIN "VoteCount" vc ON vc."ReportingUnit_Id" = ru."Id"
+        JOIN "Contest" c ON vc."Contest_Id" = c."Id"
+        WHERE vc."_datafile_Id" = %s AND ru."Id" != %s AND c.contest_type = 'Candidate'
+        LIMIT 1""",
+        [datafile_id, top_ru_id],
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        cursor.close()
+        connection.close()
+        e.dispose_analyzers()
+        pytest.skip("No candidate vote counts below the jurisdiction level")
+    sub_type_id, sub_type = rows[0]
+    cursor.close()
+    connection.close()
+    yield {
+        "engine": engine,
+        "election_id": election_id,
+        "election": election,
+        "top_ru_id": top_ru_id,
+        "top_ru": top_ru,
+        "datafile_id": datafile_id,
+        "sub_type_id": sub_type_id,
+        "sub_type": sub_type,
+    }
+    e.dispose_analyzers()
@@ -92,6 +92,8 @@ def close_and_erase(dl: eda.DataLoader) -> Optional[dict]:
     }
     # point dataloader to default database
     dl.change_db("postgres")
+    # close connections held for the helper functions (e.g., by tests)
+    eda.dispose_analyzers()
     # remove the db
     err = db.remove_database(db_params)
     return err
@@ -158,7 +160,9 @@ def run2(
 
             dl.change_dir("results_dir", "TestingData")
             err, success = dl.load_all(
-                move_files=False, election_jurisdiction_list=election_jurisdiction_list
+                move_files=False,
+                election_jurisdiction_list=election_jurisdiction_list,
+                bulk_load=True,
             )
             if not success:
                 print("At least one file did not load correctly.")
@@ -0,0 +1,64 @@
+import election_data_analysis as e
+import pytest
+
+
+def contest_sample(engine, contest_type: str) -> (str, str, list):
+    """election, jurisdiction and up to 3 (contest, vote type) pairs with vote counts of
+    <contest_type> in a datafile for that election and jurisdiction"""
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    cursor.execute(
+        """SELECT d."Id", el."Name", ru."Name" FROM _datafile d
+        JOIN "Election" el ON d."Election_Id" = el."Id"
+        JOIN "ReportingUnit" ru ON d."ReportingUnit_Id" = ru."Id"
+        WHERE EXISTS (
+            SELECT 1 FROM "VoteCount" vc JOIN "Contest" C ON vc."Contest_Id" = C."Id"
+            WHERE vc."_datafile_Id" = d."Id" AND C.contest_type = %s
+        )
+        LIMIT 1""",
+        [contest_type],
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        cursor.close()
+        connection.close()
+        return None, None, []
+    datafile_id, election, jurisdiction = rows[0]
+    cursor.execute(
+        """SELECT DISTINCT C."Name", cit."Txt" FROM "VoteCount" vc
+        JOIN "Contest" C ON vc."Contest_Id" = C."Id"
+        JOIN "CountItemType" cit ON vc."CountItemType_Id" = cit."Id"
+        WHERE vc."_datafile_Id" = %s AND C.contest_type = %s
+        LIMIT 3""",
+        [datafile_id, contest_type],
+    )
+    pairs = cursor.fetchall()
+    cursor.close()
+    connection.close()
+    return election, jurisdiction, pairs
+
+
+@pytest.mark.parametrize("contest_type", ["Candidate", "BallotMeasure"])
+def test_bulk_totals_match_single_totals(sample, dbname, contest_type):
+    election, jurisdiction, pairs = contest_sample(sample["engine"], contest_type)
+    if not pairs:
+        pytest.skip(f"No {contest_type} vote counts in database")
+    expectations = list()
+    for contest, vote_type in pairs:
+        for vt in [None, vote_type]:
+            total = e.contest_total(
+                election,
+                jurisdiction,
+                contest,
+                dbname=dbname,
+                vote_type=vt,
+                contest_type=contest_type,
+            )
+            expectations.append((contest, None, vt, total))
+    # one nonsense expectation, which should not match
+    expectations.append((pairs[0][0], None, None, -1))
+
+    comparison = e.verify_contest_totals(
+        election, jurisdiction, expectations, dbname=dbname, contest_type=contest_type
+    )
+    assert list(comparison.match) == [True] * (len(expectations) - 1) + [False]
@@ -0,0 +1,244 @@
+import election_data_analysis as e
+from election_data_analysis import database as db
+import pytest
+
+
+def test_change_db_copies_template(dbname, capsys):
+    dl = e.DataLoader()
+    if dl is None:
+        pytest.skip("Unable to create DataLoader")
+    new_db = f"{dbname}_change_db"[:63]
+    db_params = db_params_for(dl, new_db)
+    try:
+        dl.change_db(new_db)
+        out = capsys.readouterr().out
+        # a new db is copied from the template, not built in place
+        assert "from schema definition instead" not in out
+        assert dl.engine.url.database == new_db
+        ok, err = db.test_connection(dbname=new_db)
+        assert ok
+    finally:
+        dl.session.close()
+        dl.engine.dispose()
+        db.remove_database(db_params)
+
+
+# a few precinct results in the format of the nc_gen munger
+nc_results = """County	Election Date	Precinct	Contest Group ID	Contest Type	Contest Name	Choice	Choice Party	Vote For	Election Day	One Stop	Absentee by Mail	Provisional	Total Votes	Real Precinct
+ALAMANCE	11/03/2020	10N	1	S	NC HOUSE OF REPRESENTATIVES DISTRICT 001	David Rogers	DEM	1	198	140	63	130	531	Y
+ALAMANCE	11/03/2020	10N	1	S	NC HOUSE OF REPRESENTATIVES DISTRICT 001	Donna Davis (Write-In)	REP	1	494	4	496	61	1055	Y
+ALAMANCE	11/03/2020	10S	1	S	NC HOUSE OF REPRESENTATIVES DISTRICT 001	David Rogers	DEM	1	21	77	250	9	357	Y
+ALAMANCE	11/03/2020	10S	1	S	NC HOUSE OF REPRESENTATIVES DISTRICT 001	Donna Davis (Write-In)	REP	1	310	112	41	77	540	Y
+"""
+
+nc_ini = """[election_data_analysis]
+results_file=North-Carolina/results_pct_20201103.txt
+jurisdiction_directory=North-Carolina
+munger_name=nc_gen
+top_reporting_unit=North Carolina
+election=2020 General
+results_short_name=nc20g
+results_download_date=2020-11-04
+results_source=test_data_loader.py
+results_note=
+aux_data_dir=
+"""
+
+
+def db_params_for(dl: e.DataLoader, dbname: str) -> dict:
+    return {
+        "host": dl.engine.url.host,
+        "port": dl.engine.url.port,
+        "user": dl.engine.url.username,
+        "password": dl.engine.url.password,
+        "dbname": dbname,
+    }
+
+
+def load_nc_results(dl: e.DataLoader, new_db: str, tmp_path, bulk_load: bool = False):
+    """Loads nc_results into <new_db> with <dl>; returns load_all's error and success flag"""
+    (tmp_path / "North-Carolina").mkdir()
+    (tmp_path / "North-Carolina" / "results_pct_20201103.txt").write_text(
+        nc_results, encoding="iso-8859-1"
+    )
+    (tmp_path / "nc20g.ini").write_text(nc_ini)
+    dl.change_db(new_db)
+    dl.change_dir("results_dir", str(tmp_path))
+    return dl.load_all(move_files=False, bulk_load=bulk_load)
+
+
+def test_bulk_load_into_partitioned_db(dbname, tmp_path):
+    new_db = f"{dbname}_partitioned"[:63]
+    err = db.create_or_reset_db(dbname=new_db, vote_count_partitioning="election")
+    assert not err
+    dl = e.DataLoader()
+    if dl is None:
+        pytest.skip("Unable to create DataLoader")
+    db_params = db_params_for(dl, new_db)
+    try:
+        err, success = load_nc_results(dl, new_db, tmp_path, bulk_load=True)
+        assert success, err
+        with dl.engine.connect() as con:
+            # the rebuilt indexes on VoteCount must cover the election's partition
+            invalid = con.execute(
+                """SELECT i.indexrelid::regclass::text FROM pg_index i
+                WHERE i.indrelid = '"VoteCount"'::regclass AND NOT i.indisvalid"""
+            ).fetchall()
+            assert invalid == []
+            parent, partition = con.execute(
+                """SELECT
+                    (SELECT count(*) FROM pg_index WHERE indrelid = '"VoteCount"'::regclass),
+                    (SELECT count(*) FROM pg_index i JOIN pg_inherits inh ON inh.inhrelid = i.indrelid
+                    WHERE inh.inhparent = '"VoteCount"'::regclass
+                        AND i.indrelid <> '"VoteCount_default"'::regclass)"""
+            ).fetchone()
+            assert partition == parent
+            count = con.execute('SELECT sum("Count") FROM "VoteCount"').scalar()
+            assert count > 0
+    finally:
+        dl.session.close()
+        dl.engine.dispose()
+        db.remove_database(db_params)
+
+
+@pytest.mark.parametrize("partitioning", ["election", "election_and_datafile"])
+def test_partition_created_after_rows_in_default(dbname, tmp_path, partitioning):
+    new_db = f"{dbname}_partitioned"[:63]
+    err = db.create_or_reset_db(dbname=new_db, vote_count_partitioning=partitioning)
+    assert not err
+    dl = e.DataLoader()
+    if dl is None:
+        pytest.skip("Unable to create DataLoader")
+    db_params = db_params_for(dl, new_db)
+    try:
+        err, success = load_nc_results(dl, new_db, tmp_path)
+        assert success, err
+        engine = dl.engine
+        election_id = db.name_to_id(dl.session, "Election", "2020 General")
+        partition = db.vote_count_partition_name(election_id)
+        with engine.connect() as con:
+            datafile_id, count = con.execute(
+                f"""SELECT min("_datafile_Id"), sum("Count") FROM "VoteCount"
+                WHERE "Election_Id" = {election_id}"""
+            ).fetchone()
+            # put the election's vote counts into the default partition, as if they had been
+            #  loaded while the election's partition was missing
+            con.execute(
+                f"""CREATE TEMP TABLE vc AS SELECT * FROM "{partition}";
+                DROP TABLE "{partition}";
+                INSERT INTO "VoteCount" SELECT * FROM vc;
+                DROP TABLE vc"""
+            )
+            assert con.execute('SELECT sum("Count") FROM "VoteCount_default"').scalar() == count
+
+        err = db.ensure_vote_count_partition(engine, election_id, datafile_id)
+        assert err is None
+        with engine.connect() as con:
+            assert con.execute(f'SELECT sum("Count") FROM "{partition}"').scalar() == count
+            assert con.execute('SELECT count(*) FROM "VoteCount_default"').scalar() == 0
+            if partitioning == "election_and_datafile":
+                datafile_partition = db.vote_count_partition_name(election_id, datafile_id)
+                assert (
+                    con.execute(f'SELECT sum("Count") FROM "{datafile_partition}"').scalar()
+                    == count
+                )
+    finally:
+        dl.session.close()
+        dl.engine.dispose()
+        db.remove_database(db_params)
+
+
+def test_path_change_invalidates_derived_data(dbname, tmp_path):
+    new_db = f"{dbname}_paths"[:63]
+    dl = e.DataLoader()
+    if dl is None:
+        pytest.skip("Unable to create DataLoader")
+    db_params = db_params_for(dl, new_db)
+    try:
+        err, success = load_nc_results(dl, new_db, tmp_path)
+        assert success, err
+        engine = dl.engine
+        election_id = db.name_to_id(dl.session, "Election", "2020 General")
+        top_ru_id = db.name_to_id(dl.session, "ReportingUnit", "North Carolina")
+        county_id = db.name_to_id(dl.session, "ReportingUnitType", "county")
+        # save a slice of candidate vote counts
+        db.get_candidate_votecounts(dl.session, election_id, top_ru_id, county_id)
+        versions = db.data_versions(engine, [election_id])
+        with engine.connect() as con:
+            assert con.execute("SELECT count(*) FROM _vote_count_rollup_status").scalar() > 0
+            assert con.execute("SELECT count(*) FROM _candidate_votecounts_status").scalar() > 0
+
+        # move a precinct out of its county
+        precinct_id = db.name_to_id(
+            dl.session, "ReportingUnit", "North Carolina;Alamance County;10N"
+        )
+        db.set_reporting_unit_hierarchy(engine, {precinct_id: (2, [top_ru_id, precinct_id])})
+        with engine.connect() as con:
+            assert con.execute("SELECT count(*) FROM _vote_count_rollup_status").scalar() == 0
+            assert con.execute("SELECT count(*) FROM _candidate_votecounts_status").scalar() == 0
+        new_versions = db.data_versions(engine, [0, election_id])
+        assert new_versions[election_id] != versions[election_id]
+        assert new_versions[0]
+    finally:
+        dl.session.close()
+        dl.engine.dispose()
+        db.remove_database(db_params)
+
+
+def test_slim_vote_count_is_explicit(dbname, tmp_path, capsys):
+    new_db = f"{dbname}_slim"[:63]
+    dl = e.DataLoader()
+    if dl is None:
+        pytest.skip("Unable to create DataLoader")
+    db_params = db_params_for(dl, new_db)
+    try:
+        err, success = load_nc_results(dl, new_db, tmp_path)
+        assert success, err
+        engine = dl.engine
+        # give VoteCount the layout of databases created before OtherCountItemType_Id
+        with engine.begin() as con:
+            con.execute(
+                """ALTER TABLE "VoteCount" DROP CONSTRAINT vc_ux0,
+                    ADD COLUMN "OtherCountItemType" varchar;
+                UPDATE "VoteCount" vc SET "OtherCountItemType" = NULLIF(o."Txt", '')
+                    FROM "OtherCountItemType" o WHERE vc."OtherCountItemType_Id" = o."Id";
+                UPDATE "VoteCount" SET "OtherCountItemType" = 'overseas'
+                    WHERE "Id" IN (SELECT min("Id") FROM "VoteCount");
+                ALTER TABLE "VoteCount" DROP COLUMN "OtherCountItemType_Id",
+                    ADD CONSTRAINT vc_ux0 UNIQUE ("_datafile_Id", "Election_Id", "Contest_Id",
+                        "Selection_Id", "CountItemType_Id", "ReportingUnit_Id", "OtherCountItemType")"""
+            )
+            expected = con.execute(
+                """SELECT "Id", COALESCE("OtherCountItemType", '') FROM "VoteCount" ORDER BY "Id" """
+            ).fetchall()
+        assert "overseas" in [t for (i, t) in expected]
+
+        # connecting does not convert VoteCount, but says how to
+        errs = db.upgrade_database(engine)
+        assert any("DataLoader.slim_vote_count" in x for x in errs)
+        with engine.connect() as con:
+            assert not db.vote_count_is_slim(con.connection.cursor())
+
+        capsys.readouterr()
+        assert dl.slim_vote_count() is None
+        assert "MB after" in capsys.readouterr().out
+        with engine.connect() as con:
+            assert db.vote_count_is_slim(con.connection.cursor())
+            actual = con.execute(
+                """SELECT vc."Id", o."Txt" FROM "VoteCount" vc
+                JOIN "OtherCountItemType" o ON vc."OtherCountItemType_Id" = o."Id"
+                ORDER BY vc."Id" """
+            ).fetchall()
+            unique_columns = con.execute(
+                """SELECT pg_get_constraintdef(oid) FROM pg_constraint
+                WHERE conname = 'vc_ux0' AND conrelid = '"VoteCount"'::regclass"""
+            ).scalar()
+        assert actual == expected
+        assert "OtherCountItemType_Id" in unique_columns
+        assert db.upgrade_database(engine) == []
+        assert dl.slim_vote_count() is None
+        assert "needed no conversion" in capsys.readouterr().out
+    finally:
+        dl.session.close()
+        dl.engine.dispose()
+        db.remove_database(db_params)
@@ -0,0 +1,164 @@
+import os
+from pathlib import Path
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import pytest
+from election_data_analysis import munge as m
+from election_data_analysis import juris_and_munger as jm
+
+# these tests need no database
+
+mungers_dir = Path(__file__).absolute().parents[1] / "src" / "mungers"
+
+count_cols = ["Election Day", "One Stop", "Absentee by Mail", "Provisional"]
+
+
+def old_clean_count_cols(df: pd.DataFrame, cols: list) -> (pd.DataFrame, pd.DataFrame):
+    """clean_count_cols as it was before the count columns were coerced in one block"""
+    err_df = pd.DataFrame()
+    working = df.copy()
+    for c in cols:
+        if c in working.columns:
+            mask = working[c] != pd.to_numeric(working[c], errors="coerce")
+            if mask.any():
+                err_df = pd.concat([err_df, working[mask]]).drop_duplicates()
+                working[c] = (
+                    pd.to_numeric(working[c], errors="coerce").fillna(0).astype("int64")
+                )
+            else:
+                working[c] = working[c].astype("int64")
+    return working, err_df
+
+
+def results(rows: list) -> pd.DataFrame:
+    return pd.DataFrame(
+        rows,
+        columns=["County", "Precinct", "Real Precinct", "Contest Name", "Choice", "Choice Party"]
+        + count_cols,
+    )
+
+
+@pytest.fixture
+def raw():
+    return results(
+        [
+            ["ALAMANCE", "10N", "Y", "US SENATE", "Cal Cunningham", "DEM", 198, 140, 63, 130],
+            ["ALAMANCE", "10N", "Y", "US SENATE", "Thom Tillis", "REP", 494, 4, 496, 61],
+            ["ALAMANCE", "10S", "Y", "US SENATE", "Cal Cunningham", "DEM", 21, 77, 250, 9],
+            ["ALAMANCE", "10S", "Y", "US SENATE", "Thom Tillis", "REP", 310, 112, 41, 77],
+            ["ALAMANCE", "ABSENTEE", "N", "US SENATE", "Thom Tillis", "REP", 5, 6, 7, 8],
+        ]
+    )
+
+
+@pytest.mark.parametrize(
+    "bad",
+    [
+        # all numeric
+        {},
+        # non-numeric values in one column
+        {(1, "One Stop"): "n/a", (3, "One Stop"): "*"},
+        # non-numeric values in several columns, some in the same row
+        {(0, "Election Day"): "", (0, "Provisional"): None, (4, "Absentee by Mail"): "x"},
+    ],
+)
+def test_clean_count_cols_matches_old_loop(raw, bad):
+    df = raw.astype({c: object for c in count_cols})
+    for (i, c), v in bad.items():
+        df.loc[i, c] = v
+    new, new_err = m.clean_count_cols(df, count_cols)
+    old, old_err = old_clean_count_cols(df, count_cols)
+    pd.testing.assert_frame_equal(new, old)
+    assert all(new[c].dtype == np.int64 for c in count_cols)
+    # the same rows are reported (the old loop could report a row once per bad column)
+    assert set(new_err.index) == set(old_err.index) == {i for (i, c) in bad}
+    # with their original values
+    for (i, c), v in bad.items():
+        assert new_err.loc[[i], c].iloc[0] is v or new_err.loc[[i], c].iloc[0] == v
+
+
+def test_clean_count_cols_without_count_columns(raw):
+    new, err_df = m.clean_count_cols(raw, ["not a column"])
+    pd.testing.assert_frame_equal(new, raw)
+    assert err_df.empty
+
+
+def juris_with_dictionary(tmp_path, rows: list) -> SimpleNamespace:
+    """Stands in for a Jurisdiction whose dictionary.txt holds <rows>"""
+    pd.DataFrame(
+        rows, columns=["cdf_element", "cdf_internal_name", "raw_identifier_value"]
+    ).to_csv(os.path.join(tmp_path, "dictionary.txt"), sep="\t", index=False)
+    return SimpleNamespace(path_to_juris_dir=str(tmp_path))
+
+
+def test_extraneous_raw_identifiers(tmp_path):
+    juris = juris_with_dictionary(
+        tmp_path,
+        [
+            ["ReportingUnit", "row should be dropped", "ALAMANCE;ABSENTEE - N"],
+            ["ReportingUnit", "North Carolina;Alamance County;10N", "ALAMANCE;10N - Y"],
+            ["CountItemType", "row should be dropped", "Provisional"],
+            ["CountItemType", "row should be dropped", "One Stop"],
+        ],
+    )
+    assert m.extraneous_raw_identifiers(juris) == {
+        "ReportingUnit": {"ALAMANCE;ABSENTEE - N"},
+        "CountItemType": {"Provisional", "One Stop"},
+    }
+
+
+def melted_without_extraneous(mu, juris, raw: pd.DataFrame) -> pd.DataFrame:
+    """munge_and_melt without pruning, then dropping the extraneous rows, as was done before
+    they were pruned ahead of the melt"""
+    melted, err = m.munge_and_melt(mu, raw, count_cols, None)
+    assert not err
+    for element, values in m.extraneous_raw_identifiers(juris).items():
+        melted = melted[~melted[f"{element}_raw"].isin(values)]
+    return melted.reset_index(drop=True)
+
+
+def test_prune_extraneous_matches_dropping_after_melt(raw, tmp_path):
+    mu = jm.Munger(str(mungers_dir / "nc_gen"))
+    juris = juris_with_dictionary(
+        tmp_path,
+        [
+            ["ReportingUnit", "row should be dropped", "ALAMANCE;ABSENTEE - N"],
+            ["CountItemType", "row should be dropped", "Provisional"],
+        ],
+    )
+    pruned, pruned_cols = m.prune_extraneous(mu, juris, raw, count_cols)
+    assert pruned_cols == ["Election Day", "One Stop", "Absentee by Mail"]
+    assert "Provisional" not in pruned.columns
+    assert list(pruned["Precinct"]) == ["10N", "10N", "10S", "10S"]
+
+    melted, err = m.munge_and_melt(mu, raw, count_cols, None, juris=juris)
+    assert not err
+    pd.testing.assert_frame_equal(
+        melted.reset_index(drop=True), melted_without_extraneous(mu, juris, raw)
+    )
+
+
+def test_prune_extraneous_with_formula_on_missing_column(raw, tmp_path):
+    mu = jm.Munger(str(mungers_dir / "nc_gen"))
+    juris = juris_with_dictionary(
+        tmp_path,
+        [["ReportingUnit", "row should be dropped", "ALAMANCE;ABSENTEE - N"]],
+    )
+    # the ReportingUnit formula refers to <Real Precinct>, which is not in the file:
+    #  nothing is pruned, and the error is left for the melt to report
+    no_real_precinct = raw.drop(columns="Real Precinct")
+    pruned, pruned_cols = m.prune_extraneous(mu, juris, no_real_precinct, count_cols)
+    pd.testing.assert_frame_equal(pruned, no_real_precinct)
+    assert pruned_cols == count_cols
+
+
+def test_prune_extraneous_keeps_all_columns_if_all_would_be_dropped(raw, tmp_path):
+    mu = jm.Munger(str(mungers_dir / "nc_gen"))
+    juris = juris_with_dictionary(
+        tmp_path,
+        [["CountItemType", "row should be dropped", c] for c in count_cols],
+    )
+    pruned, pruned_cols = m.prune_extraneous(mu, juris, raw, count_cols)
+    pd.testing.assert_frame_equal(pruned, raw)
+    assert pruned_cols == count_cols
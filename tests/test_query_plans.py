@@ -0,0 +1,209 @@
+from election_data_analysis import database as db
+from election_data_analysis.database import create_cdf_db as db_cdf
+from psycopg2 import sql
+import pytest
+
+# Regression check for the VoteCount indices: on a loaded (e.g., benchmark) database with
+# several elections, none of the hot read queries should need a sequential scan of VoteCount,
+# and each should read VoteCount through one of the covering indices, filtering on Election_Id.
+# (With a single election every query reads the whole table, so no index is needed.)
+# Queries are captured as the db functions issue them, then EXPLAINed.
+
+
+class RecordingCursor:
+    """passes everything through to <cursor>, noting each query and its variables"""
+
+    def __init__(self, cursor, queries: list):
+        self.cursor = cursor
+        self.queries = queries
+
+    def execute(self, q, str_vars=None):
+        self.queries.append((q, str_vars))
+        return self.cursor.execute(q, str_vars)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class RecordingSession:
+    """stands in for a session in functions that only use session.bind.raw_connection()"""
+
+    def __init__(self, engine, queries: list):
+        self.bind = self
+        self.engine = engine
+        self.queries = queries
+
+    def raw_connection(self):
+        return RecordingConnection(self.engine.raw_connection(), self.queries)
+
+
+class RecordingConnection:
+    def __init__(self, connection, queries: list):
+        self.connection = connection
+        self.queries = queries
+
+    def cursor(self):
+        return RecordingCursor(self.connection.cursor(), self.queries)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+def plan_nodes(cursor, q, str_vars=None) -> list:
+    """Returns all nodes (as dictionaries from EXPLAIN (FORMAT JSON)) of the plan for query <q>
+    when the planner is told to avoid sequential scans. Does not run the query itself."""
+    cursor.execute("SAVEPOINT explain_check")
+    try:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        if isinstance(q, str):
+            q = sql.SQL(q)
+        cursor.execute(sql.SQL("EXPLAIN (FORMAT JSON) ") + q, str_vars)
+        plan = cursor.fetchall()[0][0]
+    finally:
+        cursor.execute("ROLLBACK TO SAVEPOINT explain_check")
+
+    all_nodes = list()
+    nodes = [p["Plan"] for p in plan]
+    while nodes:
+        node = nodes.pop()
+        all_nodes.append(node)
+        nodes.extend(node.get("Plans", []))
+    return all_nodes
+
+
+def sequential_scans(cursor, q, str_vars=None) -> list:
+    """Returns the list of tables (or partitions) that the plan for query <q> reads by
+    sequential scan even when the planner is told to avoid them -- i.e., the tables for which
+    no index serves the query. Does not run the query itself."""
+    return [
+        node["Relation Name"]
+        for node in plan_nodes(cursor, q, str_vars)
+        if node.get("Node Type") == "Seq Scan"
+    ]
+
+
+def index_scans(cursor, q, str_vars=None) -> list:
+    """Returns a pair (index, index condition) for each index scan or index-only scan in the plan
+    for query <q> (see plan_nodes). An index on a partition is reported by the name of the index
+    on the partitioned table it belongs to. Does not run the query itself."""
+    scans = [
+        (node["Index Name"], node.get("Index Cond", ""))
+        for node in plan_nodes(cursor, q, str_vars)
+        if node.get("Node Type") in ["Index Scan", "Index Only Scan"]
+    ]
+    q_root = """WITH RECURSIVE up(idx) AS (
+            SELECT to_regclass(%s)
+            UNION SELECT inh.inhparent FROM pg_inherits inh JOIN up ON inh.inhrelid = up.idx
+        )
+        SELECT up.idx::regclass::text FROM up
+        WHERE NOT EXISTS (SELECT 1 FROM pg_inherits inh WHERE inh.inhrelid = up.idx)"""
+    root_scans = list()
+    for index, cond in scans:
+        cursor.execute(q_root, [sql.Identifier(index).as_string(cursor)])
+        rows = cursor.fetchall()
+        root = rows[0][0].strip('"') if rows else index
+        root_scans.append((root, cond))
+    return root_scans
+
+
+def vote_count_seq_scans(engine, queries: list) -> list:
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    scanned = list()
+    for q, str_vars in queries:
+        scanned.extend(
+            [t for t in sequential_scans(cursor, q, str_vars) if t.startswith("VoteCount")]
+        )
+    connection.rollback()
+    cursor.close()
+    connection.close()
+    return scanned
+
+
+def uses_cover_index(engine, queries: list) -> bool:
+    """True if the plan for each query reading VoteCount scans a VoteCount covering index
+    by Election_Id"""
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    ok = all(
+        any(
+            index in db_cdf.vote_count_covering_indexes and "Election_Id" in cond
+            for index, cond in index_scans(cursor, q, str_vars)
+        )
+        for q, str_vars in queries
+        if any(
+            node.get("Relation Name", "").startswith("VoteCount")
+            for node in plan_nodes(cursor, q, str_vars)
+        )
+    )
+    connection.rollback()
+    cursor.close()
+    connection.close()
+    return ok
+
+
+def test_export_rollup_plan(sample):
+    # the prepared statement can't be EXPLAINed from another connection, so check its query
+    connection = sample["engine"].raw_connection()
+    cursor = connection.cursor()
+    parameters = db.rollup_parameter_values(
+        cursor,
+        sample["top_ru_id"],
+        sample["election_id"],
+        sample["sub_type_id"],
+        [sample["datafile_id"]],
+        True,
+        None,
+    )
+    cursor.close()
+    connection.close()
+    q = db.rollup_query("Candidate", by_vote_type=True, use_rollup=False)
+    assert vote_count_seq_scans(sample["engine"], [(q, parameters)]) == []
+    assert uses_cover_index(sample["engine"], [(q, parameters)])
+
+
+def test_active_vote_types_plan(sample):
+    queries = list()
+    connection = sample["engine"].raw_connection()
+    cursor = RecordingCursor(connection.cursor(), queries)
+    db.active_vote_types_from_ids(
+        cursor, election_id=sample["election_id"], jurisdiction_id=sample["top_ru_id"]
+    )
+    cursor.close()
+    connection.close()
+    assert vote_count_seq_scans(sample["engine"], queries) == []
+    assert uses_cover_index(sample["engine"], queries)
+
+
+def test_candidate_votecounts_plan(sample):
+    queries = list()
+    db.get_candidate_votecounts(
+        RecordingSession(sample["engine"], queries),
+        sample["election_id"],
+        sample["top_ru_id"],
+        sample["sub_type_id"],
+        use_materialized=False,
+    )
+    assert vote_count_seq_scans(sample["engine"], queries) == []
+    assert uses_cover_index(sample["engine"], queries)
+
+
+def test_materialized_candidate_votecounts(sample):
+    session = RecordingSession(sample["engine"], list())
+    args = [sample["election_id"], sample["top_ru_id"], sample["sub_type_id"]]
+    direct = db.get_candidate_votecounts(session, *args, use_materialized=False)
+    saved = db.get_candidate_votecounts(session, *args)
+    assert sorted(saved["VoteCount_Id"]) == sorted(direct["VoteCount_Id"])
+
+
+def test_read_vote_count_plan(sample):
+    queries = list()
+    db.read_vote_count(
+        RecordingSession(sample["engine"], queries),
+        sample["election_id"],
+        sample["top_ru_id"],
+        ["Contest_Id", "Selection_Id", "CountItemType_Id"],
+        ["contest_id", "selection_id", "count_item_type_id"],
+    )
+    assert vote_count_seq_scans(sample["engine"], queries) == []
+    assert uses_cover_index(sample["engine"], queries)
@@ -0,0 +1,72 @@
+from election_data_analysis import database as db
+from election_data_analysis import result_cache as rc
+
+
+def test_versions_must_match():
+    cache = rc.ResultCache(size=2)
+    cache.put("a", {1: "v1"}, [1, 2])
+    assert cache.get("a", {1: "v1"}) == (True, [1, 2])
+    assert cache.get("a", {1: "v2"}) == (False, None)
+
+
+def test_least_recently_used_dropped():
+    cache = rc.ResultCache(size=2)
+    cache.put("a", {}, 1)
+    cache.put("b", {}, 2)
+    cache.get("a", {})
+    cache.put("c", {}, 3)
+    assert cache.get("a", {}) == (True, 1)
+    assert cache.get("b", {}) == (False, None)
+
+
+def test_callers_get_copies():
+    cache = rc.ResultCache()
+    cache.put("a", {}, [1])
+    hit, value = cache.get("a", {})
+    value.append(2)
+    assert cache.get("a", {}) == (True, [1])
+
+
+def test_disk_cache_survives(tmp_path):
+    rc.ResultCache(directory=str(tmp_path)).put("a", {0: "v"}, "result")
+    assert rc.ResultCache(directory=str(tmp_path)).get("a", {0: "v"}) == (True, "result")
+
+
+def test_data_change_invalidates(sample):
+    engine = sample["engine"]
+    rc.configure(engine)
+    calls = list()
+
+    def compute():
+        calls.append(1)
+        return len(calls)
+
+    args = {"election_id": sample["election_id"]}
+    assert rc.cached(engine, "test", args, [sample["election_id"]], compute) == 1
+    assert rc.cached(engine, "test", args, [sample["election_id"]], compute) == 1
+    assert not db.record_data_change(engine, [sample["election_id"]])
+    assert rc.cached(engine, "test", args, [sample["election_id"]], compute) == 2
+
+
+def test_configure_keeps_cache(sample):
+    engine = sample["engine"]
+    rc.configure(engine)
+    cache = rc.caches[rc.database_key(engine)]
+    cache.put("a", {}, 1)
+    # e.g., another Analyzer for the same database
+    rc.configure(engine)
+    assert rc.caches[rc.database_key(engine)] is cache
+    assert cache.get("a", {}) == (True, 1)
+    rc.configure(engine, size=rc.default_cache_size + 1)
+    assert rc.caches[rc.database_key(engine)] is not cache
+    rc.configure(engine)
+
+
+def test_keys_depend_on_database_identity(sample):
+    engine = sample["engine"]
+    identity = rc.database_identity(engine)
+    assert identity
+    # a database dropped and created again under the same name has another identity
+    assert rc.result_key(engine, "test", {}, identity) != rc.result_key(
+        engine, "test", {}, "another"
+    )
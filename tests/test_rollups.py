@@ -0,0 +1,154 @@
+import io
+from sqlalchemy.orm import Session
+from election_data_analysis import analyze as an
+from election_data_analysis import database as db
+import pandas as pd
+
+# Rollups exported in different ways from the same database should agree.
+
+
+def rollup_args(sample) -> dict:
+    return {
+        "top_ru": sample["top_ru"],
+        "election": sample["election"],
+        "sub_unit_type": sample["sub_type"],
+        "contest_type": "Candidate",
+        "datafile_list": [sample["datafile_id"]],
+        "by": "Id",
+        "by_vote_type": True,
+    }
+
+
+def test_streamed_rollup_matches_dataframe(sample):
+    connection = sample["engine"].raw_connection()
+    cursor = connection.cursor()
+    df, err_str = db.export_rollup_from_db(cursor, **rollup_args(sample))
+    assert not err_str
+    out = io.StringIO()
+    err_str = db.export_rollup_to_file(
+        cursor,
+        out,
+        sample["top_ru_id"],
+        sample["election_id"],
+        sample["sub_type_id"],
+        "Candidate",
+        [sample["datafile_id"]],
+        by_vote_type=True,
+    )
+    cursor.close()
+    connection.close()
+    assert not err_str
+    out.seek(0)
+    streamed = pd.read_csv(out, sep="\t")
+    assert list(streamed.columns) == db.rollup_columns
+    assert len(streamed) == len(df)
+    assert streamed["count"].sum() == df["count"].sum()
+
+
+def test_prepared_rollup_is_reused(sample):
+    connection = sample["engine"].raw_connection()
+    cursor = connection.cursor()
+    first, err_str = db.export_rollup_from_db(cursor, **rollup_args(sample))
+    assert not err_str
+    second, err_str = db.export_rollup_from_db(cursor, **rollup_args(sample))
+    assert not err_str
+    cursor.execute("SELECT COUNT(*) FROM pg_prepared_statements WHERE name LIKE 'rollup_%%'")
+    n_prepared = cursor.fetchall()[0][0]
+    cursor.close()
+    connection.close()
+    assert first.equals(second)
+    assert n_prepared == 1
+
+
+def test_multilevel_rollup_matches_single_level(sample):
+    connection = sample["engine"].raw_connection()
+    cursor = connection.cursor()
+    single = dict()
+    for b in [False, True]:
+        out = io.StringIO()
+        err_str = db.export_rollup_to_file(
+            cursor,
+            out,
+            sample["top_ru_id"],
+            sample["election_id"],
+            sample["sub_type_id"],
+            "Candidate",
+            [sample["datafile_id"]],
+            by_vote_type=b,
+        )
+        assert not err_str
+        out.seek(0)
+        single[b] = pd.read_csv(out, sep="\t")
+    level_outs = {(sample["sub_type_id"], b): io.StringIO() for b in [False, True]}
+    long_out = io.StringIO()
+    err_str = db.export_multilevel_rollup(
+        cursor,
+        sample["top_ru_id"],
+        sample["election_id"],
+        [sample["sub_type_id"]],
+        "Candidate",
+        [sample["datafile_id"]],
+        by_vote_type=[False, True],
+        long_out=long_out,
+        level_outs=level_outs,
+    )
+    cursor.close()
+    connection.close()
+    assert not err_str
+    for (sub_type_id, b), out in level_outs.items():
+        out.seek(0)
+        multi = pd.read_csv(out, sep="\t")
+        assert list(multi.columns) == db.rollup_columns
+        assert multi.equals(single[b])
+    long_out.seek(0)
+    long_df = pd.read_csv(long_out, sep="\t")
+    assert len(long_df) == len(single[False]) + len(single[True])
+
+
+def test_multilevel_rollup_files_and_connection(sample, tmp_path):
+    engine = sample["engine"]
+    session = Session(bind=engine)
+    checked_out = engine.pool.checkedout()
+    # an unknown datafile stops the export early
+    err_str = an.create_multilevel_rollup(
+        session,
+        str(tmp_path),
+        sample["top_ru_id"],
+        [sample["sub_type_id"]],
+        sample["election_id"],
+        datafile_list=[-1],
+    )
+    assert err_str
+    assert engine.pool.checkedout() == checked_out
+    err_str = an.create_multilevel_rollup(
+        session,
+        str(tmp_path),
+        sample["top_ru_id"],
+        [sample["sub_type_id"]],
+        sample["election_id"],
+        datafile_list=[sample["datafile_id"]],
+    )
+    session.close()
+    assert not err_str
+    assert engine.pool.checkedout() == checked_out
+    leaf_dir = tmp_path / sample["election"] / sample["top_ru"] / f"by_{sample['sub_type']}"
+    assert len(list(leaf_dir.glob("*_Candidate_results.txt"))) == 1
+
+
+def test_multilevel_rollup_reports_both_contest_types(sample, tmp_path, monkeypatch):
+    def failing_export(cursor, top_ru_id, election_id, sub_types, contest_type, *args, **kwargs):
+        return f"Unable to export {contest_type} results"
+
+    monkeypatch.setattr(an.db, "export_multilevel_rollup", failing_export)
+    session = Session(bind=sample["engine"])
+    err_str = an.create_multilevel_rollup(
+        session,
+        str(tmp_path),
+        sample["top_ru_id"],
+        [sample["sub_type_id"]],
+        sample["election_id"],
+        datafile_list=[sample["datafile_id"]],
+    )
+    session.close()
+    assert "Unable to export BallotMeasure results" in err_str
+    assert "Unable to export Candidate results" in err_str